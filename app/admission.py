@@ -0,0 +1,292 @@
+import os
+import threading
+import time
+from collections import Counter, deque
+
+# What to do with a file once HIGH_WATER_MARK files are already waiting:
+# "block" the caller until there is room, "spill" it to the on-disk journal
+# or "drop" it and count it.
+OVERFLOW_POLICIES = ("block", "spill", "drop")
+
+HIGH_WATER_MARK = 10000
+WAIT_SAMPLES = 1000
+
+# Size lanes, so a few huge files cannot hold every worker while small ones wait:
+# (name, largest file size in bytes or None, share of the workers it may use, priority).
+# A path goes to the first lane its size (at admission) fits in; a free worker takes
+# the oldest path of the lane with the lowest priority number that is under its share.
+# The shares of "medium" and "large" add up to less than 1, so a worker is always left
+# for small files.
+SIZE_LANES = (
+    ("small", 1024 * 1024, 1.0, 0),
+    ("medium", 64 * 1024 * 1024, 0.6, 1),
+    ("large", None, 0.2, 2),
+)
+
+
+class SpillJournal:
+    """
+    Append-only file of paths that did not fit in memory, read back in order along
+    with the time they were spilled.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.count = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                self.count = sum(1 for _ in file)
+
+    def append(self, path):
+        with open(self.path, 'a') as file:
+            file.write(f"{time.time()}\t{path}\n")
+        self.count += 1
+
+    def drain_to(self, path):
+        """
+        Appends the entries left in the journal to the file at ``path`` and empties the journal.
+        """
+        with open(self.path, 'r') as file, open(path, 'a') as target:
+            file.seek(self.offset)
+            for line in file:
+                target.write(line)
+        open(self.path, 'w').close()
+        self.offset = 0
+        self.count = 0
+
+    def pop(self, limit):
+        """
+        Returns up to ``limit`` of the oldest (path, spill time) entries and removes
+        them from the journal.
+        """
+        entries = []
+        with open(self.path, 'r') as file:
+            file.seek(self.offset)
+            while len(entries) < limit:
+                line = file.readline()
+                if not line:
+                    break
+                spilled_at, path = line.rstrip("\n").split("\t", 1)
+                entries.append((path, float(spilled_at)))
+            self.offset = file.tell()
+
+        self.count -= len(entries)
+        if self.count <= 0:
+            # Everything was read back, start over with an empty file
+            open(self.path, 'w').close()
+            self.offset = 0
+            self.count = 0
+        return entries
+
+
+class AdmissionQueue:
+    """
+    Bounded queue between the event handlers and the worker pool.
+
+    At most ``workers`` jobs are handed to the executor at a time, so its own
+    unbounded queue stays empty; everything else waits here. Once ``high_water``
+    paths are waiting, new ones are handled according to ``policy``.
+
+    :param dispatch: Called with a path to start its job; must return a Future.
+    :param workers: Number of jobs running at once, the size of the worker pool.
+    :param high_water: Number of paths waiting in memory before ``policy`` applies.
+    :param policy: One of OVERFLOW_POLICIES.
+    :param spill_path: Journal file used by the "spill" policy. The paths a previous run
+                       left in it are set aside and offered again by ``start``.
+    :param lanes: Size lanes, see SIZE_LANES.
+    """
+
+    def __init__(self, dispatch, workers, high_water=HIGH_WATER_MARK, policy="block", spill_path=None,
+                 lanes=SIZE_LANES):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        if policy == "spill" and not spill_path:
+            raise ValueError("The spill policy needs a spill_path")
+
+        self.dispatch = dispatch
+        self.workers = workers
+        self.high_water = high_water
+        self.policy = policy
+        self.spill = SpillJournal(spill_path) if policy == "spill" else None
+        self.counters = Counter()
+        self.lanes = list(lanes)
+        # Lanes in priority order, with the most jobs each may run at once
+        self._lanes_by_priority = [name for name, _, _, _ in sorted(lanes, key=lambda lane: lane[3])]
+        self.lane_limits = {name: max(1, int(workers * share)) for name, _, share, _ in lanes}
+        self._condition = threading.Condition()
+        self._pending = {name: deque() for name, _, _, _ in lanes}
+        self._depth = 0
+        self._running = 0
+        self._lane_running = Counter()
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        # Per lane: seconds waiting, and from admission to the end of the job
+        self._lane_waits = {name: deque(maxlen=WAIT_SAMPLES) for name, _, _, _ in lanes}
+        self._lane_latencies = {name: deque(maxlen=WAIT_SAMPLES) for name, _, _, _ in lanes}
+        # Jobs left to start by the _start call running on this thread, if any
+        self._local = threading.local()
+
+        # Paths spilled by a previous run, moved out of the spill journal so they are not
+        # dispatched before start claims them again
+        self.replay_path = spill_path + ".replay" if self.spill else None
+        if self.spill and self.spill.count:
+            self.spill.drain_to(self.replay_path)
+
+    def start(self, replay):
+        """
+        Offers the paths spilled by a previous run again, through ``replay`` (e.g.
+        FileEventRegistry.ready, so they are claimed and deduplicated like any other
+        path). To be called once everything ``dispatch`` needs is set up.
+        """
+        if not self.replay_path or not os.path.exists(self.replay_path):
+            return
+        with open(self.replay_path, 'r') as file:
+            for line in file:
+                try:
+                    _, path = line.rstrip("\n").split("\t", 1)
+                except ValueError:
+                    # Line cut short by a crash
+                    continue
+                self.counters["replayed"] += 1
+                replay(path)
+        os.remove(self.replay_path)
+
+    def offer(self, path, size=None):
+        """
+        Admits ``path`` for processing. Returns False if it was dropped.
+        :param size: Size of the file, read from the file if not given.
+        """
+        enqueued = time.monotonic()
+        lane = self.lane_of(path, size)
+        with self._condition:
+            if self._depth >= self.high_water or (self.spill and self.spill.count):
+                if self.policy == "drop":
+                    self.counters["dropped"] += 1
+                    return False
+                if self.policy == "spill":
+                    # Once something is spilled, newer paths queue behind it on disk
+                    self.spill.append(path)
+                    self.counters["spilled"] += 1
+                    return True
+                self.counters["blocked"] += 1
+                while self._depth >= self.high_water:
+                    self._condition.wait()
+                self.counters["blocked_seconds"] += time.monotonic() - enqueued
+
+            self.counters["admitted"] += 1
+            self._pending[lane].append((path, enqueued))
+            self._depth += 1
+            jobs = self._next_jobs()
+
+        self._start(jobs)
+        return True
+
+    def lane_of(self, path, size=None):
+        """
+        Returns the name of the size lane of ``path``. A file gone missing counts as empty.
+        """
+        if size is None:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+        for name, max_size, _, _ in self.lanes:
+            if max_size is None or size <= max_size:
+                return name
+        return self.lanes[-1][0]
+
+    def stats(self):
+        """
+        Returns the queue depth, the running jobs, the counters and the wait time
+        percentiles (in seconds) of the most recent jobs, overall and per lane. The
+        lanes also have the percentiles of their latency, from admission to the end of
+        the job.
+        """
+        with self._condition:
+            waits = sorted(self._waits)
+            stats = {
+                "depth": self._depth,
+                "spilled_depth": self.spill.count if self.spill else 0,
+                "running": self._running,
+                "counters": dict(self.counters),
+                "lanes": {},
+            }
+            for name, _, _, _ in self.lanes:
+                lane = stats["lanes"][name] = {"depth": len(self._pending[name]), "running": self._lane_running[name]}
+                lane.update(_percentiles("wait", self._lane_waits[name]))
+                lane.update(_percentiles("latency", self._lane_latencies[name]))
+        stats.update(_percentiles("wait", waits))
+        return stats
+
+    def _next_jobs(self):
+        # Called with the lock held: refills from the spill journal and picks the
+        # paths that can start now.
+        if self.spill and self.spill.count and self._depth < self.high_water:
+            # Spill times are wall clock, convert them to the monotonic clock
+            offset = time.monotonic() - time.time()
+            for path, spilled_at in self.spill.pop(self.high_water - self._depth):
+                self._pending[self.lane_of(path)].append((path, spilled_at + offset))
+                self._depth += 1
+
+        jobs = []
+        while self._depth and self._running < self.workers:
+            lane = next((name for name in self._lanes_by_priority
+                         if self._pending[name] and self._lane_running[name] < self.lane_limits[name]), None)
+            if lane is None:
+                # Only lanes at their limit have paths waiting
+                break
+            path, enqueued = self._pending[lane].popleft()
+            self._depth -= 1
+            wait = time.monotonic() - enqueued
+            self._waits.append(wait)
+            self._lane_waits[lane].append(wait)
+            self._running += 1
+            self._lane_running[lane] += 1
+            jobs.append((path, lane, enqueued))
+        if jobs:
+            self._condition.notify_all()
+        return jobs
+
+    def _start(self, jobs):
+        if getattr(self._local, "jobs", None) is not None:
+            # Called by the done callback of a future that was already done, run inline
+            # by add_done_callback below: the loop below starts these jobs, so a run of
+            # jobs finishing at once does not grow the stack.
+            self._local.jobs.extend(jobs)
+            return
+        self._local.jobs = deque(jobs)
+        try:
+            while self._local.jobs:
+                path, lane, enqueued = self._local.jobs.popleft()
+                try:
+                    future = self.dispatch(path)
+                except Exception:
+                    # Executor shut down, this job and the ones after it are not running
+                    with self._condition:
+                        for not_started in [lane] + [lane for _, lane, _ in self._local.jobs]:
+                            self._running -= 1
+                            self._lane_running[not_started] -= 1
+                    raise
+                future.add_done_callback(lambda future, lane=lane, enqueued=enqueued: self._finished(lane, enqueued))
+        finally:
+            self._local.jobs = None
+
+    def _finished(self, lane, enqueued):
+        with self._condition:
+            self._running -= 1
+            self._lane_running[lane] -= 1
+            self._lane_latencies[lane].append(time.monotonic() - enqueued)
+            jobs = self._next_jobs()
+        self._start(jobs)
+
+
+def _percentiles(name, samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    return {
+        f"{name}_p50": samples[len(samples) // 2],
+        f"{name}_p99": samples[min(len(samples) - 1, len(samples) * 99 // 100)],
+        f"{name}_max": samples[-1],
+    }
@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+BATCH_MAX_FILES = 100
+BATCH_MAX_BYTES = 64 * 1024 * 1024
+BATCH_MAX_DELAY = 0.5
+
+
+class Batcher:
+    """
+    Collects paths into batches. A batch is flushed once it holds ``max_files`` paths,
+    ``max_bytes`` bytes of file content, or its oldest path waited ``max_delay`` seconds.
+
+    :param flush: Called with the list of paths of a batch; must return a Future.
+    :param max_files: Maximum number of paths in a batch.
+    :param max_bytes: Maximum total size of the files of a batch.
+    :param max_delay: Maximum seconds a path waits for its batch to fill up.
+    """
+
+    def __init__(self, flush, max_files=BATCH_MAX_FILES, max_bytes=BATCH_MAX_BYTES, max_delay=BATCH_MAX_DELAY):
+        self.flush = flush
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self._condition = threading.Condition()
+        self._paths = []
+        self._futures = []
+        self._bytes = 0
+        self._deadline = None
+        threading.Thread(target=self._run, name="batch-flush", daemon=True).start()
+
+    def add(self, path):
+        """
+        Adds ``path`` to the current batch.
+        :return: Future completed when the batch holding the path is done.
+        """
+        future = Future()
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+
+        with self._condition:
+            if not self._paths:
+                self._deadline = time.monotonic() + self.max_delay
+                self._condition.notify()
+            self._paths.append(path)
+            self._futures.append(future)
+            self._bytes += size
+            batch = self._take() if len(self._paths) >= self.max_files or self._bytes >= self.max_bytes else None
+
+        if batch:
+            self._flush(*batch)
+        return future
+
+    def _take(self):
+        batch = self._paths, self._futures
+        self._paths = []
+        self._futures = []
+        self._bytes = 0
+        self._deadline = None
+        return batch
+
+    def _flush(self, paths, futures):
+        try:
+            job = self.flush(paths)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        def done(job):
+            for future in futures:
+                if job.exception() is None:
+                    future.set_result(job.result())
+                else:
+                    future.set_exception(job.exception())
+
+        job.add_done_callback(done)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._deadline is None:
+                    self._condition.wait()
+                delay = self._deadline - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                batch = self._take()
+            self._flush(*batch)
@@ -0,0 +1,94 @@
+import os
+import zlib
+import pyzipper
+
+# Compression method name -> (pyzipper compression type, compresslevel).
+COMPRESSION_METHODS = {
+    "store": (pyzipper.ZIP_STORED, None),
+    "fast": (pyzipper.ZIP_DEFLATED, 1),
+    "deflate": (pyzipper.ZIP_DEFLATED, 6),
+    "max": (pyzipper.ZIP_DEFLATED, 9),
+    "bzip2": (pyzipper.ZIP_BZIP2, 9),
+    "lzma": (pyzipper.ZIP_LZMA, None),
+}
+
+# Files up to this size are stored, the zip headers outweigh anything compression saves.
+SMALL_FILE_BYTES = 256
+# Files from this size on get the fast deflate level, so zip latency stays bounded.
+LARGE_FILE_BYTES = 16 * 1024 * 1024
+# Bytes at the start of the file compressed to estimate how well it compresses.
+SAMPLE_BYTES = 1024
+# Sample ratio (compressed / original) from which a file counts as already dense and is stored.
+INCOMPRESSIBLE_RATIO = 0.9
+# Sample ratio up to which a file that is not large gets the method in DENSE_METHOD.
+COMPRESSIBLE_RATIO = 0.3
+DENSE_METHOD = "max"
+
+
+class CompressionPolicy:
+    """
+    Chooses how each file is compressed in a zip.
+
+    With ``mode`` "adaptive" the method depends on the file size and on how well its
+    first SAMPLE_BYTES compress; any other mode is one of COMPRESSION_METHODS used
+    for every file.
+
+    :param mode: "adaptive" or a key of COMPRESSION_METHODS.
+    :param dense_method: Method used for small, highly compressible files in adaptive mode.
+    """
+
+    def __init__(self, mode="adaptive", small=SMALL_FILE_BYTES, large=LARGE_FILE_BYTES,
+                 incompressible=INCOMPRESSIBLE_RATIO, compressible=COMPRESSIBLE_RATIO, dense_method=DENSE_METHOD):
+        for method in (mode, dense_method):
+            if method != "adaptive" and method not in COMPRESSION_METHODS:
+                raise ValueError(f"Unknown compression method: {method}")
+        self.mode = mode
+        self.small = small
+        self.large = large
+        self.incompressible = incompressible
+        self.compressible = compressible
+        self.dense_method = dense_method
+
+    def choose(self, file_path):
+        """
+        Returns the name of the compression method for the file.
+        """
+        if self.mode != "adaptive":
+            return self.mode
+
+        size = os.path.getsize(file_path)
+        if size <= self.small:
+            return "store"
+
+        ratio = sample_ratio(file_path)
+        if ratio >= self.incompressible:
+            return "store"
+        if size >= self.large:
+            return "fast"
+        if ratio <= self.compressible:
+            return self.dense_method
+        return "deflate"
+
+    def write(self, zipf, file_path, arcname):
+        """
+        Writes the file into the open zip with the chosen method.
+        :return: (method name, compressed size / original size).
+        """
+        method = self.choose(file_path)
+        compress_type, compresslevel = COMPRESSION_METHODS[method]
+        zipf.write(file_path, arcname, compress_type=compress_type, compresslevel=compresslevel)
+
+        info = zipf.getinfo(arcname)
+        return method, info.compress_size / info.file_size if info.file_size else 1.0
+
+
+def sample_ratio(file_path, sample_size=SAMPLE_BYTES):
+    """
+    Compresses the first ``sample_size`` bytes of the file with the fastest deflate level.
+    :return: Compressed size / original size of the sample, 1.0 for an empty file.
+    """
+    with open(file_path, 'rb') as file:
+        sample = file.read(sample_size)
+    if not sample:
+        return 1.0
+    return len(zlib.compress(sample, 1)) / len(sample)
@@ -0,0 +1,205 @@
+import os
+import heapq
+import threading
+import time
+from collections import Counter, OrderedDict
+
+DEBOUNCE_SECONDS = 0.2
+PROCESSED_HISTORY = 10000
+
+
+def file_signature(path):
+    """
+    Returns the (size, mtime) signature of a file, or None if it no longer exists.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class FileEventRegistry:
+    """
+    Turns the watchdog events of a folder into exactly one job per file version.
+
+    Events for a path are debounced: the path is dispatched once no new event for it
+    arrived and its (size, mtime) signature stayed the same for ``debounce`` seconds,
+    or as soon as ``ready`` is called for it (e.g. on a close-write event). It is then
+    skipped if a job for it is still in flight, or if it was already processed with
+    the same signature. Suppressed events are counted per reason in ``suppressed``.
+
+    :param dispatch: Called with the path of every file that should be processed. It may
+                     return False if the path was not accepted, so a later event retries it.
+    :param debounce: Debounce window in seconds, 0 dispatches on the first event.
+    :param history: Number of processed signatures remembered in memory.
+    :param journal: Optional ProcessedJournal persisting processed signatures across restarts.
+    :param logger: Optional logger for the errors of debounced dispatches, which are also
+                   counted in ``dispatch_errors``.
+    """
+
+    def __init__(self, dispatch, debounce=DEBOUNCE_SECONDS, history=PROCESSED_HISTORY, journal=None, logger=None):
+        self.dispatch = dispatch
+        self.debounce = debounce
+        self.history = history
+        self.journal = journal
+        self.logger = logger
+        self.suppressed = Counter()
+        self.dispatch_errors = 0
+        self._condition = threading.Condition()
+        self._due = {}
+        self._pending_signatures = {}
+        self._heap = []
+        self._in_flight = {}
+        self._processed = OrderedDict()
+
+        if debounce > 0:
+            threading.Thread(target=self._run, name="event-debounce", daemon=True).start()
+
+    def observe(self, path):
+        """
+        Records an event for ``path``.
+        """
+        if self.debounce <= 0:
+            self._claim_and_dispatch(path)
+            return
+
+        signature = file_signature(path)
+        with self._condition:
+            if path in self._due:
+                self.suppressed["debounced"] += 1
+            self._pending_signatures[path] = signature
+            self._schedule(path)
+
+    def ready(self, path):
+        """
+        Dispatches ``path`` right away, without waiting for the debounce window.
+        :return: True if the path was dispatched and accepted.
+        """
+        with self._condition:
+            if self._due.pop(path, None) is not None:
+                self._pending_signatures.pop(path, None)
+        return self._claim_and_dispatch(path)
+
+    def claim(self, path):
+        """
+        Marks ``path`` as in flight. Returns False if it is missing, already in flight
+        or was already processed in its current version.
+        """
+        signature = file_signature(path)
+        with self._condition:
+            reason = self._suppression(path, signature)
+            if reason is None:
+                self._in_flight[path] = signature
+                return True
+
+            self.suppressed[reason] += 1
+            return False
+
+    def handled(self, path):
+        """
+        Returns True if ``path`` needs no new job: it is missing, in flight or was
+        already processed in its current version. Tells a path ``ready`` suppressed
+        from one the dispatch did not accept.
+        """
+        signature = file_signature(path)
+        with self._condition:
+            return self._suppression(path, signature) is not None
+
+    def release(self, path, processed=True, removed=False):
+        """
+        Marks the job for ``path`` as finished, successful or not. Later events for the
+        same file version are suppressed.
+        :param processed: False if the job never ran, so the next event retries it.
+        :param removed: True if the job removed (or moved) the file, which the journal
+                        then forgets instead of recording.
+        """
+        with self._condition:
+            signature = self._in_flight.pop(path, None)
+            if signature is None or not processed:
+                return
+            self._processed[path] = signature
+            self._processed.move_to_end(path)
+            while len(self._processed) > self.history:
+                self._processed.popitem(last=False)
+        if self.journal is None:
+            return
+        if removed:
+            self.journal.forget(path)
+        else:
+            self.journal.record(path, signature)
+
+    def stats(self):
+        """
+        Returns the suppressed event counters along with the dispatch errors and the
+        pending and in flight counts.
+        """
+        with self._condition:
+            return {
+                "suppressed": dict(self.suppressed),
+                "dispatch_errors": self.dispatch_errors,
+                "pending": len(self._due),
+                "in_flight": len(self._in_flight),
+            }
+
+    def _suppression(self, path, signature):
+        # Called with the lock held: the reason to suppress a job for ``path``, or None
+        if signature is None:
+            return "missing"
+        if path in self._in_flight:
+            return "in_flight"
+        if self._processed.get(path) == signature or (self.journal is not None and self.journal.contains(path, signature)):
+            return "processed"
+        return None
+
+    def _schedule(self, path):
+        due = time.monotonic() + self.debounce
+        self._due[path] = due
+        heapq.heappush(self._heap, (due, path))
+        self._condition.notify()
+
+    def _claim_and_dispatch(self, path):
+        if not self.claim(path):
+            return False
+        try:
+            accepted = self.dispatch(path)
+        except Exception:
+            self.release(path, processed=False)
+            raise
+        if accepted is False:
+            self.release(path, processed=False)
+            return False
+        return True
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                due, path = self._heap[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                # Stale heap entry, a later event pushed the path back
+                if self._due.get(path) != due:
+                    continue
+
+                # Still being written without events (or by a slow writer), wait again
+                signature = file_signature(path)
+                if signature is not None and signature != self._pending_signatures[path]:
+                    self._pending_signatures[path] = signature
+                    self._schedule(path)
+                    continue
+                del self._due[path]
+                del self._pending_signatures[path]
+
+            try:
+                self._claim_and_dispatch(path)
+            except Exception as e:
+                # The path was released, a later event for it will retry
+                with self._condition:
+                    self.dispatch_errors += 1
+                if self.logger:
+                    self.logger.error(f"Error dispatching {path}: {str(e)}", stack_info=True, exc_info=True)
@@ -0,0 +1,106 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Bounds of the cache: entries, and characters of filtered text held.
+CACHE_MAX_ENTRIES = 1024
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Larger members are streamed through the filter and never cached.
+CACHE_MAX_ITEM_BYTES = 1024 * 1024
+
+
+def content_key(data, version):
+    """
+    Returns the cache key of the decrypted bytes ``data`` filtered by the rule set ``version``.
+    """
+    digest = hashlib.blake2b(data, digest_size=16)
+    digest.update(version.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class FilterCache:
+    """
+    LRU cache of PII filtered text, keyed by content_key, so identical payloads arriving
+    under different names are filtered once.
+    :param folder: Optional folder the entries are also written to. They are loaded back
+                   on startup, and process pool workers sharing the folder see each
+                   other's entries.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES,
+                 max_item_bytes=CACHE_MAX_ITEM_BYTES, folder=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.size = 0
+
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+            # Oldest first, so the most recently written entries are kept
+            paths = [entry.path for entry in os.scandir(folder) if entry.name.endswith(".txt")]
+            for path in sorted(paths, key=os.path.getmtime):
+                with open(path, 'r', newline='') as file:
+                    self.put(os.path.basename(path)[:-len(".txt")], file.read(), persist=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Returns the filtered text cached under ``key``, or None.
+        """
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+                return text
+        if not self.folder:
+            return None
+        try:
+            with open(self._path(key), 'r', newline='') as file:
+                text = file.read()
+        except FileNotFoundError:
+            return None
+        self.put(key, text, persist=False)
+        return text
+
+    def put(self, key, text, persist=True):
+        """
+        Caches ``text`` under ``key``, evicting the least recently used entries past the bounds.
+        """
+        if len(text) > self.max_item_bytes:
+            return
+        evicted = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = text
+            self.size += len(text)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                evicted_key, evicted_text = self._entries.popitem(last=False)
+                self.size -= len(evicted_text)
+                evicted.append(evicted_key)
+
+        if self.folder:
+            if persist:
+                tmp_path = self._path(key) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'w', newline='') as file:
+                    file.write(text)
+                os.replace(tmp_path, self._path(key))
+            for evicted_key in evicted:
+                try:
+                    os.remove(self._path(evicted_key))
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "size": self.size}
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.txt")
@@ -2,90 +2,362 @@ import time
 import pyzipper
 import os
 import sys
+import threading
 import pathlib
-from watchdog.observers import Observer
+import io
+import json
 from watchdog.events import FileSystemEventHandler
 from concurrent.futures import ThreadPoolExecutor
-from utils import logger_setup
+from utils import logger_setup, write_heartbeat
+from watcher import FolderWatcher
+from event_registry import FileEventRegistry
+from admission import AdmissionQueue, HIGH_WATER_MARK
+from journal import ProcessedJournal, scan_backlog, catch_up
+from batcher import Batcher
+from compression import CompressionPolicy
+from handoff import HandoffClient, HANDOFF_MAX_BYTES
+from metrics import MetricsServer, metrics_port, STAGE_SECONDS, FILES, BYTES, register_queue_gauges
 
 WORKER_TREAD_COUNT = 5
 
+# Seconds the size and mtime of a .txt file must stay unchanged before it is zipped.
+# A close-write event (inotify IN_CLOSE_WRITE) marks the file ready right away.
+SETTLE_SECONDS = 1.0
+
+# Files waiting for a worker before QUEUE_OVERFLOW_POLICY ("block", "spill" or "drop") applies.
+QUEUE_HIGH_WATER_MARK = HIGH_WATER_MARK
+QUEUE_OVERFLOW_POLICY = "block"
+SPILL_FILE = "state/folder_monitor.spill"
+
+# Processed .txt files, used to find the ones that arrived while the monitor was down.
+JOURNAL_FILE = "state/folder_monitor.journal"
+
+# Opt-in: zip many .txt files into one archive, see batcher.Batcher for the limits.
+BATCH_MODE = False
+
+# How the .txt files are compressed: "adaptive" picks a method per file from its size
+# and a compressibility sample, see compression.py. One of compression.COMPRESSION_METHODS
+# ("store", "fast", "deflate", "max", "bzip2", "lzma") forces that method for every file.
+COMPRESSION_POLICY = "adaptive"
+
+# Opt-in: pass every zip straight to todecode_monitor over a Unix socket instead of
+# waiting for its watcher. The zip is still written to disk as the durable copy.
+HANDOFF_MODE = False
+
+# Watch the subfolders of the input folders too.
+WATCH_RECURSIVE = False
+
+# Optional list of extra folders to watch, as {"folder": "...", "recursive": true,
+# "output": "..."} objects; "recursive" defaults to WATCH_RECURSIVE and "output" to the
+# todecode folder.
+WATCH_FILE = "config/watch.json"
+# Environment variable overriding WATCH_FILE, empty for none. Set by manage_monitor_app.py
+# so only the first pipeline watches the extra folders.
+WATCH_FILE_ENV = "MONITOR_WATCH_FILE"
+
+# Seconds between two checks for inotify watches that stopped, e.g. because the watch
+# limit was reached while adding a new subfolder, which are then polled instead.
+WATCH_CHECK_INTERVAL = 10
+
+# Seconds between two logs of the event and queue stats.
+STATS_LOG_INTERVAL = 60
+
 logger = logger_setup('logs/folder_monitor.log')
 
 
 class TxtFileHandler(FileSystemEventHandler):
     """
     Handler for detecting new .txt files and creating a password-protected zip file.
+    :param routes: (input folder, output folder) pairs. The zips of the files in an input
+                   folder or its subfolders go to its output folder, the others to
+                   ``output_folder``.
     """
 
-    def __init__(self, output_folder, executor):
+    def __init__(self, output_folder, executor, settle=SETTLE_SECONDS, workers=WORKER_TREAD_COUNT,
+                 queue_size=QUEUE_HIGH_WATER_MARK, overflow=QUEUE_OVERFLOW_POLICY, journal=None, batch=BATCH_MODE,
+                 compression=COMPRESSION_POLICY, handoff=HANDOFF_MODE, routes=()):
         super().__init__()
         self.output_folder = output_folder
+        # Deepest folders first, so a subfolder routed elsewhere wins over its parent
+        self.routes = sorted(((os.path.abspath(folder), output) for folder, output in routes),
+                             key=lambda route: len(route[0]), reverse=True)
         self.executor = executor
+        self.handoff = HandoffClient() if handoff else None
+        self.compression = CompressionPolicy(compression)
+        self.batcher = Batcher(self.submit_batch) if batch else None
+        if self.batcher:
+            # Files of a batch count against the queue while the batch fills up
+            workers *= self.batcher.max_files
+        self.admission = AdmissionQueue(self.submit, workers, queue_size, overflow, SPILL_FILE)
+        # Waits for each file to be completely written and coalesces its events into one job
+        self.events = FileEventRegistry(self.admission.offer, settle, journal=journal, logger=logger)
+
+        self.zip_seconds = STAGE_SECONDS.labels(stage="zip")
+        self.detect_to_zip_seconds = STAGE_SECONDS.labels(stage="detect_to_zip")
+        self.zipped_files = FILES.labels(stage="zip", outcome="ok")
+        self.failed_files = FILES.labels(stage="zip", outcome="failed")
+        self.zipped_bytes = BYTES.labels(stage="zip")
+        register_queue_gauges("txt", self)
+        # Last, as the files spilled by a previous run are dispatched right away
+        self.admission.start(self.events.ready)
 
     def on_created(self, event):
         if event.src_path.endswith(".txt"):
             logger.info(f"New txt file detected: {event.src_path}")
-            self.executor.submit(self.process_files, event.src_path)
+            self.events.observe(event.src_path)
+
+    def on_modified(self, event):
+        if event.src_path.endswith(".txt"):
+            self.events.observe(event.src_path)
+
+    def on_closed(self, event):
+        if event.src_path.endswith(".txt"):
+            self.events.ready(event.src_path)
+
+    def submit(self, file_path):
+        if self.batcher:
+            return self.batcher.add(file_path)
+        return self.executor.submit(self.process_files, file_path)
+
+    def submit_batch(self, file_paths):
+        return self.executor.submit(self.process_batch, file_paths)
 
     def process_files(self, file_path):
+        started = time.perf_counter()
+        zipped = False
         try:
+            stats = [os.stat(file_path)]
             self.create_zip(file_path)
+            zipped = True
+            self.record_zipped(stats, started)
         except Exception as e:
+            self.failed_files.inc()
             logger.error(f"Error creating zip file for {file_path}: {str(e)}", stack_info=True, exc_info=True)
+        finally:
+            # A file not zipped is not recorded as processed, so a later event or the
+            # next catch-up scan retries it
+            self.events.release(file_path, processed=zipped)
+
+    def process_batch(self, file_paths):
+        """
+        Zips the files of a batch, one zip per output folder. A file that is gone or
+        cannot be read is left out instead of failing the whole batch.
+        """
+        started = time.perf_counter()
+        zipped = set()
+        try:
+            stats = {}
+            for file_path in file_paths:
+                try:
+                    stat = os.stat(file_path)
+                    with open(file_path, 'rb'):
+                        pass
+                    stats[file_path] = stat
+                except OSError as e:
+                    self.failed_files.inc()
+                    logger.error(f"Leaving {file_path} out of its batch zip: {str(e)}", stack_info=True, exc_info=True)
+
+            routed = {}
+            for file_path in stats:
+                routed.setdefault(self.output_for(file_path), []).append(file_path)
+            for routed_paths in routed.values():
+                try:
+                    self.create_batch_zip(routed_paths)
+                except Exception as e:
+                    self.failed_files.inc(len(routed_paths))
+                    logger.error(f"Error creating batch zip file for {len(routed_paths)} files: {str(e)}",
+                                 stack_info=True, exc_info=True)
+                    continue
+                zipped.update(routed_paths)
+            if zipped:
+                self.record_zipped([stats[file_path] for file_path in zipped], started)
+        finally:
+            # The files not zipped are not recorded as processed, so they are retried
+            for file_path in file_paths:
+                self.events.release(file_path, processed=file_path in zipped)
+
+    def record_zipped(self, stats, started):
+        """
+        Records the zip time and, per file, the time from its last write to its zip.
+        :param stats: os.stat results of the zipped files, taken before zipping.
+        """
+        self.zip_seconds.observe(time.perf_counter() - started)
+        now = time.time()
+        for stat in stats:
+            self.detect_to_zip_seconds.observe(now - stat.st_mtime)
+            self.zipped_bytes.inc(stat.st_size)
+        self.zipped_files.inc(len(stats))
+
+    def output_for(self, file_path):
+        """
+        Returns the output folder of the zip of ``file_path``.
+        """
+        file_path = os.path.abspath(file_path)
+        for folder, output in self.routes:
+            if file_path.startswith(folder + os.sep):
+                return output
+        return self.output_folder
+
+    def member_name(self, file_path):
+        """
+        Returns the name of ``file_path`` in its zip, which the zip is also named after:
+        its journal key with the folder separators replaced by "__". Files directly in the
+        first watched folder keep their file name; files of subfolders and other folders
+        get their folders in the name, so same-named files never share a zip or output name.
+        """
+        if self.events.journal is None:
+            return os.path.basename(file_path)
+        name = os.path.splitdrive(self.events.journal.key(file_path))[1]
+        return "__".join(part for part in name.split(os.sep) if part)
 
     def create_zip(self, file_path):
         """
         Creates a zip file for the given text file with password protection.
         The password is the UTC epoch time.
         """
+        txt_file_name = self.member_name(file_path).replace(".txt", "")
+        return self.write_zip(txt_file_name, [file_path])
+
+    def create_batch_zip(self, file_paths):
+        """
+        Creates one password-protected zip file holding all the given text files,
+        named after the first one and the number of files.
+        """
+        txt_file_name = self.member_name(file_paths[0]).replace(".txt", "")
+        return self.write_zip(f"batch_{len(file_paths)}_{txt_file_name}", file_paths)
+
+    def write_zip(self, name, file_paths):
+        """
+        Writes the text files into ``<name>_<timestamp>.zip`` in the output folder of the
+        first one, with the UTC epoch time of the timestamp as password.
+        """
         epoch_time = int(time.time())
-        txt_file_name = os.path.basename(file_path).replace(".txt", "")
-        zip_name = f"{txt_file_name}_{time.strftime('%Y_%m_%d_%I_%M_%S_%p', time.gmtime())}.zip"
-    
-        zip_tmp_path = os.path.join(self.output_folder, zip_name + ".tmp")  
+        zip_name = f"{name}_{time.strftime('%Y_%m_%d_%I_%M_%S_%p', time.gmtime(epoch_time))}.zip"
+        output_folder = self.output_for(file_paths[0])
+
+        zip_tmp_path = os.path.join(output_folder, zip_name + ".tmp")
 
-        with pyzipper.AESZipFile(zip_tmp_path, 'w', compression=pyzipper.ZIP_DEFLATED, encryption=pyzipper.WZ_AES) as zipf:
+        # Small enough zips are built in memory so the hand-off can pass their bytes along
+        buffer = None
+        if self.handoff and sum(os.path.getsize(file_path) for file_path in file_paths) <= HANDOFF_MAX_BYTES:
+            buffer = io.BytesIO()
+
+        with pyzipper.AESZipFile(buffer if buffer is not None else zip_tmp_path, 'w', compression=pyzipper.ZIP_DEFLATED, encryption=pyzipper.WZ_AES) as zipf:
             zipf.setpassword(bytes(str(epoch_time), 'utf-8'))
-            zipf.write(file_path, os.path.basename(file_path))
-        
-        zip_final_path = os.path.join(self.output_folder, zip_name)
+            for file_path in file_paths:
+                method, ratio = self.compression.write(zipf, file_path, self.member_name(file_path))
+                logger.info(f"Compressed {file_path} with {method}, ratio {ratio:.2f}")
+
+        if buffer is not None:
+            with open(zip_tmp_path, 'wb') as file:
+                file.write(buffer.getbuffer())
+
+        zip_final_path = os.path.join(output_folder, zip_name)
         os.rename(zip_tmp_path, zip_final_path)
         logger.info(f"Created zip file: {zip_final_path}")
 
+        if self.handoff and self.handoff.send(zip_final_path, buffer.getvalue() if buffer is not None else b""):
+            return zip_final_path
+
         # Manually trigger a file creation event by updating the modification time
-        pathlib.Path(zip_final_path).touch()  
+        pathlib.Path(zip_final_path).touch()
+        return zip_final_path
 
 
-def start_folder_monitor(input_folder):
+def catch_up_backlog(event_handler, folder, recursive=False):
+    """
+    Queues the .txt files that arrived in the folder while the monitor was down.
+    """
+    try:
+        backlog = scan_backlog(folder, ".txt", event_handler.events.journal, seed=True, recursive=recursive)
+        logger.info(f"Catch-up scan found {len(backlog)} unprocessed txt files in {folder}")
+        for queued in catch_up(backlog, event_handler.events.ready):
+            logger.info(f"Catch-up queued {queued}/{len(backlog)} txt files")
+    except Exception as e:
+        logger.error(f"Error in catch-up scan of {folder}: {str(e)}", stack_info=True, exc_info=True)
+
+
+def load_watches(input_folders, recursive=WATCH_RECURSIVE, output_folder="todecode", path=None):
+    """
+    Returns the (folder, recursive, output folder) of every folder to watch: the input
+    folders, then the ones of the watch file if it exists.
+    :param input_folders: A folder or a list of folders.
+    :param path: The watch file, see WATCH_FILE and WATCH_FILE_ENV.
+    """
+    if path is None:
+        path = os.environ.get(WATCH_FILE_ENV, WATCH_FILE)
+    if isinstance(input_folders, str):
+        input_folders = [input_folders]
+    watches = [(folder, recursive, output_folder) for folder in input_folders]
+    if path and os.path.exists(path):
+        with open(path, 'r') as file:
+            for watch in json.load(file):
+                watches.append((watch["folder"], watch.get("recursive", recursive), watch.get("output", output_folder)))
+    return watches
+
+
+def start_folder_monitor(input_folders, recursive=WATCH_RECURSIVE):
     """
     Starts the folder monitor service to detect new .txt files and zip them.
-    :param input_folder: The folder to monitor for new .txt files.
+    All folders share one observer and one worker pool.
+    :param input_folders: The folder, or list of folders, to monitor for new .txt files.
+    :param recursive: Monitor their subfolders too.
     """
     output_folder = "todecode"  
-    os.makedirs(output_folder, exist_ok=True)
+    watches = load_watches(input_folders, recursive, output_folder)
+    for _, _, output in watches:
+        os.makedirs(output, exist_ok=True)
+
+    # Files directly in the first folder keep their name as journal key, as with a single folder
+    journal = ProcessedJournal(JOURNAL_FILE, base_folder=watches[0][0])
 
     with ThreadPoolExecutor(max_workers=WORKER_TREAD_COUNT) as executor:
-        event_handler = TxtFileHandler(output_folder, executor)
-        observer = Observer()
-        observer.schedule(event_handler, input_folder, recursive=False)
-        observer.start()
+        event_handler = TxtFileHandler(output_folder, executor, journal=journal,
+                                       routes=[(folder, output) for folder, _, output in watches if output != output_folder])
+        watcher = FolderWatcher(logger=logger)
+        for folder, watch_recursive, _ in watches:
+            watcher.add(event_handler, folder, recursive=watch_recursive)
+        watcher.start()
+
+        logger.info(f"Folder monitor started. Monitoring {len(watches)} folders: {watcher.stats()}")
+
+        try:
+            MetricsServer(metrics_port("folder_monitor")).start()
+        except OSError as e:
+            logger.error(f"Metrics endpoint not started: {str(e)}", stack_info=True, exc_info=True)
 
-        logger.info(f"Folder monitor started. Monitoring folder: {input_folder}")
+        # The watcher is already running, so nothing arriving during the scan is missed
+        def catch_up_all():
+            for folder, watch_recursive, _ in watches:
+                catch_up_backlog(event_handler, folder, watch_recursive)
+        threading.Thread(target=catch_up_all, daemon=True).start()
 
         try:
+            last_stats_log = last_watch_check = time.monotonic()
             while True:
                 time.sleep(1)
+                # No heartbeat once the watcher died, so service_monitor restarts the service
+                if watcher.is_alive():
+                    write_heartbeat("folder_monitor")
+                if time.monotonic() - last_watch_check >= WATCH_CHECK_INTERVAL:
+                    watcher.check()
+                    last_watch_check = time.monotonic()
+                if time.monotonic() - last_stats_log >= STATS_LOG_INTERVAL:
+                    logger.info(f"Txt event stats: {event_handler.events.stats()}")
+                    logger.info(f"Txt queue stats: {event_handler.admission.stats()}")
+                    logger.info(f"Watch stats: {watcher.stats()}")
+                    last_stats_log = time.monotonic()
         except Exception as e:
             logger.error(f"Error in Folder Monitor: {str(e)}", stack_info=True, exc_info=True)
-            observer.stop()
+            watcher.stop()
 
-        observer.join()
+        watcher.join()
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Please provide input folder.")
         sys.exit(1)
 
-    input_folder = sys.argv[1]
-    start_folder_monitor(input_folder)
\ No newline at end of file
+    # Any extra arguments are more folders to monitor
+    input_folders = sys.argv[1:]
+    start_folder_monitor(input_folders)
@@ -0,0 +1,126 @@
+import os
+import socket
+import struct
+import threading
+
+# Unix socket todecode_monitor listens on for zips written by folder_monitor.
+HANDOFF_SOCKET = "state/handoff.sock"
+# Archives up to this size are passed along in memory; larger ones only by name,
+# todecode_monitor then reads them from disk.
+HANDOFF_MAX_BYTES = 16 * 1024 * 1024
+HANDOFF_TIMEOUT = 5
+
+# Name length, archive length
+_HEADER = struct.Struct("!II")
+_ACCEPTED = b"\x01"
+_REJECTED = b"\x00"
+
+
+class HandoffClient:
+    """
+    Passes zips straight to a HandoffServer. The zip must already be in the watched
+    folder, which stays the durable copy: if the hand-off fails, the watcher or the
+    catch-up scan of todecode_monitor still picks it up.
+    """
+
+    def __init__(self, socket_path=HANDOFF_SOCKET, timeout=HANDOFF_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def send(self, zip_path, data=b""):
+        """
+        Sends the zip name and, optionally, its bytes.
+        :return: True if the server accepted the zip.
+        """
+        name = os.path.basename(zip_path).encode('utf-8')
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                conn.settimeout(self.timeout)
+                conn.connect(self.socket_path)
+                conn.sendall(_HEADER.pack(len(name), len(data)) + name)
+                if data:
+                    # Without data the server may already have answered and closed
+                    conn.sendall(data)
+                return conn.recv(1) == _ACCEPTED
+        except OSError:
+            return False
+
+
+class LocalHandoff:
+    """
+    HandoffClient for a receiver running in the same process, see supervisor.py.
+    """
+
+    def __init__(self, receive):
+        self.receive = receive
+
+    def send(self, zip_path, data=b""):
+        return self.receive(os.path.basename(zip_path), data)
+
+
+class HandoffServer:
+    """
+    Listens on a Unix socket and calls ``receive(name, data)`` for every zip handed off;
+    ``data`` is empty if only the name was sent. Connections are served concurrently.
+    :param timeout: Seconds to wait for the data of a connection.
+    """
+
+    def __init__(self, receive, socket_path=HANDOFF_SOCKET, timeout=HANDOFF_TIMEOUT):
+        self.receive = receive
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._server = None
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+        if os.path.exists(self.socket_path):
+            # Left over by a previous run
+            os.remove(self.socket_path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.socket_path)
+        self._server.listen()
+        threading.Thread(target=self._run, name="handoff-server", daemon=True).start()
+
+    def stop(self):
+        if self._server:
+            self._server.close()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def _run(self):
+        server = self._server
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                # Server closed
+                return
+            # receive may block (e.g. the "block" overflow policy of the admission queue),
+            # so each connection gets its own thread and the next one is accepted right away
+            threading.Thread(target=self._handle, args=(conn,), name="handoff-connection", daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            # A sender that stalls mid-message does not hold the thread forever
+            conn.settimeout(self.timeout)
+            try:
+                name_size, data_size = _HEADER.unpack(_recv_exactly(conn, _HEADER.size))
+                name = _recv_exactly(conn, name_size).decode('utf-8')
+                data = _recv_exactly(conn, data_size)
+                accepted = self.receive(name, data)
+                conn.sendall(_ACCEPTED if accepted else _REJECTED)
+            except Exception:
+                # The sender falls back to the watcher
+                return
+
+
+def _recv_exactly(conn, size):
+    chunks = []
+    while size:
+        chunk = conn.recv(min(size, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("Hand-off connection closed early")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
@@ -0,0 +1,188 @@
+import os
+import threading
+
+CATCH_UP_BATCH_SIZE = 1000
+
+# The journal file is rewritten with the live entries only once it holds more than twice
+# as many lines as entries, and at least this many lines.
+COMPACT_MIN_LINES = 10000
+
+
+class ProcessedJournal:
+    """
+    Append-only journal of processed files, keyed by file name, size and mtime.
+    It lets a restarted monitor tell the files it already handled from the ones
+    that arrived while it was down.
+    :param path: Journal file, created if missing.
+    :param base_folder: If set, files are keyed by their path relative to it (so the files
+                        directly in it keep their name as key), and files outside of it by
+                        their absolute path. Used when several folders or subfolders are
+                        watched, where file names are not unique.
+    """
+
+    def __init__(self, path, base_folder=None):
+        self.path = path
+        self.base_folder = os.path.abspath(base_folder) if base_folder else None
+        self._lock = threading.Lock()
+        self._entries = {}
+        # Lines in the journal file, superseded and forgotten entries included
+        self._lines = 0
+        # Folders scan_backlog already seeded, a later scan (e.g. after a restart of the
+        # observer) must report the files that arrived meanwhile instead
+        self.seeded = set()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.created = not os.path.exists(path)
+        if not self.created:
+            with open(path, 'r') as file:
+                for line in file:
+                    try:
+                        size, mtime, name = line.rstrip("\n").split("\t", 2)
+                        self._entries[name] = (int(size), int(mtime))
+                        self._lines += 1
+                    except ValueError:
+                        # Line cut short by a crash
+                        continue
+        self._file = open(path, 'a')
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, path):
+        """
+        Returns the name ``path`` is recorded under.
+        """
+        if self.base_folder is None:
+            return os.path.basename(path)
+        path = os.path.abspath(path)
+        if path.startswith(self.base_folder + os.sep):
+            return os.path.relpath(path, self.base_folder)
+        return path
+
+    def keys_in(self, folder, recursive=False):
+        """
+        Returns the recorded names of the files in ``folder``, and in its subfolders if
+        ``recursive``. Without a base folder, every name is taken as in ``folder``.
+        """
+        names = self.names()
+        if self.base_folder is None:
+            return names
+        folder = os.path.abspath(folder)
+        keys = set()
+        for name in names:
+            path = os.path.join(self.base_folder, name)
+            if os.path.dirname(path) == folder or (recursive and path.startswith(folder + os.sep)):
+                keys.add(name)
+        return keys
+
+    def contains(self, path, signature):
+        """
+        Returns True if the file was processed with this (size, mtime) signature.
+        """
+        return self._entries.get(self.key(path)) == signature
+
+    def record(self, path, signature):
+        name = self.key(path)
+        with self._lock:
+            self._entries[name] = signature
+            self._file.write(f"{signature[0]}\t{signature[1]}\t{name}\n")
+            self._file.flush()
+            self._lines += 1
+            self._compact_if_sparse()
+
+    def forget(self, path):
+        """
+        Drops the entry of ``path``, typically a file removed once processed, which the
+        journal no longer needs to tell apart. Its lines stay in the journal file until
+        it is compacted.
+        """
+        name = self.key(path)
+        with self._lock:
+            if self._entries.pop(name, None) is not None:
+                self._compact_if_sparse()
+
+    def names(self):
+        with self._lock:
+            return set(self._entries)
+
+    def compact(self, stale_names):
+        """
+        Rewrites the journal without the entries of ``stale_names``, typically files
+        no longer present in the watched folder.
+        """
+        with self._lock:
+            self._entries = {name: signature for name, signature in self._entries.items() if name not in stale_names}
+            self._rewrite()
+
+    def _compact_if_sparse(self):
+        # Called with the lock held, see COMPACT_MIN_LINES
+        if self._lines > max(COMPACT_MIN_LINES, 2 * len(self._entries)):
+            self._rewrite()
+
+    def _rewrite(self):
+        # Called with the lock held
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            for name, (size, mtime) in self._entries.items():
+                file.write(f"{size}\t{mtime}\t{name}\n")
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'a')
+        self._lines = len(self._entries)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def scan_backlog(folder, suffix, journal, seed=False, recursive=False):
+    """
+    Lists the files of ``folder`` ending with ``suffix`` that are not in the journal,
+    oldest first, and compacts the journal down to the files still present.
+    :param seed: If the journal was just created, record the files present instead of
+                 returning them, on the first scan of ``folder`` only. Used for folders
+                 whose files stay after processing, so the first run does not process
+                 everything again.
+    :param recursive: Also list the files of the subfolders.
+    :return: Paths of the unprocessed files.
+    """
+    # Only entries known before the scan can go stale; files processed while the
+    # scan runs are recorded too and must be kept.
+    known_names = journal.keys_in(folder, recursive)
+    seeding = seed and journal.created and os.path.abspath(folder) not in journal.seeded
+    names = set()
+    backlog = []
+    folders = [folder]
+    while folders:
+        with os.scandir(folders.pop()) as entries:
+            for entry in entries:
+                if recursive and entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                    continue
+                if not entry.name.endswith(suffix) or not entry.is_file():
+                    continue
+                names.add(journal.key(entry.path))
+                stat = entry.stat()
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if seeding:
+                    journal.record(entry.path, signature)
+                elif not journal.contains(entry.path, signature):
+                    backlog.append((stat.st_mtime_ns, entry.path))
+
+    if seed:
+        journal.seeded.add(os.path.abspath(folder))
+    journal.compact(known_names - names)
+    backlog.sort()
+    return [path for _, path in backlog]
+
+
+def catch_up(backlog, ready, batch_size=CATCH_UP_BATCH_SIZE):
+    """
+    Hands the backlog over in batches, so the oldest files reach the workers first.
+    :param ready: Called with each path, e.g. FileEventRegistry.ready.
+    :return: Generator yielding the number of files handed over after each batch.
+    """
+    for start in range(0, len(backlog), batch_size):
+        for path in backlog[start:start + batch_size]:
+            ready(path)
+        yield min(start + batch_size, len(backlog))
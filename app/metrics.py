@@ -0,0 +1,326 @@
+import os
+import bisect
+import json
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds of the stage latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Upper bounds of the histogram buckets of batch sizes, in files.
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+# Local HTTP endpoint of each service, serving /metrics (Prometheus text format) and /summary (JSON).
+METRICS_HOST = "127.0.0.1"
+METRICS_PORTS = {"supervisor": 9100, "folder_monitor": 9101, "todecode_monitor": 9102}
+# Environment variable with an offset added to the ports, so several pipelines started
+# together (see manage_monitor_app.py) each get their own.
+METRICS_PORT_OFFSET_ENV = "MONITOR_METRICS_PORT_OFFSET"
+
+
+class Counter:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """
+    Gauge read through a function when the metrics are rendered, so the hot path pays nothing.
+    """
+
+    def __init__(self):
+        self.function = lambda: 0
+
+    def set_function(self, function):
+        self.function = function
+
+    @property
+    def value(self):
+        return self.function()
+
+
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """
+        Estimates the ``q`` quantile as the upper bound of the bucket holding it.
+        """
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        rank = q * count
+        seen = 0
+        for index, bucket_count in enumerate(counts):
+            seen += bucket_count
+            if seen >= rank and bucket_count:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return 0.0
+
+
+class MetricFamily:
+    """
+    Metrics of one name, one per set of label values.
+    """
+
+    def __init__(self, name, help, kind, factory):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.factory = factory
+        self._lock = threading.Lock()
+        self.children = {}
+
+    def labels(self, **labels):
+        """
+        Returns the metric for the label values. Look it up once and keep it, rather
+        than calling this on the hot path.
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            if key not in self.children:
+                self.children[key] = self.factory()
+            return self.children[key]
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.families = []
+
+    def counter(self, name, help):
+        return self._add(MetricFamily(name, help, "counter", Counter))
+
+    def gauge(self, name, help):
+        return self._add(MetricFamily(name, help, "gauge", Gauge))
+
+    def counter_function(self, name, help):
+        # Counter kept elsewhere (e.g. in the Counter of a component's stats), read like a Gauge
+        return self._add(MetricFamily(name, help, "counter", Gauge))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._add(MetricFamily(name, help, "histogram", lambda: Histogram(buckets)))
+
+    def _add(self, family):
+        self.families.append(family)
+        return family
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for family in self.families:
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for key, metric in list(family.children.items()):
+                if family.kind != "histogram":
+                    lines.append(f"{family.name}{_labels(key)} {metric.value}")
+                    continue
+                with metric._lock:
+                    counts, total, count = list(metric.counts), metric.sum, metric.count
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{family.name}_bucket{_labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{family.name}_sum{_labels(key)} {total}")
+                lines.append(f"{family.name}_count{_labels(key)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """
+        Returns the count, mean, p50 and p99 of every histogram and the value of every
+        other metric, keyed by metric name and label values.
+        """
+        summary = {}
+        for family in self.families:
+            for key, metric in list(family.children.items()):
+                name = family.name + _labels(key)
+                if family.kind != "histogram":
+                    summary[name] = metric.value
+                elif metric.count:
+                    summary[name] = {
+                        "count": metric.count,
+                        "mean": metric.sum / metric.count,
+                        "p50": metric.quantile(0.5),
+                        "p99": metric.quantile(0.99),
+                    }
+        return summary
+
+
+def _labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in key) + "}"
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram("monitor_stage_seconds", "Seconds spent in each pipeline stage.")
+FILES = REGISTRY.counter("monitor_files_total", "Files handled by each stage, by outcome.")
+BYTES = REGISTRY.counter("monitor_bytes_total", "Bytes handled by each stage.")
+QUEUE = REGISTRY.gauge("monitor_queue", "Admission queue and event registry sizes.")
+QUEUE_EVENTS = REGISTRY.counter_function("monitor_queue_events_total",
+                                        "Events suppressed or failed in the event registry, jobs admitted, "
+                                        "dropped, spilled, blocked and replayed by the admission queue.")
+PII_RULE_SECONDS = REGISTRY.counter("monitor_pii_rule_seconds_total", "Seconds spent in each PII rule.")
+PII_RULE_CHUNKS = REGISTRY.counter("monitor_pii_rule_chunks_total",
+                                   "Chunks of text each PII rule searched, or skipped by its prefilter.")
+FILTER_CACHE_LOOKUPS = REGISTRY.counter("monitor_filter_cache_lookups_total", "Filter cache lookups, by outcome.")
+OUTPUT_COMMIT_SECONDS = REGISTRY.histogram("monitor_output_commit_seconds",
+                                           "Seconds from an output being queued to it being durable (latency), "
+                                           "and of each group commit (barrier).")
+RETENTION_FILES = REGISTRY.counter("monitor_retention_files_total", "Files deleted by each retention policy.")
+RETENTION_BYTES = REGISTRY.counter("monitor_retention_bytes_total", "Bytes deleted by each retention policy.")
+OUTPUT_COMMIT_FILES = REGISTRY.histogram("monitor_output_commit_files", "Files made durable by each group commit.",
+                                         BATCH_SIZE_BUCKETS)
+
+
+def register_queue_gauges(queue, event_handler):
+    """
+    Exposes the depth, spilled depth, running and in flight counts of a monitor handler,
+    the depth, running count and p99 latency (in seconds) of each size lane, and the event
+    counters of its event registry and admission queue.
+    """
+    QUEUE.labels(queue=queue, gauge="depth").set_function(lambda: event_handler.admission.stats()["depth"])
+    QUEUE.labels(queue=queue, gauge="spilled").set_function(lambda: event_handler.admission.stats()["spilled_depth"])
+    QUEUE.labels(queue=queue, gauge="running").set_function(lambda: event_handler.admission.stats()["running"])
+    QUEUE.labels(queue=queue, gauge="in_flight").set_function(lambda: event_handler.events.stats()["in_flight"])
+    for name, _, _, _ in event_handler.admission.lanes:
+        QUEUE.labels(queue=queue, lane=name, gauge="depth").set_function(
+            lambda name=name: event_handler.admission.stats()["lanes"][name]["depth"])
+        QUEUE.labels(queue=queue, lane=name, gauge="running").set_function(
+            lambda name=name: event_handler.admission.stats()["lanes"][name]["running"])
+        QUEUE.labels(queue=queue, lane=name, gauge="latency_p99").set_function(
+            lambda name=name: event_handler.admission.stats()["lanes"][name].get("latency_p99", 0))
+
+    # Read straight from the counters, without the percentiles of stats()
+    for reason in ("debounced", "missing", "in_flight", "processed"):
+        QUEUE_EVENTS.labels(queue=queue, event=f"suppressed_{reason}").set_function(
+            lambda reason=reason: event_handler.events.suppressed[reason])
+    QUEUE_EVENTS.labels(queue=queue, event="dispatch_error").set_function(lambda: event_handler.events.dispatch_errors)
+    for name in ("admitted", "dropped", "spilled", "blocked", "replayed"):
+        QUEUE_EVENTS.labels(queue=queue, event=name).set_function(lambda name=name: event_handler.admission.counters[name])
+
+
+class TimedStream:
+    """
+    Wraps a file object and adds up the seconds spent in its read and write calls,
+    and the size of what went through.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.seconds = 0.0
+        self.size = 0
+
+    def read(self, size=-1):
+        started = time.perf_counter()
+        data = self.stream.read(size)
+        self.seconds += time.perf_counter() - started
+        self.size += len(data)
+        return data
+
+    def write(self, data):
+        started = time.perf_counter()
+        written = self.stream.write(data)
+        self.seconds += time.perf_counter() - started
+        self.size += len(data)
+        return written
+
+
+class MetricsServer:
+    """
+    Serves the registry on a local HTTP port: /metrics in the Prometheus text format
+    and /summary as JSON.
+    """
+
+    def __init__(self, port, registry=REGISTRY, host=METRICS_HOST):
+        self.port = port
+        self.registry = registry
+        self.host = host
+        self._server = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = registry.render(), "text/plain; version=0.0.4"
+                elif self.path == "/summary":
+                    body, content_type = json.dumps(registry.summary()), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                body = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def metrics_port(service):
+    """
+    Returns the metrics port of ``service`` in this process, see METRICS_PORT_OFFSET_ENV.
+    """
+    return METRICS_PORTS[service] + int(os.environ.get(METRICS_PORT_OFFSET_ENV, "0"))
+
+
+def fetch_summary(port, host=METRICS_HOST, timeout=2):
+    """
+    Returns the /summary of the service listening on ``port``, or None if it does not answer.
+    """
+    try:
+        with urllib.request.urlopen(f"http://{host}:{port}/summary", timeout=timeout) as response:
+            return json.loads(response.read())
+    except (OSError, ValueError):
+        return None
+
+
+def format_summary(summary):
+    """
+    Formats a /summary as short lines for the console, latencies in milliseconds.
+    """
+    lines = []
+    for name, value in summary.items():
+        if isinstance(value, dict):
+            lines.append(f"{name} count={value['count']} mean={value['mean'] * 1000:.1f}ms "
+                         f"p50<={value['p50'] * 1000:g}ms p99<={value['p99'] * 1000:g}ms")
+        else:
+            lines.append(f"{name} {value}")
+    return lines
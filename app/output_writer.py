@@ -0,0 +1,186 @@
+import os
+import sys
+import time
+import ctypes
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from metrics import OUTPUT_COMMIT_SECONDS, OUTPUT_COMMIT_FILES
+
+# Seconds a group commit waits for more outputs after the first one is queued, and the
+# most outputs it takes; whichever comes first starts the commit.
+COMMIT_INTERVAL = 0.05
+COMMIT_BATCH_SIZE = 256
+
+# How the data of a batch is made durable: "syncfs" flushes each file system the batch
+# writes to once (Linux only, falls back to "fsync"); "fsync" flushes every file.
+# syncfs also flushes the other dirty files of the file system, so "fsync" may be
+# cheaper where other services write a lot to the same file system.
+SYNC_METHOD = "syncfs"
+
+TEMP_SUFFIX = ".tmp"
+
+
+def _load_syncfs():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        syncfs = ctypes.CDLL(None, use_errno=True).syncfs
+    except (OSError, AttributeError):
+        return None
+    syncfs.argtypes = [ctypes.c_int]
+    return syncfs
+
+
+_syncfs = _load_syncfs()
+
+
+def temp_path(path):
+    """
+    Returns the path the output ``path`` is written to before it is committed.
+    """
+    return path + TEMP_SUFFIX
+
+
+def fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class OutputWriter:
+    """
+    Makes outputs durable in groups. An output is written to its temp_path and closed,
+    then passed to commit. A committer thread collects the outputs queued within
+    ``interval`` (or ``batch_size`` of them) and per batch: flushes their data, renames
+    them to their final name, and fsyncs each of their folders once. An output thus only
+    shows up under its name once complete and durable, and the Future returned by
+    commit tells when its input can be removed. The writes can happen in any process,
+    the commit only needs the paths. The Futures are completed by another thread, so
+    their callbacks (e.g. removing the input and starting the next job) never hold up
+    the next group commit.
+
+    :param interval: See COMMIT_INTERVAL.
+    :param batch_size: See COMMIT_BATCH_SIZE.
+    :param sync_method: See SYNC_METHOD.
+    """
+
+    def __init__(self, interval=COMMIT_INTERVAL, batch_size=COMMIT_BATCH_SIZE, sync_method=SYNC_METHOD):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.sync_method = sync_method if sync_method != "syncfs" or _syncfs else "fsync"
+        self._condition = threading.Condition()
+        # (paths, Future, queued at) of the commits waiting for the next batch
+        self._queue = []
+        self._queued_files = 0
+        self._thread = None
+        # Completes the Futures of the committed batches, started on first use
+        self._completer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="output-complete")
+        self.latency_seconds = OUTPUT_COMMIT_SECONDS.labels(kind="latency")
+        self.barrier_seconds = OUTPUT_COMMIT_SECONDS.labels(kind="barrier")
+        self.batch_files = OUTPUT_COMMIT_FILES.labels()
+
+    def commit(self, paths):
+        """
+        Queues outputs written to their temp_path for the next group commit.
+        :param paths: Final paths of the outputs.
+        :return: Future completed with ``paths`` once they are all durable under their
+                 final name, or with the error that kept them from it.
+        """
+        future = Future()
+        if not paths:
+            future.set_result([])
+            return future
+        with self._condition:
+            if self._thread is None:
+                # Started on first use, so process pool workers that only write temp files have none
+                self._thread = threading.Thread(target=self._run, name="output-commit", daemon=True)
+                self._thread.start()
+            self._queue.append((list(paths), future, time.monotonic()))
+            self._queued_files += len(paths)
+            self._condition.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                # Gives the outputs of other jobs a chance to join the batch
+                deadline = self._queue[0][2] + self.interval
+                while self._queued_files < self.batch_size and time.monotonic() < deadline:
+                    self._condition.wait(deadline - time.monotonic())
+                batch, self._queue, self._queued_files = self._queue, [], 0
+            try:
+                self._commit_batch(batch)
+            except Exception as e:
+                # Not an error of the outputs (those complete their own commits): the
+                # whole batch fails and the next one is committed as usual
+                _complete([(future, None, e) for _, future, _ in batch if not future.done()])
+
+    def _commit_batch(self, batch):
+        started = time.perf_counter()
+        paths = [path for commit_paths, _, _ in batch for path in commit_paths]
+        failed = {}
+        try:
+            self._sync_data(paths, failed)
+            folders = set()
+            for path in paths:
+                if path in failed:
+                    continue
+                try:
+                    os.replace(temp_path(path), path)
+                    folders.add(os.path.dirname(path) or ".")
+                except OSError as e:
+                    failed[path] = e
+            for folder in folders:
+                fsync_path(folder)
+        except OSError as e:
+            # A failed barrier leaves the durability of the whole batch unknown
+            self._completer.submit(_complete, [(future, None, e) for _, future, _ in batch])
+            return
+
+        self.barrier_seconds.observe(time.perf_counter() - started)
+        self.batch_files.observe(len(paths))
+        now = time.monotonic()
+        outcomes = []
+        for commit_paths, future, queued in batch:
+            self.latency_seconds.observe(now - queued)
+            errors = [failed[path] for path in commit_paths if path in failed]
+            outcomes.append((future, commit_paths, errors[0] if errors else None))
+        self._completer.submit(_complete, outcomes)
+
+    def _sync_data(self, paths, failed):
+        if self.sync_method == "syncfs":
+            devices = {}
+            for path in paths:
+                try:
+                    devices.setdefault(os.stat(temp_path(path)).st_dev, temp_path(path))
+                except OSError as e:
+                    failed[path] = e
+            for path in devices.values():
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    if _syncfs(fd) != 0:
+                        error = ctypes.get_errno()
+                        raise OSError(error, os.strerror(error), path)
+                finally:
+                    os.close(fd)
+            return
+
+        for path in paths:
+            try:
+                fsync_path(temp_path(path))
+            except FileNotFoundError as e:
+                failed[path] = e
+
+
+def _complete(outcomes):
+    # Runs on the completer thread of an OutputWriter (on its committer thread after an
+    # unexpected error): (Future, result, error) per commit
+    for future, result, error in outcomes:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
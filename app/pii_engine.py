@@ -0,0 +1,253 @@
+import os
+import re
+import json
+import time
+import hashlib
+
+# Extra rules, loaded by PiiEngine at startup: a JSON list of objects with the PiiRule
+# arguments ("name", "pattern", "replacement", and optionally "guard", "prefilter" and
+# "prefilter_pattern"). A rule named like a built-in one replaces it, others are appended.
+PII_RULES_FILE = "config/pii_rules.json"
+# Environment variable overriding PII_RULES_FILE, set by manage_monitor_app.py to the
+# project's rules file for the pipelines running in their own working folder.
+PII_RULES_FILE_ENV = "MONITOR_PII_RULES_FILE"
+
+# Streaming defaults: text is read in chunks of CHUNK_SIZE characters and each rule
+# holds back OVERLAP_WINDOW characters so matches spanning two chunks are still found.
+CHUNK_SIZE = 1024 * 1024
+OVERLAP_WINDOW = 64 * 1024
+
+
+class PiiRule:
+    """
+    A single PII rule: a regex pattern and what to replace its matches with.
+    :param name: Unique name of the rule.
+    :param pattern: Regular expression matching the PII.
+    :param replacement: Replacement string (``re.sub`` template) or a callable taking the match.
+    :param guard: Optional lookahead that every match of ``pattern`` satisfies. It is checked
+                  before the pattern, so positions that cannot match are skipped cheaply.
+    :param prefilter: Literal strings, one of which every match contains (e.g. "@").
+    :param prefilter_pattern: Cheap regex every match contains a match of (e.g. a digit run).
+                              Text holding none of the prefilters is not searched by the
+                              rule at all. A rule without prefilters always runs.
+    """
+
+    def __init__(self, name, pattern, replacement, guard=None, prefilter=(), prefilter_pattern=None):
+        self.name = name
+        self.pattern = pattern
+        self.replacement = replacement
+        self.guard = guard
+        self.prefilter = tuple(prefilter)
+        self.prefilter_pattern = prefilter_pattern
+        self.regex = re.compile(f"{guard}{pattern}" if guard else pattern)
+        self.prefilter_regex = re.compile(prefilter_pattern) if prefilter_pattern else None
+
+        if callable(replacement):
+            self.replace = replacement
+        elif "\\" in replacement:
+            self.replace = lambda match: match.expand(replacement)
+        else:
+            self.replace = lambda match: replacement
+
+    def __repr__(self):
+        return f"PiiRule({self.name!r})"
+
+    def sub(self, content):
+        return self.regex.sub(self.replacement, content)
+
+    def may_match(self, content, pos=0):
+        """
+        Returns False if no match can start at or after ``pos``, going by the prefilters.
+        """
+        if not self.prefilter and self.prefilter_regex is None:
+            return True
+        for literal in self.prefilter:
+            if content.find(literal, pos) != -1:
+                return True
+        return self.prefilter_regex is not None and self.prefilter_regex.search(content, pos) is not None
+
+
+# Rules are applied in this order, each one on the output of the previous ones.
+# Every repetition is bounded, so no match is longer than a few hundred characters and
+# filter_stream gives the same output as filter_text (see PiiEngine's overlap).
+PII_RULES = [
+    # File paths like "C:\Users\username"; the user name ends with the line
+    PiiRule("file_paths", r"([A-Za-z]):(\\{0,16})Users(\\{0,16})([^\\\r\n]{1,255})",
+            lambda m: f'<d>{m.group(2)}Users{m.group(3)}<u>', prefilter=("Users",)),
+    # Email addresses
+    PiiRule("emails", r"\b[A-Za-z0-9._%+-]{1,64}@[A-Za-z0-9.-]{1,255}\.[A-Za-z]{2,63}\b", r"<email>", prefilter=("@",)),
+    # Phone numbers (e.g., (123) 456-7890, 123-456-7890, +1-234-567-8900)
+    # A match always reaches its first digit within three "+", "(" or separator characters.
+    PiiRule("phone_numbers", r"\b(?:\+?(\d{1,3})?[-.\s]?)?(?:\(?(\d{3})\)?[-.\s]?)?(\d{3})[-.\s]?(\d{4})\b",
+            r"<phone_number>", guard=r"(?=[-+.(\s]{0,3}\d)", prefilter_pattern=r"\d{3}"),
+    # Dates (e.g., 12/25/2023, 25-12-2023, Dec 25, 2023, 25th December 2023)
+    # Every form ends with at least two digits in a row.
+    PiiRule("dates", r"\b(\d{1,2}[-/th|st|nd|rd\s]{0,16}[A-Za-z]{3,9}[-/\s]{0,16}\d{2,4}|\d{1,2}[-/]\d{1,2}[-/]\d{2,4}|[A-Za-z]{3,9} \d{1,2}(?:th|st|nd|rd)?, \d{4})\b",
+            r"<date>", prefilter_pattern=r"\d\d"),
+    # Social media patterns
+    PiiRule("twitter", r"@([A-Za-z0-9_]{1,15})", r"<twitter_handle>", prefilter=("@",)),
+    PiiRule("linkedin", r"https?://(www\.)?linkedin\.com/in/[A-Za-z0-9_-]{1,100}", r"<linkedin_profile>",
+            prefilter=("linkedin.com",)),
+    PiiRule("instagram", r"@([A-Za-z0-9_.]{1,30})|https?://(www\.)?instagram\.com/[A-Za-z0-9_.]{1,100}",
+            r"<instagram_handle>", prefilter=("@", "instagram.com")),
+    PiiRule("facebook", r"https?://(www\.)?facebook\.com/[A-Za-z0-9_.]{1,100}", r"<facebook_profile>",
+            prefilter=("facebook.com",)),
+    PiiRule("github", r"https?://(www\.)?github\.com/[A-Za-z0-9_-]{1,100}", r"<github_profile>",
+            prefilter=("github.com",)),
+    # Physical addresses (simple example, could be refined)
+    PiiRule("addresses", r"\b\d{1,4}\s[A-Za-z0-9\s]{1,100}(?:St|Street|Ave|Avenue|Blvd|Boulevard|Rd|Road|Lane|Ln|Dr|Drive|Ct|Court)\b",
+            r"<address>", prefilter_pattern=r"\d\s"),
+]
+
+
+def load_rules(path=None, rules=None):
+    """
+    Returns ``rules`` (PII_RULES by default) merged with the rules of the JSON file at
+    ``path``, see PII_RULES_FILE and PII_RULES_FILE_ENV. A missing file leaves the rules
+    as they are.
+    """
+    if path is None:
+        path = os.environ.get(PII_RULES_FILE_ENV) or PII_RULES_FILE
+    rules = list(PII_RULES if rules is None else rules)
+    if not os.path.exists(path):
+        return rules
+
+    with open(path) as file:
+        for config in json.load(file):
+            rule = PiiRule(**config)
+            names = [existing.name for existing in rules]
+            if rule.name in names:
+                rules[names.index(rule.name)] = rule
+            else:
+                rules.append(rule)
+    return rules
+
+
+def rules_version(rules):
+    """
+    Returns a digest of the rules, which changes whenever a rule, its replacement or
+    their order does, e.g. to tell filtered text cached under other rules.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for rule in rules:
+        replacement = rule.replacement
+        if callable(replacement):
+            code = replacement.__code__
+            replacement = code.co_code.hex() + repr(code.co_consts)
+        digest.update(repr((rule.name, rule.pattern, rule.guard, replacement)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class _RuleStream:
+    """
+    Applies one rule to text that arrives in pieces. Text closer than ``window`` to the
+    end of what has been read is held back until more arrives, as is a match running up
+    to the end of it, which more text could extend. ``window`` characters of already
+    processed text are kept so ``\\b`` and lookbehinds see the same context as on the
+    whole text.
+    """
+
+    def __init__(self, rule, window):
+        self.rule = rule
+        self.window = window
+        self.buffer = ""
+        self.pos = 0
+        # Seconds spent in the rule, and pieces of text it searched and skipped
+        self.seconds = 0.0
+        self.searched = 0
+        self.skipped = 0
+
+    def feed(self, data, final=False):
+        """
+        Adds ``data`` and returns the filtered text that can no longer change.
+        :param final: True once the input is exhausted; everything left is flushed.
+        """
+        started = time.perf_counter()
+        buffer = self.buffer + data
+        limit = len(buffer) if final else len(buffer) - self.window
+        pos = self.pos
+        output = []
+
+        if pos < limit and not self.rule.may_match(buffer, pos):
+            self.skipped += 1
+            output.append(buffer[pos:limit])
+            pos = limit
+        elif pos < limit:
+            self.searched += 1
+            for match in self.rule.regex.finditer(buffer, pos):
+                if match.start() >= limit:
+                    break
+                if match.end() == len(buffer) and not final:
+                    # May go on in the next piece, held back along with what follows
+                    output.append(buffer[pos:match.start()])
+                    pos = limit = match.start()
+                    break
+                output.append(buffer[pos:match.start()])
+                output.append(self.rule.replace(match))
+                pos = match.end()
+            if pos < limit:
+                output.append(buffer[pos:limit])
+                pos = limit
+
+        keep = max(0, pos - self.window)
+        self.buffer = buffer[keep:]
+        self.pos = pos - keep
+        self.seconds += time.perf_counter() - started
+        return "".join(output)
+
+
+class PiiEngine:
+    """
+    Compiled PII filter. Build it once at startup and reuse it for every file.
+
+    Each rule runs on the output of the previous one, so the rules are not merged
+    into a single alternation: a later rule matching earlier in the text would
+    consume text an earlier rule is meant to replace (e.g. ``@john@example.com``).
+
+    :param rules: Rules to apply, in order. Defaults to PII_RULES merged with PII_RULES_FILE.
+    :param chunk_size: Characters read at a time by filter_stream.
+    :param overlap: Characters each rule holds back between chunks. Streaming gives the
+                    same output as filter_text as long as no match (and no text a rule
+                    has to look at to decide on one) is longer than this, which holds
+                    for the built-in rules. A match reaching the end of what was read is
+                    held back whatever its length.
+    """
+
+    def __init__(self, rules=None, chunk_size=CHUNK_SIZE, overlap=OVERLAP_WINDOW):
+        self.rules = load_rules() if rules is None else list(rules)
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.version = rules_version(self.rules)
+
+    def filter_text(self, content):
+        """
+        Returns ``content`` with every PII rule applied in order.
+        """
+        for rule in self.rules:
+            if rule.may_match(content):
+                content = rule.sub(content)
+        return content
+
+    def filter_stream(self, source, target, stats=None):
+        """
+        Reads text from ``source`` in chunks and writes the filtered text to ``target``
+        as it goes, so memory use is bounded by chunk_size and overlap, not file size.
+        :param source: Readable text file object.
+        :param target: Writable text file object.
+        :param stats: Optional dict filled with the seconds spent in each rule and the
+                      number of chunks it searched and skipped, as
+                      ``{name: (seconds, searched, skipped)}``.
+        """
+        streams = [_RuleStream(rule, self.overlap) for rule in self.rules]
+        while True:
+            chunk = source.read(self.chunk_size)
+            final = not chunk
+            for stream in streams:
+                chunk = stream.feed(chunk, final)
+            target.write(chunk)
+            if final:
+                break
+
+        if stats is not None:
+            for stream in streams:
+                stats[stream.rule.name] = (stream.seconds, stream.searched, stream.skipped)
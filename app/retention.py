@@ -0,0 +1,231 @@
+import os
+import time
+import heapq
+import fnmatch
+import threading
+from collections import Counter
+from watchdog.events import FileSystemEventHandler
+from metrics import RETENTION_FILES, RETENTION_BYTES
+
+# Seconds between two sweeps, and the most files a sweep deletes, so a large backlog of
+# expired files is deleted at most RETENTION_BATCH_SIZE / RETENTION_INTERVAL files per
+# second instead of all at once.
+RETENTION_INTERVAL = 10
+RETENTION_BATCH_SIZE = 100
+
+
+class RetentionPolicy:
+    """
+    Limits on the files of ``folder`` (not its subfolders) whose name matches ``pattern``.
+    While a limit is exceeded, the oldest file by mtime is deleted. Each limit is None
+    for none.
+    :param max_age: Seconds since the last modification of a file.
+    :param max_files: Number of files.
+    :param max_bytes: Total size of the files.
+    """
+
+    def __init__(self, folder, pattern="*", max_age=None, max_files=None, max_bytes=None):
+        self.name = f"{folder}/{pattern}"
+        self.folder = os.path.abspath(folder)
+        self.pattern = pattern
+        self.max_age = max_age
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        # Path -> (mtime, size), and (mtime, path) entries with the oldest first; entries
+        # no longer matching the dict are skipped when they come up
+        self._files = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self._files)
+
+    def matches(self, path):
+        return os.path.dirname(path) == self.folder and fnmatch.fnmatchcase(os.path.basename(path), self.pattern)
+
+    def track(self, path, mtime, size):
+        previous = self._files.get(path)
+        if previous is not None:
+            self.total_bytes -= previous[1]
+        self._files[path] = (mtime, size)
+        self.total_bytes += size
+        if previous is None or previous[0] != mtime:
+            heapq.heappush(self._heap, (mtime, path))
+            if len(self._heap) > 2 * len(self._files) + 64:
+                self._heap = [(mtime, path) for path, (mtime, _) in self._files.items()]
+                heapq.heapify(self._heap)
+
+    def untrack(self, path):
+        previous = self._files.pop(path, None)
+        if previous is not None:
+            self.total_bytes -= previous[1]
+
+    def expired(self, now):
+        """
+        Returns the (path, size) of the oldest file if a limit is exceeded, else None.
+        """
+        while self._heap:
+            mtime, path = self._heap[0]
+            entry = self._files.get(path)
+            if entry is None or entry[0] != mtime:
+                heapq.heappop(self._heap)
+                continue
+            if ((self.max_age is not None and now - mtime > self.max_age)
+                    or (self.max_files is not None and len(self._files) > self.max_files)
+                    or (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+                return path, entry[1]
+            return None
+        return None
+
+
+class RetentionEngine(FileSystemEventHandler):
+    """
+    Applies retention policies to folders without listing them again: each folder is
+    listed once when the engine starts, and from then on the engine keeps its index up to
+    date from the events of the observer it is scheduled on. A sweep thread deletes the
+    files over a limit in batches of ``batch_size`` every ``interval`` seconds.
+    :param policies: RetentionPolicy list.
+    """
+
+    def __init__(self, policies, interval=RETENTION_INTERVAL, batch_size=RETENTION_BATCH_SIZE, logger=None):
+        super().__init__()
+        self.policies = list(policies)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.logger = logger
+        self.counters = Counter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.deleted_files = {policy.name: RETENTION_FILES.labels(policy=policy.name) for policy in self.policies}
+        self.deleted_bytes = {policy.name: RETENTION_BYTES.labels(policy=policy.name) for policy in self.policies}
+
+    def folders(self):
+        return sorted({policy.folder for policy in self.policies})
+
+    def schedule(self, observer):
+        """
+        Schedules the engine on ``observer`` for the folders of its policies, which are
+        created if missing.
+        """
+        for folder in self.folders():
+            os.makedirs(folder, exist_ok=True)
+            observer.schedule(self, folder, recursive=False)
+
+    def seed(self):
+        """
+        Indexes the files already in the folders.
+        """
+        for folder in self.folders():
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False):
+                        self.track(entry.path)
+
+    def track(self, path):
+        path = os.path.abspath(path)
+        policies = [policy for policy in self.policies if policy.matches(path)]
+        if not policies:
+            return
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.untrack(path)
+            return
+        with self._lock:
+            for policy in policies:
+                policy.track(path, stat.st_mtime, stat.st_size)
+
+    def untrack(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            for policy in self.policies:
+                policy.untrack(path)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.track(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.track(event.src_path)
+
+    def on_closed(self, event):
+        if not event.is_directory:
+            self.track(event.src_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.untrack(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.untrack(event.src_path)
+            self.track(event.dest_path)
+
+    def sweep(self, now=None):
+        """
+        Deletes up to ``batch_size`` files over the limits of their policy, oldest first.
+        :return: The number of files deleted and their total size.
+        """
+        now = time.time() if now is None else now
+        deleted = size_deleted = 0
+        for policy in self.policies:
+            while deleted < self.batch_size:
+                with self._lock:
+                    expired = policy.expired(now)
+                    if expired is None:
+                        break
+                    path, size = expired
+                    # Untracked first, so a new version of the file written meanwhile is tracked again
+                    policy.untrack(path)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    if self.logger:
+                        self.logger.error(f"Error deleting {path} for retention policy {policy.name}: {str(e)}",
+                                          stack_info=True, exc_info=True)
+                    continue
+                deleted += 1
+                size_deleted += size
+                self.deleted_files[policy.name].inc()
+                self.deleted_bytes[policy.name].inc(size)
+        self.counters["files"] += deleted
+        self.counters["bytes"] += size_deleted
+        return deleted, size_deleted
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self):
+        """
+        Returns the files and bytes indexed per policy and the totals deleted.
+        """
+        with self._lock:
+            policies = {policy.name: {"files": len(policy), "bytes": policy.total_bytes} for policy in self.policies}
+        return {"policies": policies, "deleted_files": self.counters["files"], "deleted_bytes": self.counters["bytes"]}
+
+    def _run(self):
+        try:
+            self.seed()
+        except OSError as e:
+            if self.logger:
+                self.logger.error(f"Error indexing the retention folders: {str(e)}", stack_info=True, exc_info=True)
+        while not self._stopped.wait(self.interval):
+            try:
+                deleted, size_deleted = self.sweep()
+                if deleted and self.logger:
+                    self.logger.info(f"Retention deleted {deleted} files, {size_deleted} bytes")
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Error in retention sweep: {str(e)}", stack_info=True, exc_info=True)
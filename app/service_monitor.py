@@ -1,7 +1,31 @@
+import os
 import sys
+import json
 import time
-import schedule
-from utils import logger_setup,is_process_running
+import select
+import subprocess
+import psutil
+from utils import logger_setup, is_process_running, heartbeat_age
+from telemetry import TelemetryCollector, TELEMETRY_FILE
+from metrics import fetch_summary, metrics_port
+
+# Seconds before a dead or hung service is restarted, doubled on every restart up to
+# MAX_RESTART_BACKOFF and reset once the service stayed up that long.
+RESTART_BACKOFF = 1
+MAX_RESTART_BACKOFF = 60
+
+# Seconds without a heartbeat after which a running service counts as hung and is killed.
+HEARTBEAT_TIMEOUT = 10
+
+# Seconds between two checks of the heartbeats, and upper bound on the exit detection
+# latency where pidfds are not available.
+CHECK_INTERVAL = 0.5
+
+# Seconds between two status logs.
+STATUS_LOG_INTERVAL = 5 * 60
+
+# PID file of manage_monitor_app.py, updated with the PIDs of restarted services.
+PID_FILE = "pids.json"
 
 
 def monitor_applications(logger, folder_monitor_pid, todecode_monitor_pid):
@@ -21,22 +45,185 @@ def monitor_applications(logger, folder_monitor_pid, todecode_monitor_pid):
         logger.warning("One or more applications are not running!")
 
 
+def log_retention(logger, service, summary):
+    """
+    Logs the files and bytes deleted so far by the retention policies of a service, from
+    its metrics summary (None if the service did not answer).
+    """
+    for name, value in (summary or {}).items():
+        if name.startswith(("monitor_retention_files_total", "monitor_retention_bytes_total")):
+            logger.info(f"Retention ({service}): {name} {value:g}")
+
+
+def monitor_components(logger, components):
+    """
+    Logs the status of components running in the supervisor process, see supervisor.py.
+    """
+    statuses = [(component.name, "Running" if component.is_alive() else "Not Running") for component in components]
+
+    for index, (name, status) in enumerate(statuses, start=1):
+        logger.info(f"Application {index} ({name}): {status}")
+
+    if any(status == "Not Running" for _, status in statuses):
+        logger.warning("One or more applications are not running!")
+
+
+class ServiceProcess:
+    """
+    A monitor process watched by service_monitor. Its command line and working directory
+    are read from the running process, so it can be started again the same way.
+    :param name: Service name, also the name of its heartbeat.
+    :param pid_key: Key of the service in PID_FILE.
+    """
+
+    def __init__(self, name, pid, pid_key):
+        self.name = name
+        self.pid_key = pid_key
+        self.popen = None
+        self.restarts = 0
+        self.delay = RESTART_BACKOFF
+        self.died_at = None
+        process = psutil.Process(pid)
+        self.cmdline = process.cmdline()
+        self.cwd = process.cwd()
+        self._attach(pid)
+
+    def _attach(self, pid):
+        self.pid = pid
+        self.started_at = time.monotonic()
+        self.pidfd = None
+        if hasattr(os, "pidfd_open"):
+            try:
+                self.pidfd = os.pidfd_open(pid)
+            except OSError:
+                # Already gone
+                self.died_at = time.monotonic()
+
+    def fileno(self):
+        return self.pidfd
+
+    def exited(self):
+        """
+        Marks the process as dead and reaps it if it is our child.
+        """
+        if self.pidfd is not None:
+            os.close(self.pidfd)
+            self.pidfd = None
+        if self.popen is not None:
+            self.popen.wait()
+        if time.monotonic() - self.started_at >= MAX_RESTART_BACKOFF:
+            self.delay = RESTART_BACKOFF
+        self.died_at = time.monotonic()
+
+    def restart(self):
+        self.popen = subprocess.Popen(self.cmdline, cwd=self.cwd)
+        self.restarts += 1
+        self.died_at = None
+        self.delay = min(self.delay * 2, MAX_RESTART_BACKOFF)
+        self._attach(self.popen.pid)
+
+    def kill(self):
+        try:
+            process = psutil.Process(self.pid)
+            process.terminate()
+            process.wait(timeout=5)
+        except psutil.TimeoutExpired:
+            process.kill()
+        except psutil.NoSuchProcess:
+            pass
+
+
+def wait_for_exit(services, timeout):
+    """
+    Waits up to ``timeout`` seconds for one of the services to exit.
+    With pidfds (Linux 5.3+) an exit wakes this up right away; otherwise the processes
+    are polled through psutil.
+    :return: The services that exited.
+    """
+    running = [service for service in services if service.died_at is None]
+    watched = [service for service in running if service.pidfd is not None]
+    if len(watched) == len(running):
+        if not watched:
+            time.sleep(timeout)
+            return []
+        ready, _, _ = select.select(watched, [], [], timeout)
+        return ready
+
+    processes = {}
+    for service in running:
+        try:
+            processes[service.pid] = psutil.Process(service.pid)
+        except psutil.NoSuchProcess:
+            return [service]
+    gone, _ = psutil.wait_procs(list(processes.values()), timeout=timeout)
+    return [service for service in running if service.pid in {process.pid for process in gone}]
+
+
+def update_pid_file(service):
+    try:
+        with open(os.path.join(service.cwd, PID_FILE), 'r') as f:
+            pids_data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return
+    pids_data[service.pid_key] = service.pid
+    with open(os.path.join(service.cwd, PID_FILE), 'w') as f:
+        json.dump(pids_data, f)
+
+
+def supervise(logger, services, heartbeat_timeout=HEARTBEAT_TIMEOUT, check_interval=CHECK_INTERVAL):
+    """
+    Runs one round of supervision: waits for exits, kills services whose heartbeat
+    stalled and restarts dead services whose backoff elapsed.
+    """
+    for service in wait_for_exit(services, check_interval):
+        service.exited()
+        logger.error(f"{service.name} (PID {service.pid}) exited, restarting in {service.delay} seconds")
+
+    now = time.monotonic()
+    for service in services:
+        if service.died_at is None:
+            age = heartbeat_age(service.name)
+            # A service gets the full timeout to send its first heartbeat after a start
+            if age is not None and min(age, now - service.started_at) > heartbeat_timeout:
+                logger.error(f"{service.name} (PID {service.pid}) sent no heartbeat for {age:.1f} seconds, killing it")
+                service.kill()
+        elif now - service.died_at >= service.delay:
+            try:
+                service.restart()
+                update_pid_file(service)
+                logger.info(f"{service.name} restarted with PID {service.pid} ({service.restarts} restarts)")
+            except Exception as e:
+                service.died_at = now
+                logger.error(f"Error restarting {service.name}: {str(e)}", stack_info=True, exc_info=True)
+
+
 def start_monitoring_service(folder_monitor_pid, todecode_monitor_pid,log_to_console):
     """
-    Starts the monitoring service to log the status of the two applications every 5 minutes.
+    Starts the monitoring service: restarts a monitor within moments of it exiting or
+    hanging, and logs the status of the two applications every 5 minutes.
     """
 
     logger = logger_setup('logs/app_status.log', log_to_console)
 
-    # Schedule to check the applications' status every 5 minutes
-    schedule.every(5).minutes.do(monitor_applications, folder_monitor_pid=folder_monitor_pid, todecode_monitor_pid=todecode_monitor_pid, logger=logger)
+    services = [
+        ServiceProcess("folder_monitor", int(folder_monitor_pid), "folder_proc_pid"),
+        ServiceProcess("todecode_monitor", int(todecode_monitor_pid), "todecode_proc_pid"),
+    ]
+
+    # CPU, memory, fds, threads and I/O of the monitors and their workers, as JSON lines
+    telemetry = TelemetryCollector(logger_setup(TELEMETRY_FILE, log_format="%(message)s").info)
 
     logger.info("Monitoring service started. Logging application status every 5 minutes.")
 
     try:
+        last_status_log = time.monotonic()
         while True:
-            schedule.run_pending()
-            time.sleep(1)
+            supervise(logger, services)
+            telemetry.sample({service.name: service.pid for service in services if service.died_at is None})
+            if time.monotonic() - last_status_log >= STATUS_LOG_INTERVAL:
+                monitor_applications(logger, services[0].pid, services[1].pid)
+                log_retention(logger, "todecode_monitor", fetch_summary(metrics_port("todecode_monitor")))
+                last_status_log = time.monotonic()
     except KeyboardInterrupt:
         logger.info("Monitoring service stopped.")
 
@@ -48,5 +235,5 @@ if __name__ == "__main__":
 
     folder_monitor_pid = sys.argv[1]
     todecode_monitor_pid = sys.argv[2]
-    log_to_console = sys.argv[3]
+    log_to_console = sys.argv[3] == "True"
     start_monitoring_service(folder_monitor_pid, todecode_monitor_pid, log_to_console)
@@ -0,0 +1,168 @@
+import os
+import socket
+import threading
+import time
+from collections import Counter
+
+# Seconds a claim is held without being renewed before another worker may take it over.
+LEASE_SECONDS = 300
+
+# Environment variable with a stable worker id. With one, a restarted worker hands back
+# its own claims right away instead of waiting for their leases to expire.
+WORKER_ID_ENV = "MONITOR_SPOOL_WORKER_ID"
+
+CLAIMED_FOLDER = "claimed"
+DONE_FOLDER = "done"
+FAILED_FOLDER = "failed"
+
+
+def default_worker_id():
+    return os.environ.get(WORKER_ID_ENV) or f"{socket.gethostname()}.{os.getpid()}"
+
+
+class Spool:
+    """
+    Shared spool folder that several workers, possibly on other hosts over a shared
+    mount, take archives from. A worker claims an archive by renaming it into its own
+    ``claimed/<worker id>/`` folder; only one rename of a file can succeed, so only one
+    worker gets it. The mtime of the claimed file is its lease: it is set when claiming
+    and renewed while the archive is processed. An archive whose lease expired (its
+    worker died or hung) is renamed back into the spool folder by any worker. Processed
+    archives are moved to ``done/``, failed ones to ``failed/``.
+
+    An archive is processed at least once: a worker that loses its lease keeps going, and
+    the worker taking the archive over processes it again. Leases compare the clocks of
+    the hosts, which must not drift apart by a good part of ``lease_seconds``.
+
+    :param folder: The spool folder.
+    :param worker_id: Name of this worker's claimed folder, unique among the workers.
+    :param lease_seconds: See LEASE_SECONDS.
+    """
+
+    def __init__(self, folder, worker_id=None, lease_seconds=LEASE_SECONDS):
+        self.folder = folder
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.claimed_folder = os.path.join(folder, CLAIMED_FOLDER, self.worker_id)
+        self.done_folder = os.path.join(folder, DONE_FOLDER)
+        self.failed_folder = os.path.join(folder, FAILED_FOLDER)
+        for path in (self.claimed_folder, self.done_folder, self.failed_folder):
+            os.makedirs(path, exist_ok=True)
+        self.counters = Counter()
+        self._lock = threading.Lock()
+        # Claimed path -> path in the spool folder, of the archives being processed
+        self._held = {}
+
+    def claim(self, path):
+        """
+        Claims the archive at ``path`` in the spool folder.
+        :return: Its path in this worker's claimed folder, or None if another worker was first.
+        """
+        claimed_path = os.path.join(self.claimed_folder, os.path.basename(path))
+        try:
+            # Starts the lease before the rename, so the claimed file never looks expired
+            os.utime(path)
+            os.rename(path, claimed_path)
+        except FileNotFoundError:
+            self.counters["lost_race"] += 1
+            return None
+        with self._lock:
+            self._held[claimed_path] = path
+        self.counters["claimed"] += 1
+        return claimed_path
+
+    def renew(self):
+        """
+        Renews the leases of the archives being processed. An archive another worker
+        took over is forgotten.
+        :return: The claimed paths whose lease was lost.
+        """
+        with self._lock:
+            held = list(self._held)
+        lost = []
+        for claimed_path in held:
+            try:
+                os.utime(claimed_path)
+            except FileNotFoundError:
+                lost.append(claimed_path)
+                with self._lock:
+                    self._held.pop(claimed_path, None)
+        self.counters["lost_lease"] += len(lost)
+        return lost
+
+    def complete(self, claimed_path, failed=False):
+        """
+        Moves a claimed archive to the done folder, or to the failed folder.
+        :return: The new path of the archive.
+        :raises FileNotFoundError: The lease was lost and another worker took the archive over.
+        """
+        with self._lock:
+            self._held.pop(claimed_path, None)
+        target = os.path.join(self.failed_folder if failed else self.done_folder, os.path.basename(claimed_path))
+        os.replace(claimed_path, target)
+        self.counters["failed" if failed else "done"] += 1
+        return target
+
+    def reclaim(self, now=None):
+        """
+        Renames the archives whose lease expired back into the spool folder, where
+        any worker can claim them again.
+        :return: Their paths in the spool folder.
+        """
+        now = time.time() if now is None else now
+        claimed_root = os.path.join(self.folder, CLAIMED_FOLDER)
+        reclaimed = []
+        for worker_id in os.listdir(claimed_root):
+            with os.scandir(os.path.join(claimed_root, worker_id)) as entries:
+                for entry in entries:
+                    try:
+                        if now - entry.stat().st_mtime < self.lease_seconds:
+                            continue
+                        path = os.path.join(self.folder, entry.name)
+                        os.rename(entry.path, path)
+                    except FileNotFoundError:
+                        # Completed or reclaimed by another worker meanwhile
+                        continue
+                    reclaimed.append(path)
+        self.counters["reclaimed"] += len(reclaimed)
+        return reclaimed
+
+    def recover(self):
+        """
+        Renames the archives left in this worker's claimed folder by a previous run back
+        into the spool folder. Only useful with a stable worker id.
+        :return: Their paths in the spool folder.
+        """
+        with self._lock:
+            held = set(self._held)
+        recovered = []
+        with os.scandir(self.claimed_folder) as entries:
+            for entry in entries:
+                if entry.path in held:
+                    continue
+                path = os.path.join(self.folder, entry.name)
+                os.rename(entry.path, path)
+                recovered.append(path)
+        self.counters["recovered"] += len(recovered)
+        return recovered
+
+    def pending(self, suffix):
+        """
+        Lists the unclaimed archives ending with ``suffix``, oldest first. Used where the
+        watcher cannot see the files added by other hosts, e.g. on NFS.
+        """
+        pending = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(suffix) and entry.is_file():
+                    try:
+                        pending.append((entry.stat().st_mtime_ns, entry.path))
+                    except FileNotFoundError:
+                        continue
+        pending.sort()
+        return [path for _, path in pending]
+
+    def stats(self):
+        with self._lock:
+            held = len(self._held)
+        return {"worker_id": self.worker_id, "held": held, "counters": dict(self.counters)}
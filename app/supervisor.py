@@ -0,0 +1,274 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from watchdog.observers import Observer
+from utils import logger_setup
+from journal import ProcessedJournal
+from pii_engine import PiiEngine
+from service_monitor import monitor_components, RESTART_BACKOFF, MAX_RESTART_BACKOFF
+from handoff import LocalHandoff
+from metrics import MetricsServer, metrics_port
+import folder_monitor
+import todecode_monitor
+
+# Seconds between two health checks of the components.
+SUPERVISOR_INTERVAL = 1
+
+# Seconds between two status logs of the health checker.
+STATUS_LOG_INTERVAL = 5 * 60
+
+logger = logger_setup('logs/supervisor.log')
+
+
+class PipelineComponent:
+    """
+    Runs the observer of one monitor handler. A restart schedules a new observer on the
+    same handler, so queued and in-flight files are kept, and runs the catch-up scan
+    again for the files that arrived while it was down.
+    :param watches: (folder, recursive) pairs, all watched by the observer.
+    :param catch_up_backlog: The catch_up_backlog function of the monitor module.
+    """
+
+    def __init__(self, name, event_handler, watches, catch_up_backlog):
+        self.name = name
+        self.event_handler = event_handler
+        self.watches = list(watches)
+        self.catch_up_backlog = catch_up_backlog
+        self.observer = None
+
+    def start(self):
+        self.observer = Observer()
+        for folder, recursive in self.watches:
+            self.observer.schedule(self.event_handler, folder, recursive=recursive)
+        self.observer.start()
+        for folder, recursive in self.watches:
+            # Only folder_monitor's catch-up takes the recursive flag, no other watch is recursive
+            args = (self.event_handler, folder, True) if recursive else (self.event_handler, folder)
+            threading.Thread(target=self.catch_up_backlog, args=args, daemon=True).start()
+
+    def stop(self):
+        if self.observer:
+            self.observer.stop()
+            if self.observer.is_alive():
+                self.observer.join()
+
+    def is_alive(self):
+        return self.observer is not None and self.observer.is_alive()
+
+    def stats(self):
+        return {"events": self.event_handler.events.stats(), "queue": self.event_handler.admission.stats()}
+
+
+class RetentionComponent:
+    """
+    Runs a RetentionEngine on an observer of its own. A restart indexes the folders again.
+    """
+
+    name = "retention"
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.observer = None
+
+    def start(self):
+        self.observer = Observer()
+        self.engine.schedule(self.observer)
+        self.observer.start()
+        self.engine.start()
+
+    def stop(self):
+        self.engine.stop()
+        if self.observer:
+            self.observer.stop()
+            if self.observer.is_alive():
+                self.observer.join()
+
+    def is_alive(self):
+        return self.engine.is_alive() and self.observer is not None and self.observer.is_alive()
+
+    def stats(self):
+        return self.engine.stats()
+
+
+class HealthChecker:
+    """
+    In-process replacement of service_monitor: logs the status of the other components
+    every ``interval`` seconds.
+    """
+
+    name = "service_monitor"
+
+    def __init__(self, components, log_to_console=False, interval=STATUS_LOG_INTERVAL):
+        self.components = components
+        self.interval = interval
+        self.logger = logger_setup('logs/app_status.log', log_to_console)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, name="health-checker", daemon=True)
+        self._thread.start()
+
+    def run(self):
+        self.logger.info(f"Monitoring service started. Logging application status every {self.interval} seconds.")
+        while not self._stopped.wait(self.interval):
+            monitor_components(self.logger, self.components)
+
+    def stop(self):
+        self._stopped.set()
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stats(self):
+        return {}
+
+
+class Supervisor:
+    """
+    Starts the components, checks them every ``interval`` seconds and restarts the
+    ones that died, with an exponential backoff.
+    A component has a ``name`` and ``start``, ``stop``, ``is_alive`` and ``stats`` methods.
+    """
+
+    def __init__(self, components, interval=SUPERVISOR_INTERVAL, backoff=RESTART_BACKOFF, max_backoff=MAX_RESTART_BACKOFF):
+        self.components = components
+        self.interval = interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.restarts = {component.name: 0 for component in components}
+        self._delays = {component.name: backoff for component in components}
+        self._started_at = {}
+        self._down_since = {}
+
+    def start(self):
+        for component in self.components:
+            component.start()
+            self._started_at[component.name] = time.monotonic()
+            logger.info(f"Component {component.name} started")
+
+    def stop(self):
+        for component in reversed(self.components):
+            try:
+                component.stop()
+            except Exception as e:
+                logger.error(f"Error stopping component {component.name}: {str(e)}", stack_info=True, exc_info=True)
+
+    def check(self):
+        """
+        Restarts the components that are down and whose backoff elapsed.
+        """
+        now = time.monotonic()
+        for component in self.components:
+            name = component.name
+            if component.is_alive():
+                if now - self._started_at[name] >= self.max_backoff:
+                    self._delays[name] = self.backoff
+                continue
+
+            if name not in self._down_since:
+                self._down_since[name] = now
+                logger.error(f"Component {name} is down, restarting in {self._delays[name]} seconds")
+            if now - self._down_since[name] < self._delays[name]:
+                continue
+
+            del self._down_since[name]
+            self._delays[name] = min(self._delays[name] * 2, self.max_backoff)
+            self.restarts[name] += 1
+            self._started_at[name] = now
+            try:
+                component.stop()
+                component.start()
+                logger.info(f"Component {name} restarted ({self.restarts[name]} restarts)")
+            except Exception as e:
+                logger.error(f"Error restarting component {name}: {str(e)}", stack_info=True, exc_info=True)
+
+    def run(self):
+        self.start()
+        try:
+            while True:
+                time.sleep(self.interval)
+                self.check()
+        except Exception as e:
+            logger.error(f"Error in Supervisor: {str(e)}", stack_info=True, exc_info=True)
+        finally:
+            self.stop()
+
+
+def start_supervisor(input_folder, output_folder, log_to_console=False, executor_mode=todecode_monitor.EXECUTOR_MODE):
+    """
+    Runs folder_monitor, todecode_monitor, the retention policies and the health checker
+    in this process. Both pipelines share one thread pool; todecode_monitor gets its own
+    process pool in the "process" executor mode.
+    :param input_folder: The folder to monitor for new .txt files, along with the folders
+                         of folder_monitor's watch file.
+    :param output_folder: The folder where filtered files will be stored.
+    """
+    todecode_folder = "todecode"
+    os.makedirs(todecode_folder, exist_ok=True)
+    watches = folder_monitor.load_watches(input_folder, output_folder=todecode_folder)
+    for _, _, output in watches:
+        os.makedirs(output, exist_ok=True)
+
+    thread_workers = folder_monitor.WORKER_TREAD_COUNT + todecode_monitor.WORKER_TREAD_COUNT
+    with ThreadPoolExecutor(max_workers=thread_workers) as executor:
+        zip_executor = executor
+        zip_workers = todecode_monitor.WORKER_TREAD_COUNT
+        if executor_mode == "process":
+            zip_executor = todecode_monitor.create_executor(executor_mode, output_folder, todecode_folder)
+            zip_workers = todecode_monitor.WORKER_PROCESS_COUNT
+
+        txt_journal = ProcessedJournal(folder_monitor.JOURNAL_FILE, base_folder=watches[0][0])
+        txt_handler = folder_monitor.TxtFileHandler(todecode_folder, executor, journal=txt_journal,
+                                                    routes=[(folder, output) for folder, _, output in watches
+                                                            if output != todecode_folder])
+        zip_handler = todecode_monitor.ZipFileHandler(output_folder, todecode_folder, zip_executor, PiiEngine(),
+                                                      workers=zip_workers,
+                                                      journal=ProcessedJournal(todecode_monitor.JOURNAL_FILE),
+                                                      cache=todecode_monitor.create_cache(),
+                                                      spool=todecode_monitor.create_spool(todecode_folder),
+                                                      writer=todecode_monitor.create_writer())
+        if folder_monitor.HANDOFF_MODE:
+            # Both stages live in this process, so the hand-off is a plain call
+            txt_handler.handoff = LocalHandoff(zip_handler.handoff)
+
+        components = [
+            PipelineComponent("folder_monitor", txt_handler, [(folder, recursive) for folder, recursive, _ in watches],
+                              folder_monitor.catch_up_backlog),
+            PipelineComponent("todecode_monitor", zip_handler, [(todecode_folder, False)],
+                              todecode_monitor.catch_up_backlog),
+        ]
+        retention = todecode_monitor.create_retention(todecode_folder, output_folder)
+        if retention:
+            components.append(RetentionComponent(retention))
+        components.append(HealthChecker(list(components), log_to_console))
+
+        logger.info(f"Supervisor started. Monitoring {len(watches)} folders: {', '.join(folder for folder, _, _ in watches)}")
+        if zip_handler.spool:
+            threading.Thread(target=todecode_monitor.run_spool, args=(zip_handler,), daemon=True).start()
+
+        # Both pipelines record into the same registry, served on one port
+        try:
+            MetricsServer(metrics_port("supervisor")).start()
+        except OSError as e:
+            logger.error(f"Metrics endpoint not started: {str(e)}", stack_info=True, exc_info=True)
+        try:
+            Supervisor(components).run()
+        finally:
+            if zip_executor is not executor:
+                zip_executor.shutdown()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Please provide input and output folders.")
+        sys.exit(1)
+
+    input_folder = sys.argv[1]
+    output_folder = sys.argv[2]
+    log_to_console = len(sys.argv) > 3 and sys.argv[3] == "True"
+    executor_mode = sys.argv[4] if len(sys.argv) > 4 else todecode_monitor.EXECUTOR_MODE
+    start_supervisor(input_folder, output_folder, log_to_console, executor_mode)
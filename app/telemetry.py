@@ -0,0 +1,146 @@
+import json
+import time
+from collections import deque
+import psutil
+
+# Samples kept per process in the ring buffer.
+TELEMETRY_SAMPLES = 900
+# Seconds between two samples of a process.
+TELEMETRY_INTERVAL = 1
+# Seconds covered by one summary line.
+TELEMETRY_WINDOW = 60
+TELEMETRY_FILE = "logs/telemetry.jsonl"
+
+# Sampled gauges, and counters reported as their increase over the window.
+GAUGES = ("cpu", "rss", "fds", "threads")
+COUNTERS = ("read_bytes", "write_bytes")
+
+
+class ProcessTelemetry:
+    """
+    Samples the resource use of one process into a ring buffer. The psutil.Process
+    handle is kept for the life of the process, so the CPU percentage is measured
+    since the previous sample.
+    """
+
+    def __init__(self, name, pid, samples=TELEMETRY_SAMPLES):
+        self.name = name
+        self.pid = pid
+        self.process = psutil.Process(pid)
+        self.samples = deque(maxlen=samples)
+        # The first call only starts the CPU measurement
+        self.process.cpu_percent(None)
+
+    def sample(self):
+        """
+        Appends a sample, see GAUGES and COUNTERS. Raises psutil.NoSuchProcess once the
+        process is gone.
+        """
+        with self.process.oneshot():
+            try:
+                io = self.process.io_counters()
+                read_bytes, write_bytes = io.read_bytes, io.write_bytes
+            except (AttributeError, psutil.AccessDenied):
+                # Not available on every platform
+                read_bytes = write_bytes = 0
+            self.samples.append((
+                time.time(),
+                self.process.cpu_percent(None),
+                self.process.memory_info().rss,
+                self.process.num_fds() if hasattr(self.process, "num_fds") else self.process.num_handles(),
+                self.process.num_threads(),
+                read_bytes,
+                write_bytes,
+            ))
+
+    def summary(self, since):
+        """
+        Summarizes the samples taken since the ``since`` timestamp.
+        :return: Dict with the min, max and percentiles of every gauge and the increase
+                 of every counter, or None if there is no sample.
+        """
+        window = [sample for sample in self.samples if sample[0] >= since]
+        if not window:
+            return None
+
+        summary = {"name": self.name, "pid": self.pid, "t": round(window[-1][0], 3), "n": len(window)}
+        for index, gauge in enumerate(GAUGES, start=1):
+            summary[gauge] = percentiles([sample[index] for sample in window])
+        for index, counter in enumerate(COUNTERS, start=len(GAUGES) + 1):
+            summary[counter] = window[-1][index] - window[0][index]
+        return summary
+
+
+class TelemetryCollector:
+    """
+    Samples a set of named processes, along with their child processes (e.g. the
+    process pool workers of todecode_monitor), and writes one compact JSON line per
+    process and window.
+    :param write: Called with every JSON line.
+    """
+
+    def __init__(self, write, interval=TELEMETRY_INTERVAL, window=TELEMETRY_WINDOW, samples=TELEMETRY_SAMPLES):
+        self.write = write
+        self.interval = interval
+        self.window = window
+        self.samples = samples
+        self.processes = {}
+        self._last_sample = 0
+        self._window_start = time.time()
+
+    def sample(self, targets):
+        """
+        Samples the processes if the interval elapsed.
+        :param targets: Dict of service name to PID; a changed PID (restarted service)
+                        starts a new ring buffer.
+        """
+        if time.monotonic() - self._last_sample < self.interval:
+            return
+        self._last_sample = time.monotonic()
+
+        current = {}
+        for name, pid in targets.items():
+            try:
+                process = psutil.Process(pid)
+                current[pid] = name
+                for child in process.children(recursive=True):
+                    current[child.pid] = f"{name}/worker"
+            except psutil.NoSuchProcess:
+                continue
+
+        for pid, name in current.items():
+            telemetry = self.processes.get(pid)
+            try:
+                if telemetry is None:
+                    telemetry = self.processes[pid] = ProcessTelemetry(name, pid, self.samples)
+                telemetry.sample()
+            except psutil.NoSuchProcess:
+                continue
+
+        if time.time() - self._window_start >= self.window:
+            self.flush()
+
+        # Keep the buffers of exited processes until their last window was written
+        for pid, telemetry in list(self.processes.items()):
+            if pid not in current and (not telemetry.samples or telemetry.samples[-1][0] < self._window_start):
+                del self.processes[pid]
+
+    def flush(self):
+        """
+        Writes the summary of the current window for every process.
+        """
+        for telemetry in self.processes.values():
+            summary = telemetry.summary(self._window_start)
+            if summary:
+                self.write(json.dumps(summary, separators=(",", ":")))
+        self._window_start = time.time()
+
+
+def percentiles(values):
+    values = sorted(values)
+    return {
+        "min": values[0],
+        "p50": values[len(values) // 2],
+        "p95": values[min(len(values) - 1, len(values) * 95 // 100)],
+        "max": values[-1],
+    }
@@ -1,71 +1,439 @@
 import pyzipper
+import io
 import os
 import glob
 import sys
+import threading
 import re
 import time
 import calendar
-from utils import logger_setup
-from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+from utils import logger_setup, write_heartbeat
+from pii_engine import PiiEngine
+from filter_cache import FilterCache, content_key
+from event_registry import FileEventRegistry, DEBOUNCE_SECONDS
+from admission import AdmissionQueue, HIGH_WATER_MARK
+from journal import ProcessedJournal, scan_backlog, catch_up
+from handoff import HandoffServer
+from spool import Spool, FAILED_FOLDER
+from retention import RetentionEngine, RetentionPolicy
+from output_writer import OutputWriter, temp_path
+from metrics import (MetricsServer, metrics_port, STAGE_SECONDS, FILES, BYTES, PII_RULE_SECONDS, PII_RULE_CHUNKS,
+                     FILTER_CACHE_LOOKUPS, TimedStream, register_queue_gauges)
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
 WORKER_TREAD_COUNT = 5
+WORKER_PROCESS_COUNT = os.cpu_count()
+
+# "thread" runs jobs on WORKER_TREAD_COUNT threads; "process" runs them on
+# WORKER_PROCESS_COUNT worker processes so the CPU bound PII filtering is not held by the GIL.
+EXECUTOR_MODE = "thread"
+
+# Zips waiting for a worker before QUEUE_OVERFLOW_POLICY ("block", "spill" or "drop") applies.
+QUEUE_HIGH_WATER_MARK = HIGH_WATER_MARK
+QUEUE_OVERFLOW_POLICY = "block"
+SPILL_FILE = "state/todecode_monitor.spill"
+
+# Processed .zip files, used to find the ones that arrived while the monitor was down.
+JOURNAL_FILE = "state/todecode_monitor.journal"
+
+# Opt-in: also accept zips from folder_monitor over a Unix socket, see handoff.py.
+HANDOFF_MODE = False
+# Most bytes of handed off zips kept in memory for the zips waiting in the queue. The
+# bytes of a zip handed off beyond it are dropped, and its job reads the zip from disk.
+HANDOFF_MEMORY_BYTES = 256 * 1024 * 1024
+
+# Opt-in: keep the filtered text of small members by content, so identical payloads
+# under other names are written without being filtered again, see filter_cache.py.
+# The cache is also kept in FILTER_CACHE_FOLDER, where process pool workers share it.
+FILTER_CACHE = False
+FILTER_CACHE_FOLDER = "state/filter_cache"
+
+# Opt-in: share the todecode folder with other todecode_monitor instances, on this host
+# or on others over a shared mount. Each zip is claimed with a lease before it is
+# processed, then moved to done/ or failed/ instead of being removed, see spool.py.
+SPOOL_MODE = False
+# Seconds between two renewals of the leases held, reclaims of expired leases and scans
+# of the spool folder for zips the watcher missed (e.g. written by another host on NFS).
+SPOOL_SCAN_INTERVAL = 5
+
+# Write the filtered files to a temp file, rename them once their data is on disk, and
+# remove the zip (or pii_filter's source) only then, so a crash never leaves a truncated
+# filtered file with its input gone. Durability is made in groups, see output_writer.py.
+DURABLE_OUTPUT = True
+
+# Retention of the files in the todecode ("{input}") and output ("{output}") folders, as
+# (folder, file name pattern, max age in seconds, max files, max bytes), None for no limit,
+# see retention.py. E.g. ("{output}", "PII_filtered_*.txt", 30 * 24 * 3600, None, 10 * 1024 ** 3)
+# keeps the filtered files for 30 days and 10 GB at most. Unprocessed zips are never deleted.
+RETENTION_POLICIES = (
+    # Temp files left behind by a crash while writing a zip or a filtered file; only the
+    # service's own ones in the output folder, which other applications may write to
+    ("{input}", "*.tmp", 3600, None, None),
+    ("{output}", "PII_filtered_*.txt.tmp", 3600, None, None),
+    # Zips that could not be filtered, and those done in spool mode
+    ("{input}/failed", "*.zip", 7 * 24 * 3600, None, None),
+    ("{input}/done", "*.zip", 24 * 3600, None, None),
+)
+
+# Seconds between two logs of the event and queue stats.
+STATS_LOG_INTERVAL = 60
 
 logger = logger_setup('logs/todecode_monitor.log')
 
+# Handler owned by a process pool worker, see _init_worker.
+_worker_handler = None
+# Output writer of a process pool worker, only used to name the temp files.
+_worker_writer = None
+
 
 class ZipFileHandler(FileSystemEventHandler):
     """
     Handler for detecting new zip files, unzipping them, and applying PII filtering.
     """
 
-    def __init__(self, output_folder, input_folder, executor):
+    def __init__(self, output_folder, input_folder, executor, pii_engine=None, debounce=DEBOUNCE_SECONDS,
+                 workers=WORKER_TREAD_COUNT, queue_size=QUEUE_HIGH_WATER_MARK, overflow=QUEUE_OVERFLOW_POLICY,
+                 journal=None, cache=None, spool=None, writer=None):
         super().__init__()
         self.output_folder = output_folder
         self.input_folder = input_folder
         self.executor = executor
+        self.pii_engine = pii_engine or PiiEngine()
+        self.cache = cache
+        self.spool = spool
+        # OutputWriter committing the filtered files, None to write them in place
+        self.writer = writer
+        # Bytes of handed off zips, read instead of the file until their job starts,
+        # HANDOFF_MEMORY_BYTES at most in total
+        self.archives = {}
+        self.archive_bytes = 0
+        self._archives_lock = threading.Lock()
+        self.admission = AdmissionQueue(self.submit, workers, queue_size, overflow, SPILL_FILE)
+        # Collapses the created/modified/touch events of a zip into a single job
+        self.events = FileEventRegistry(self.admission.offer, debounce, journal=journal, logger=logger)
+
+        self.pickup_seconds = STAGE_SECONDS.labels(stage="pickup")
+        self.decrypt_seconds = STAGE_SECONDS.labels(stage="decrypt")
+        self.filter_seconds = STAGE_SECONDS.labels(stage="pii_filter")
+        self.write_seconds = STAGE_SECONDS.labels(stage="write")
+        self.filtered_files = FILES.labels(stage="pii_filter", outcome="ok")
+        self.failed_files = FILES.labels(stage="pii_filter", outcome="failed")
+        self.filtered_bytes = BYTES.labels(stage="pii_filter")
+        self.cache_lookups = {outcome: FILTER_CACHE_LOOKUPS.labels(outcome=outcome) for outcome in ("hit", "miss")}
+        self.rule_metrics = {rule.name: (PII_RULE_SECONDS.labels(rule=rule.name),
+                                         PII_RULE_CHUNKS.labels(rule=rule.name, outcome="searched"),
+                                         PII_RULE_CHUNKS.labels(rule=rule.name, outcome="skipped"))
+                             for rule in self.pii_engine.rules}
+        register_queue_gauges("zip", self)
+        # Last, as the zips spilled by a previous run are dispatched right away
+        self.admission.start(self.events.ready)
 
     def on_modified(self, event):
         if event.src_path.endswith(".zip"):
             logger.info(f"Modified zip file detected: {event.src_path}")
-            self.executor.submit(self.process_files, event.src_path)
+            self.events.observe(event.src_path)
 
     def on_created(self, event):
         if event.src_path.endswith(".zip"):
             logger.info(f"New zip file detected: {event.src_path}")
-            self.executor.submit(self.process_files, event.src_path)
+            self.events.observe(event.src_path)
+
+    def handoff(self, name, data=b""):
+        """
+        Receives a zip that folder_monitor wrote to the input folder and passed along
+        directly, with its bytes if it was small enough. Process pool workers only get
+        the path, so they read the zip from disk, as do the jobs of zips handed off while
+        HANDOFF_MEMORY_BYTES are already held.
+        :return: True if the zip is now handled like one seen by the watcher, or already
+                 was; False if the queue dropped it, so folder_monitor falls back to the watcher.
+        """
+        zip_file_path = os.path.join(self.input_folder, os.path.basename(name))
+        logger.info(f"Handed off zip file received: {zip_file_path}")
+        if data and not isinstance(self.executor, ProcessPoolExecutor):
+            with self._archives_lock:
+                if self.archive_bytes + len(data) <= HANDOFF_MEMORY_BYTES and zip_file_path not in self.archives:
+                    self.archives[zip_file_path] = data
+                    self.archive_bytes += len(data)
+        if self.events.ready(zip_file_path):
+            return True
+        self.take_archive(zip_file_path)
+        return self.events.handled(zip_file_path)
+
+    def take_archive(self, zip_file_path):
+        """
+        Removes and returns the handed off bytes of a zip, or None if there are none.
+        """
+        with self._archives_lock:
+            data = self.archives.pop(zip_file_path, None)
+            if data is not None:
+                self.archive_bytes -= len(data)
+        return data
+
+    def submit(self, zip_file_path):
+        """
+        Queues one job per .txt member of the zip file, so the members of a batch zip are
+        filtered in parallel. Process pool workers only receive the path and member name
+        and report the result back, which is logged here in the parent.
+        In spool mode the zip is claimed first, and its members are read from the claimed copy.
+        :return: Future completed with the paths of the PII filtered files once all the
+                 members are done.
+        """
+        result = Future()
+        data = self.take_archive(zip_file_path)
+        claimed_path = zip_file_path
+        try:
+            try:
+                # From the zip being written (or touched) to its job starting
+                self.pickup_seconds.observe(time.time() - os.path.getmtime(zip_file_path))
+            except FileNotFoundError:
+                # In spool mode, claimed by another worker: the claim below tells
+                if not self.spool:
+                    raise
+            if self.spool:
+                claimed_path = self.spool.claim(zip_file_path)
+                if claimed_path is None:
+                    logger.info(f"Zip file {zip_file_path} claimed by another worker")
+                    self.events.release(zip_file_path, processed=False)
+                    result.set_result([])
+                    return result
+            members = self.list_members(claimed_path, data)
+        except Exception as e:
+            logger.error(f"Error reading zip file {zip_file_path}: {str(e)}", stack_info=True, exc_info=True)
+            if os.path.exists(claimed_path) and (not self.spool or claimed_path != zip_file_path):
+                # Moved to the failed folder
+                self.finish(zip_file_path, [], result, claimed_path, failed=True)
+                return result
+            self.events.release(zip_file_path)
+            result.set_result([])
+            return result
+
+        if isinstance(self.executor, ProcessPoolExecutor):
+            durable = self.writer is not None
+            jobs = [self.record_remote(self.executor.submit(_filter_member_in_worker, claimed_path, name, durable))
+                    for name in members]
+        else:
+            jobs = [self.executor.submit(self.filter_member, claimed_path, name, data) for name in members]
+
+        remaining = [len(jobs)]
+        lock = threading.Lock()
+
+        def done(job):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            self.finish(zip_file_path, jobs, result, claimed_path)
+
+        if not jobs:
+            self.finish(zip_file_path, jobs, result, claimed_path)
+        for job in jobs:
+            job.add_done_callback(done)
+        return result
+
+    def finish(self, zip_file_path, jobs, result, claimed_path=None, failed=False):
+        """
+        Logs the outcome of the member jobs of a zip file and commits its filtered files.
+        :param claimed_path: Path of the zip claimed from the spool.
+        :param failed: True if the zip could not be read.
+        """
+        filtered_files = []
+        for job in jobs:
+            try:
+                filtered_files.append(job.result())
+                self.filtered_files.inc()
+                logger.info(f"PII filtered file created: {filtered_files[-1]}")
+            except Exception as e:
+                failed = True
+                self.failed_files.inc()
+                logger.error(f"Error extracting and filtering zip file {zip_file_path}: {str(e)}", stack_info=True, exc_info=True)
+
+        if self.writer is None:
+            self.remove_input(zip_file_path, filtered_files, failed, claimed_path, result)
+            return
+        commit = self.writer.commit(filtered_files)
+        commit.add_done_callback(lambda commit: self.remove_input(zip_file_path, filtered_files, failed, claimed_path,
+                                                                  result, commit))
+
+    def remove_input(self, zip_file_path, filtered_files, failed, claimed_path, result, commit=None):
+        """
+        Removes the zip file once its filtered files are durable, if all of its members
+        were filtered; a zip with a failed member is moved to the failed folder. In spool
+        mode the claimed zip is moved to the done or failed folder instead.
+        :param commit: Future of the OutputWriter commit of the filtered files.
+        """
+        removed = False
+        try:
+            if commit is not None and commit.exception() is not None:
+                failed = True
+                logger.error(f"Error committing the filtered files of {zip_file_path}: {str(commit.exception())}",
+                             stack_info=True, exc_info=commit.exception())
+            if self.spool:
+                self.complete_claim(zip_file_path, claimed_path, failed)
+            elif failed:
+                failed_folder = os.path.join(os.path.dirname(zip_file_path), FAILED_FOLDER)
+                os.makedirs(failed_folder, exist_ok=True)
+                os.replace(zip_file_path, os.path.join(failed_folder, os.path.basename(zip_file_path)))
+            else:
+                os.remove(zip_file_path)
+            removed = True
+        except Exception as e:
+            logger.error(f"Error removing zip file {zip_file_path}: {str(e)}", stack_info=True, exc_info=True)
+        finally:
+            # A zip no longer in the input folder needs no journal entry
+            self.events.release(zip_file_path, removed=removed)
+            result.set_result(filtered_files)
+
+    def complete_claim(self, zip_file_path, claimed_path, failed):
+        """
+        Moves a zip claimed from the spool to the done or failed folder.
+        """
+        try:
+            self.spool.complete(claimed_path, failed)
+        except FileNotFoundError:
+            logger.warning(f"Lease of zip file {zip_file_path} expired, another worker took it over")
 
     def process_files(self, zip_file_path):
             try:
-                self.extract_and_filter(zip_file_path)
+                for filtered_file in self.extract_and_filter(zip_file_path):
+                    logger.info(f"PII filtered file created: {filtered_file}")
                 os.remove(zip_file_path)
             except Exception as e:
                 logger.error(f"Error extracting and filtering zip file {zip_file_path}: {str(e)}", stack_info=True, exc_info=True)
+            finally:
+                self.events.release(zip_file_path)
+
+    def list_members(self, zip_file, data=None):
+        """
+        Returns the names of the .txt members of the zip file. Reading the names needs no password.
+        :param data: Bytes of the zip file, read instead of the file if given.
+        """
+        with pyzipper.AESZipFile(io.BytesIO(data) if data else zip_file, 'r') as zf:
+            return [name for name in zf.namelist() if name.endswith('.txt')]
 
     def extract_and_filter(self, zip_file):
         """
-        Extracts the zip file and applies PII filtering on the text content.
+        Decrypts each .txt member of the zip file and streams it through the PII filter
+        straight into the output folder, so unfiltered text is never written to disk.
+        The members are filtered one after the other; submit spreads them over the workers.
+        :return: Paths of the PII filtered files created.
+        """
+        filtered_files = [self.filter_member(zip_file, name) for name in self.list_members(zip_file)]
+        if self.writer is not None:
+            self.writer.commit(filtered_files).result()
+        return filtered_files
+
+    def record_remote(self, job):
+        """
+        Records the timings a process pool worker sent back with the filtered file.
+        :return: Future completed with the path of the filtered file only.
+        """
+        result = Future()
+
+        def done(job):
+            try:
+                filtered_file, timings = job.result()
+            except Exception as e:
+                result.set_exception(e)
+                return
+            self.record_member(timings)
+            result.set_result(filtered_file)
+
+        job.add_done_callback(done)
+        return result
+
+    def record_member(self, timings):
+        self.decrypt_seconds.observe(timings["read"])
+        self.filter_seconds.observe(timings["filter"])
+        self.write_seconds.observe(timings["write"])
+        self.filtered_bytes.inc(timings["size"])
+        if "cache" in timings:
+            self.cache_lookups[timings["cache"]].inc()
+        for name, (seconds, searched, skipped) in timings.get("rules", {}).items():
+            rule_seconds, rule_searched, rule_skipped = self.rule_metrics[name]
+            rule_seconds.inc(seconds)
+            rule_searched.inc(searched)
+            rule_skipped.inc(skipped)
+
+    def filter_member(self, zip_file, name, data=None):
+        """
+        Decrypts one .txt member of the zip file and streams it through the PII filter.
+        :param data: Bytes of the zip file, read instead of the file if given.
+        :return: Path of the PII filtered file.
+        """
+        filtered_file, timings = self.measure_member(zip_file, name, data)
+        self.record_member(timings)
+        return filtered_file
+
+    def measure_member(self, zip_file, name, data=None):
+        """
+        Same as filter_member, but returns the timings instead of recording them, for
+        process pool workers whose metrics would stay in the worker.
+        :return: Path of the PII filtered file and the timings, see write_filtered.
         """
         password = self.extract_password(zip_file)
+        timings = {}
 
         try:
-            with pyzipper.AESZipFile(zip_file, 'r') as zf:
+            with pyzipper.AESZipFile(io.BytesIO(data) if data else zip_file, 'r') as zf:
                 zf.pwd = bytes(password, 'utf-8')
-                extracted_files = [name for name in zf.namelist() if name.endswith('.txt')]
-                zf.extractall(self.input_folder)
+                if self.cache is not None and zf.getinfo(name).file_size <= self.cache.max_item_bytes:
+                    return self.write_cached(zf, name, timings), timings
+                with io.TextIOWrapper(zf.open(name)) as source:
+                    return self.write_filtered(source, name, timings), timings
 
         except RuntimeError as e:
             logger.error(f"Error during extraction: {e} password:{password}", stack_info=True, exc_info=True)
-        except Exception as e:
-            logger.error(f"An unexpected error occurred: {e}", stack_info=True, exc_info=True)
+            raise
+
+    def write_cached(self, zf, name, timings):
+        """
+        Decrypts a member small enough for the cache and writes its filtered text, from
+        the cache if the same content was filtered before by the same rules.
+        :param timings: Dict filled as by write_filtered, plus "cache" ("hit" or "miss").
+        :return: Path of the PII filtered file.
+        """
+        started = time.perf_counter()
+        content = zf.read(name)
+        timings["read"] = time.perf_counter() - started
+        timings["size"] = len(content)
 
+        key = content_key(content, self.pii_engine.version)
+        text = self.cache.get(key)
+        timings["cache"] = "miss" if text is None else "hit"
+        started = time.perf_counter()
+        if text is None:
+            # Decoded and filtered exactly like a streamed member
+            target = io.StringIO(newline='')
+            timings["rules"] = {}
+            self.pii_engine.filter_stream(io.TextIOWrapper(io.BytesIO(content)), target, timings["rules"])
+            text = target.getvalue()
+            self.cache.put(key, text)
+        timings["filter"] = time.perf_counter() - started
 
-        for txt_file in extracted_files:
-            txt_file_path = os.path.join(self.input_folder, txt_file)
-            self.pii_filter(txt_file_path)
+        filtered_file = os.path.join(self.output_folder, f"PII_filtered_{os.path.basename(name)}")
+        started = time.perf_counter()
+        with open(self.output_path(filtered_file), 'w') as target:
+            target.write(text)
+        timings["write"] = time.perf_counter() - started
+        return filtered_file
 
     def pii_filter(self, file_path):
+        """
+        Applies PII filtering to a text file on disk and removes it once filtered.
+        """
+        with open(file_path, 'r') as source:
+            filtered_file = self.write_filtered(source, file_path)
+        if self.writer is not None:
+            self.writer.commit([filtered_file]).result()
+
+        logger.info(f"PII filtered file created: {filtered_file}")
+
+        os.remove(file_path)
+
+    def write_filtered(self, source, file_name, timings=None):
         """
         Filters out PII information from file paths and content such as:
         - File paths
@@ -73,63 +441,37 @@ class ZipFileHandler(FileSystemEventHandler):
         - Phone numbers
         - Social media accounts (Twitter, LinkedIn, Instagram, Facebook, GitHub)
         - Email addresses
+        The text is filtered in chunks, so memory use does not grow with its size.
+        :param source: Readable text stream with the unfiltered content.
+        :param file_name: Name of the original file, used to name the filtered file.
+        :param timings: Optional dict filled with the seconds spent reading ("read", which
+                        includes decryption for zip members), filtering ("filter") and
+                        writing ("write"), the size of the text read ("size") and the
+                        per rule stats of PiiEngine.filter_stream ("rules").
+        :return: Path of the PII filtered file.
         """
-        with open(file_path, 'r') as file:
-            content = file.read()
-
-        patterns = {
-            "file_paths": r"([A-Za-z]):(\\*)Users(\\*)([^\\]+)",
-            # Email addresses
-            "emails": r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b",
-            # Phone numbers (e.g., (123) 456-7890, 123-456-7890, +1-234-567-8900)
-            "phone_numbers": r"\b(?:\+?(\d{1,3})?[-.\s]?)?(?:\(?(\d{3})\)?[-.\s]?)?(\d{3})[-.\s]?(\d{4})\b",
-            # Dates (e.g., 12/25/2023, 25-12-2023, Dec 25, 2023, 25th December 2023)
-            "dates": r"\b(\d{1,2}[-/th|st|nd|rd\s]*[A-Za-z]{3,9}[-/\s]*\d{2,4}|\d{1,2}[-/]\d{1,2}[-/]\d{2,4}|[A-Za-z]{3,9} \d{1,2}(?:th|st|nd|rd)?, \d{4})\b",
-            # Social media patterns
-            "twitter": r"@([A-Za-z0-9_]{1,15})",  # Twitter handles
-            "linkedin": r"https?://(www\.)?linkedin\.com/in/[A-Za-z0-9_-]+",  # LinkedIn URLs
-            "instagram": r"@([A-Za-z0-9_.]{1,30})|https?://(www\.)?instagram\.com/[A-Za-z0-9_.]+",  # Instagram handles or URLs
-            "facebook": r"https?://(www\.)?facebook\.com/[A-Za-z0-9_.]+",  # Facebook URLs
-            "github": r"https?://(www\.)?github\.com/[A-Za-z0-9_-]+",  # GitHub URLs
-            # Physical addresses (simple example, could be refined)
-            "addresses": r"\b\d{1,4}\s[A-Za-z0-9\s]+(?:St|Street|Ave|Avenue|Blvd|Boulevard|Rd|Road|Lane|Ln|Dr|Drive|Ct|Court)\b",
-        }
-
-        replacements = {
-            "file_paths": lambda m: f'<d>{m.group(2)}Users{m.group(3)}<u>',
-            "emails": r"<email>",
-            "phone_numbers": r"<phone_number>",
-            "dates": r"<date>",
-            "twitter": r"<twitter_handle>",
-            "linkedin": r"<linkedin_profile>",
-            "instagram": r"<instagram_handle>",
-            "facebook": r"<facebook_profile>",
-            "github": r"<github_profile>",
-            "addresses": r"<address>",
-        }
-
-        for key, pattern in patterns.items():
-            content = re.sub(pattern, replacements[key], content)
-
-        # patterns = {
-        #     r"(?<!\\)\\[a-zA-Z](?=\\)": "<d>",                              # Disk Name
-        #     r"\\Users\\[^\\]+": "<u>",                                       # Username
-        #     r"\b(?:\d{1,3}\.){3}\d{1,3}\b": "<ip>",                          # IP Address
-        #     r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b": "<email>",# Email Address
-        #     r"\b(?:\d{1,2}[\/\.-]){2}\d{2,4}\b": "<date>",                   # Date (MM/DD/YYYY, DD.MM.YYYY, etc.)
-        #     r"\b\d{1,4}[-.\s]?\(?\d{1,4}\)?[-.\s]?\d{1,4}[-.\s]?\d{1,4}\b": "<phone>" # Phone number
-        # }
-    
-        # for pattern, replacements  in patterns.items():
-        #     content = re.sub(pattern, replacements, content)
-
-        filtered_file = os.path.join(self.output_folder, f"PII_filtered_{os.path.basename(file_path)}")
-        with open(filtered_file, 'w') as file:
-            file.write(content)
+        filtered_file = os.path.join(self.output_folder, f"PII_filtered_{os.path.basename(file_name)}")
+        started = time.perf_counter()
+        with open(self.output_path(filtered_file), 'w') as target:
+            if timings is None:
+                self.pii_engine.filter_stream(source, target)
+                return filtered_file
+            source, target = TimedStream(source), TimedStream(target)
+            timings["rules"] = {}
+            self.pii_engine.filter_stream(source, target, timings["rules"])
 
-        os.remove(file_path)
+        timings["read"] = source.seconds
+        timings["write"] = target.seconds
+        timings["filter"] = time.perf_counter() - started - source.seconds - target.seconds
+        timings["size"] = source.size
+        return filtered_file
 
-        logger.info(f"PII filtered file created: {filtered_file}")
+    def output_path(self, filtered_file):
+        """
+        Returns the path a filtered file is written to: its temp path if it is committed
+        by an OutputWriter, else the file itself.
+        """
+        return temp_path(filtered_file) if self.writer is not None else filtered_file
 
     def extract_password(self, file_path):
         """
@@ -151,28 +493,185 @@ class ZipFileHandler(FileSystemEventHandler):
             logger.error(f"Timestamp not found in the zip file name: {zip_file_name}", stack_info=True, exc_info=True)
 
 
-def start_todecode_monitor(output_folder):
+def catch_up_backlog(event_handler, folder):
+    """
+    Queues the .zip files that arrived in the folder while the monitor was down.
+    """
+    try:
+        backlog = scan_backlog(folder, ".zip", event_handler.events.journal)
+        logger.info(f"Catch-up scan found {len(backlog)} unprocessed zip files in {folder}")
+        for queued in catch_up(backlog, event_handler.events.ready):
+            logger.info(f"Catch-up queued {queued}/{len(backlog)} zip files")
+    except Exception as e:
+        logger.error(f"Error in catch-up scan of {folder}: {str(e)}", stack_info=True, exc_info=True)
+
+
+def run_spool(event_handler, interval=SPOOL_SCAN_INTERVAL):
+    """
+    Keeps the spool going: renews the leases of the zips being processed, hands the zips
+    whose lease expired back to the spool and queues the unclaimed zips of the spool folder.
+    """
+    spool = event_handler.spool
+    try:
+        recovered = spool.recover()
+        if recovered:
+            logger.info(f"Recovered {len(recovered)} zip files claimed by a previous run of {spool.worker_id}")
+    except Exception as e:
+        logger.error(f"Error recovering the claims of {spool.worker_id}: {str(e)}", stack_info=True, exc_info=True)
+
+    while True:
+        try:
+            for claimed_path in spool.renew():
+                logger.warning(f"Lease of zip file {claimed_path} lost, another worker took it over")
+            reclaimed = spool.reclaim()
+            if reclaimed:
+                logger.warning(f"Reclaimed {len(reclaimed)} zip files whose lease expired: {reclaimed}")
+            for zip_file_path in spool.pending(".zip"):
+                event_handler.events.ready(zip_file_path)
+        except Exception as e:
+            logger.error(f"Error in spool maintenance: {str(e)}", stack_info=True, exc_info=True)
+        time.sleep(interval)
+
+
+def _init_worker(output_folder, input_folder):
+    """
+    Runs once in every process pool worker: builds the handler, and with it the
+    compiled PII rules, that the worker reuses for all of its jobs.
+    """
+    global _worker_handler, _worker_writer
+    # Results and errors go back to the parent, which does all the logging.
+    logger.disabled = True
+    # Workers never queue zips themselves, so they stay off the parent's spill journal
+    _worker_handler = ZipFileHandler(output_folder, input_folder, None, debounce=0, overflow="drop",
+                                     cache=create_cache())
+    _worker_writer = OutputWriter()
+
+
+def _filter_member_in_worker(zip_file_path, name, durable=False):
+    # With durable output the worker only writes the temp files, the parent commits them
+    _worker_handler.writer = _worker_writer if durable else None
+    return _worker_handler.measure_member(zip_file_path, name)
+
+
+def create_cache():
+    """
+    Creates the filter cache if FILTER_CACHE is on, else returns None.
+    """
+    if not FILTER_CACHE:
+        return None
+    return FilterCache(folder=FILTER_CACHE_FOLDER)
+
+
+def create_writer():
+    """
+    Creates the output writer if DURABLE_OUTPUT is on, else returns None.
+    """
+    if not DURABLE_OUTPUT:
+        return None
+    return OutputWriter()
+
+
+def create_retention(input_folder, output_folder):
+    """
+    Creates the retention engine of RETENTION_POLICIES, or returns None if there are none.
+    """
+    if not RETENTION_POLICIES:
+        return None
+    policies = [RetentionPolicy(folder.format(input=input_folder, output=output_folder), pattern, max_age, max_files,
+                                max_bytes)
+                for folder, pattern, max_age, max_files, max_bytes in RETENTION_POLICIES]
+    return RetentionEngine(policies, logger=logger)
+
+
+def create_spool(folder):
+    """
+    Creates the spool of ``folder`` if SPOOL_MODE is on, else returns None.
+    """
+    if not SPOOL_MODE:
+        return None
+    return Spool(folder)
+
+
+def create_executor(executor_mode, output_folder, input_folder):
+    """
+    Creates the executor for the given mode, "thread" or "process".
+    """
+    if executor_mode == "process":
+        return ProcessPoolExecutor(max_workers=WORKER_PROCESS_COUNT,
+                                   mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=(output_folder, input_folder))
+    return ThreadPoolExecutor(max_workers=WORKER_TREAD_COUNT)
+
+
+def start_todecode_monitor(output_folder, executor_mode=EXECUTOR_MODE):
     """
     Starts the todecode folder monitor to unzip files and apply PII filtering.
     :param output_folder: The folder where filtered files will be stored.
+    :param executor_mode: "thread" or "process", see EXECUTOR_MODE.
     """
     input_folder = "todecode"
     os.makedirs(input_folder, exist_ok=True)
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        event_handler = ZipFileHandler(output_folder, input_folder, executor)
+    pii_engine = PiiEngine()
+    logger.info(f"PII rules: {', '.join(rule.name for rule in pii_engine.rules)}")
+
+    workers = WORKER_PROCESS_COUNT if executor_mode == "process" else WORKER_TREAD_COUNT
+    journal = ProcessedJournal(JOURNAL_FILE)
+
+    with create_executor(executor_mode, output_folder, input_folder) as executor:
+        event_handler = ZipFileHandler(output_folder, input_folder, executor, pii_engine, workers=workers,
+                                       journal=journal, cache=create_cache(), spool=create_spool(input_folder),
+                                       writer=create_writer())
         observer = Observer()
         observer.schedule(event_handler, input_folder, recursive=False)
+        # Fed by the same observer, so the folders are never listed again after the start
+        retention = create_retention(input_folder, output_folder)
+        if retention:
+            retention.schedule(observer)
         observer.start()
+        if retention:
+            retention.start()
 
         logger.info(f"Todecode folder monitor started. Monitoring folder: {input_folder}")
 
         try:
+            MetricsServer(metrics_port("todecode_monitor")).start()
+        except OSError as e:
+            logger.error(f"Metrics endpoint not started: {str(e)}", stack_info=True, exc_info=True)
+
+        handoff_server = None
+        if HANDOFF_MODE:
+            handoff_server = HandoffServer(event_handler.handoff)
+            handoff_server.start()
+
+        # The observer is already running, so nothing arriving during the scan is missed
+        threading.Thread(target=catch_up_backlog, args=(event_handler, input_folder), daemon=True).start()
+        if event_handler.spool:
+            logger.info(f"Spool mode, worker id {event_handler.spool.worker_id}")
+            threading.Thread(target=run_spool, args=(event_handler,), daemon=True).start()
+
+        try:
+            last_stats_log = time.monotonic()
             while True:
                 time.sleep(1)
+                # No heartbeat once the observer died, so service_monitor restarts the service
+                if observer.is_alive():
+                    write_heartbeat("todecode_monitor")
+                if time.monotonic() - last_stats_log >= STATS_LOG_INTERVAL:
+                    logger.info(f"Zip event stats: {event_handler.events.stats()}")
+                    logger.info(f"Zip queue stats: {event_handler.admission.stats()}")
+                    if event_handler.spool:
+                        logger.info(f"Spool stats: {event_handler.spool.stats()}")
+                    if retention:
+                        logger.info(f"Retention stats: {retention.stats()}")
+                    last_stats_log = time.monotonic()
         except Exception as e:
             logger.error(f"Error in Todecode Monitor: {str(e)}", stack_info=True, exc_info=True)
             observer.stop()
+            if retention:
+                retention.stop()
+            if handoff_server:
+                handoff_server.stop()
 
         observer.join()
 
@@ -182,4 +681,5 @@ if __name__ == "__main__":
         sys.exit(1)
 
     output_folder = sys.argv[1]
-    start_todecode_monitor(output_folder)
\ No newline at end of file
+    executor_mode = sys.argv[2] if len(sys.argv) > 2 else EXECUTOR_MODE
+    start_todecode_monitor(output_folder, executor_mode)
\ No newline at end of file
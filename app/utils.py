@@ -1,35 +1,209 @@
 import os
+import json
+import time
+import queue
+import atexit
+import pathlib
 import logging
-from logging.handlers import RotatingFileHandler
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler
 import psutil
 
+# Folder of the heartbeat files the monitors touch every second, see service_monitor.
+HEARTBEAT_DIR = "state"
 
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
 
-def logger_setup(log_file, console_output=False):
+# Opt-in: log calls only queue the record, and one listener thread per log file
+# writes them in batches and rotates the file. Records arriving while LOG_QUEUE_SIZE
+# records are waiting are dropped and counted.
+ASYNC_LOGGING = False
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 512
+
+# Write the service logs as JSON lines instead of LOG_FORMAT.
+LOG_JSON = False
+
+# Environment variable with a folder the log files of logs/ are written to instead,
+# e.g. a temporary folder for the tests.
+LOG_DIR_ENV = "MONITOR_LOG_DIR"
+
+
+def logger_setup(log_file, console_output=False, log_format=LOG_FORMAT):
     """
     Configures logging with rotating file logs. Log file size is limited to 1MB with a backup count of 5.
     :param log_file: The path of the log file to save logs.
     :param console_output: If True, logs will also be printed to the console.
+    :param log_format: Format of the log lines, e.g. "%(message)s" for data files.
     """
+    log_dir = os.environ.get(LOG_DIR_ENV)
+    if log_dir and os.path.dirname(log_file) == "logs":
+        log_file = os.path.join(log_dir, os.path.basename(log_file))
     logger = logging.getLogger(log_file)  
     logger.setLevel(logging.INFO)
 
+    formatter = JsonFormatter() if LOG_JSON and log_format == LOG_FORMAT else logging.Formatter(log_format)
+
     # Check if the logger already has handlers to avoid adding them multiple times
     if not logger.handlers:
         # File handler for rotating logs
         os.makedirs(os.path.dirname(log_file), exist_ok=True)  
-        file_handler = RotatingFileHandler(log_file, maxBytes=1024 * 1024, backupCount=5)
-        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        logger.addHandler(file_handler)
+        if ASYNC_LOGGING:
+            file_handler = BatchRotatingFileHandler(log_file, maxBytes=1024 * 1024, backupCount=5)
+            file_handler.setFormatter(formatter)
+            listener = LogListener(queue.Queue(LOG_QUEUE_SIZE), [file_handler])
+            listener.start()
+            atexit.register(listener.stop)
+            logger.addHandler(DroppingQueueHandler(listener))
+        else:
+            file_handler = RotatingFileHandler(log_file, maxBytes=1024 * 1024, backupCount=5)
+            file_handler.setFormatter(formatter)
+            logger.addHandler(file_handler)
 
     if console_output:
         console_handler = logging.StreamHandler()
-        console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        logger.addHandler(console_handler)
+        console_handler.setFormatter(formatter)
+        queue_handler = next((handler for handler in logger.handlers if isinstance(handler, DroppingQueueHandler)), None)
+        if queue_handler:
+            queue_handler.listener.handlers.append(console_handler)
+        else:
+            logger.addHandler(console_handler)
         
     return logger
 
 
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(entry)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records to a LogListener without blocking: once its queue is full, records
+    are dropped and counted in ``dropped``.
+    Records are queued as they are; their message and traceback are formatted by the
+    listener thread, off the caller's path.
+    """
+
+    def __init__(self, listener):
+        super().__init__(listener.queue)
+        self.listener = listener
+        listener.source = self
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class BatchRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler that writes a batch of records at once and checks for rollover
+    once per batch.
+    """
+
+    def emit_batch(self, records):
+        if not records:
+            return
+        lines = []
+        for record in records:
+            try:
+                lines.append(self.format(record) + self.terminator)
+            except Exception:
+                self.handleError(record)
+        text = "".join(lines)
+
+        with self.lock:
+            try:
+                if self.stream is None:
+                    self.stream = self._open()
+                if self.maxBytes > 0 and self.stream.tell() + len(text) >= self.maxBytes:
+                    self.doRollover()
+                self.stream.write(text)
+                self.stream.flush()
+            except Exception:
+                self.handleError(records[-1])
+
+
+class LogListener:
+    """
+    Thread taking records off ``queue`` and handing them to ``handlers``, up to
+    ``batch_size`` records at a time. Records dropped by the source DroppingQueueHandler
+    are reported with a warning.
+    """
+
+    _STOP = object()
+
+    def __init__(self, queue, handlers, batch_size=LOG_BATCH_SIZE):
+        self.queue = queue
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.source = None
+        self._reported_drops = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Writes the records still queued and stops the thread.
+        """
+        if self._thread:
+            self.queue.put(self._STOP)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = self._STOP in batch
+            batch = [record for record in batch if record is not self._STOP]
+            if self.source and self.source.dropped > self._reported_drops:
+                dropped = self.source.dropped - self._reported_drops
+                self._reported_drops = self.source.dropped
+                batch.append(logging.makeLogRecord({"name": batch[0].name if batch else "logging", "levelno": logging.WARNING,
+                                                    "levelname": "WARNING", "msg": f"{dropped} log records dropped, the log queue was full"}))
+            if batch:
+                self.handle(batch)
+            if stopping:
+                return
+
+    def handle(self, batch):
+        for handler in self.handlers:
+            if isinstance(handler, BatchRotatingFileHandler):
+                handler.emit_batch([record for record in batch if record.levelno >= handler.level])
+            else:
+                for record in batch:
+                    handler.handle(record)
+
+
 def is_process_running(pid):
     """
     Check if a process with the given PID is running.
@@ -41,6 +215,24 @@ def is_process_running(pid):
         process = psutil.Process(pid)
         return process.is_running() and process.status() != psutil.STATUS_ZOMBIE
     except Exception as e:
-        print(f"Error checking process with PID {pid}: {str(e)}", stack_info=True, exc_info=True)
+        print(f"Error checking process with PID {pid}: {str(e)}")
         return False
 
+
+def write_heartbeat(name):
+    """
+    Records that the service ``name`` is alive by touching its heartbeat file.
+    """
+    os.makedirs(HEARTBEAT_DIR, exist_ok=True)
+    pathlib.Path(HEARTBEAT_DIR, f"{name}.heartbeat").touch()
+
+
+def heartbeat_age(name):
+    """
+    Returns the seconds since the last heartbeat of the service ``name``, or None if it never sent one.
+    """
+    try:
+        return time.time() - os.path.getmtime(os.path.join(HEARTBEAT_DIR, f"{name}.heartbeat"))
+    except FileNotFoundError:
+        return None
+
@@ -0,0 +1,225 @@
+import os
+import errno
+import threading
+import time
+from watchdog.observers import Observer
+from watchdog.events import FileCreatedEvent, FileModifiedEvent
+
+# Seconds between two scans of the folders the poller watches.
+POLL_INTERVAL = 1.0
+# Seconds between two full scans, which also catch files rewritten in place (their
+# folder's mtime does not change).
+FULL_SCAN_INTERVAL = 60
+# A folder modified this recently is listed again on the next scan, as another file
+# may have arrived within the same mtime tick.
+RACY_SECONDS = 2
+
+# inotify errors meaning the watch or instance limit was reached (fs.inotify.max_user_watches
+# and fs.inotify.max_user_instances), which the poller takes over from.
+WATCH_LIMIT_ERRNOS = (errno.ENOSPC, errno.EMFILE)
+
+
+class ScandirPoller:
+    """
+    Watches folders by listing them with os.scandir, for when inotify runs out of
+    watches. It keeps an index of the mtime of every folder and the (size, mtime) of
+    every file: a scan stats each folder but only lists the ones whose mtime changed,
+    and reports the files that are new or changed as created or modified events.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL, full_scan_interval=FULL_SCAN_INTERVAL):
+        self.interval = interval
+        self.full_scan_interval = full_scan_interval
+        self._lock = threading.Lock()
+        # Root folder -> (handler, recursive)
+        self._watches = {}
+        # Folder -> (root, mtime_ns, {file name: (size, mtime_ns)})
+        self._folders = {}
+        self._stopped = threading.Event()
+        self._thread = None
+        self._last_full_scan = time.monotonic()
+
+    def add(self, handler, folder, recursive=False):
+        """
+        Starts watching ``folder``. The files already there are indexed, not reported.
+        """
+        with self._lock:
+            self._watches[folder] = (handler, recursive)
+            self._index(folder, folder, emit=False)
+
+    def __len__(self):
+        return len(self._watches)
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="scandir-poller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def join(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def scan(self, full=False):
+        """
+        Reports the files created or modified since the previous scan.
+        :param full: List every folder, not only the ones whose mtime changed.
+        """
+        with self._lock:
+            for folder, (root, mtime_ns, _) in list(self._folders.items()):
+                try:
+                    current = os.stat(folder).st_mtime_ns
+                except FileNotFoundError:
+                    self._forget(folder)
+                    continue
+                racy = time.time_ns() - current < RACY_SECONDS * 1_000_000_000
+                if full or racy or current != mtime_ns:
+                    self._index(folder, root, emit=True)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            full = time.monotonic() - self._last_full_scan >= self.full_scan_interval
+            if full:
+                self._last_full_scan = time.monotonic()
+            self.scan(full)
+
+    def _index(self, folder, root, emit):
+        # Called with the lock held: lists ``folder``, reports its new and changed files
+        # and indexes its subfolders if the watch is recursive.
+        handler, recursive = self._watches[root]
+        previous = self._folders.get(folder, (root, None, {}))[2]
+        try:
+            mtime_ns = os.stat(folder).st_mtime_ns
+            files = {}
+            subfolders = []
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subfolders.append(entry.path)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            self._forget(folder)
+            return
+
+        self._folders[folder] = (root, mtime_ns, files)
+        if emit:
+            for name, signature in files.items():
+                if name not in previous:
+                    handler.dispatch(FileCreatedEvent(os.path.join(folder, name)))
+                elif previous[name] != signature:
+                    handler.dispatch(FileModifiedEvent(os.path.join(folder, name)))
+
+        if recursive:
+            for subfolder in subfolders:
+                if subfolder not in self._folders:
+                    # Files already in a folder created since the previous scan are new too
+                    self._index(subfolder, root, emit=emit)
+
+    def _forget(self, folder):
+        for known in [known for known in self._folders if known == folder or known.startswith(folder + os.sep)]:
+            del self._folders[known]
+
+
+class FolderWatcher:
+    """
+    Watches many folders, recursively or not, on one shared watchdog observer. A folder
+    inotify cannot watch because its limits are reached, whether when it is added or
+    later (e.g. new subfolders of a recursive watch), is handed to a ScandirPoller
+    instead of going unwatched.
+    """
+
+    def __init__(self, poll_interval=POLL_INTERVAL, logger=None):
+        self.observer = Observer()
+        self.poller = ScandirPoller(poll_interval)
+        self.logger = logger
+        # Folder -> (handler, recursive, watchdog watch or None once polled)
+        self.watches = {}
+        self._started = False
+
+    def add(self, handler, folder, recursive=False):
+        folder = os.path.abspath(folder)
+        try:
+            watch = self.observer.schedule(handler, folder, recursive=recursive)
+        except OSError as e:
+            if e.errno not in WATCH_LIMIT_ERRNOS:
+                raise
+            self._fall_back(handler, folder, recursive, e)
+            return
+        self.watches[folder] = (handler, recursive, watch)
+
+    def start(self):
+        try:
+            self.observer.start()
+        except OSError as e:
+            # A watch scheduled before the start failed to start, poll it and the ones after it
+            if e.errno not in WATCH_LIMIT_ERRNOS:
+                raise
+            self.observer = self._restart_observer(e)
+        if len(self.poller):
+            self.poller.start()
+        self._started = True
+
+    def check(self):
+        """
+        Moves the folders whose inotify watch died (e.g. it ran out of watches while
+        adding a new subfolder) to the poller.
+        :return: The folders moved.
+        """
+        dead = {emitter.watch for emitter in self.observer.emitters if not emitter.is_alive()}
+        moved = []
+        for folder, (handler, recursive, watch) in list(self.watches.items()):
+            if watch is not None and watch in dead:
+                self.observer.unschedule(watch)
+                self._fall_back(handler, folder, recursive, OSError(errno.ENOSPC, "inotify watch stopped"))
+                moved.append(folder)
+        return moved
+
+    def stop(self):
+        self.observer.stop()
+        self.poller.stop()
+
+    def join(self):
+        if self.observer.is_alive():
+            self.observer.join()
+        self.poller.join()
+
+    def is_alive(self):
+        return self.observer.is_alive() and (not len(self.poller) or self.poller.is_alive())
+
+    def stats(self):
+        polled = len(self.poller)
+        return {"folders": len(self.watches), "inotify": len(self.watches) - polled, "polled": polled}
+
+    def _fall_back(self, handler, folder, recursive, error):
+        if self.logger:
+            self.logger.warning(f"Cannot watch {folder} with inotify ({error.strerror}), polling it every "
+                                f"{self.poller.interval} seconds instead")
+        self.watches[folder] = (handler, recursive, None)
+        self.poller.add(handler, folder, recursive)
+        if self._started and not self.poller.is_alive():
+            self.poller.start()
+
+    def _restart_observer(self, error):
+        # Observer.start stops at the first emitter failing to start. Every watch is
+        # scheduled again on a running observer, which starts its emitter right away,
+        # so only the ones inotify still cannot take are polled.
+        self.observer.stop()
+        observer = Observer()
+        observer.start()
+        for folder, (handler, recursive, watch) in list(self.watches.items()):
+            if watch is None:
+                continue
+            try:
+                self.watches[folder] = (handler, recursive, observer.schedule(handler, folder, recursive=recursive))
+            except OSError as e:
+                if e.errno not in WATCH_LIMIT_ERRNOS:
+                    raise
+                self._fall_back(handler, folder, recursive, e)
+        return observer
@@ -0,0 +1,82 @@
+"""
+Checks the import time of each service entry point against a budget, so their cold
+start stays fast (e.g. manage_monitor_app must not load tkinter for --stop):
+
+    python benchmarks/import_budget.py --budget-ms 300
+
+Each module is imported with -X importtime in a fresh interpreter, from a temporary
+working folder as the services create their logs on import. The best of --repeat runs
+is kept, so writing the .pyc files is not counted. Prints the import time of every
+module and its slowest imports as JSON, and exits with 1 if one is over budget.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+MODULES = ("manage_monitor_app", "folder_monitor", "todecode_monitor", "service_monitor", "supervisor")
+
+# Milliseconds each module may take to import, including everything it imports.
+IMPORT_BUDGET_MS = 300
+SLOWEST_IMPORTS = 5
+
+
+def parse_importtime(output):
+    """
+    Parses the -X importtime lines of ``output``.
+    :return: (name, self microseconds, cumulative microseconds, depth) of every import.
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+def measure(module, repeat=3):
+    """
+    Imports ``module`` in fresh interpreters.
+    :return: The import time in milliseconds and the slowest imports of the best run.
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join((os.path.abspath(ROOT), os.path.abspath(os.path.join(ROOT, "app")))))
+    best = None
+    with tempfile.TemporaryDirectory(prefix="import_budget_") as workdir:
+        for _ in range(repeat):
+            completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                       cwd=workdir, env=env, capture_output=True, text=True, check=True)
+            imports = parse_importtime(completed.stderr)
+            total = next(cumulative for name, _, cumulative, depth in imports if name == module and depth == 0)
+            if best is None or total < best[0]:
+                best = (total, imports)
+
+    total, imports = best
+    slowest = sorted(imports, key=lambda entry: entry[1], reverse=True)[:SLOWEST_IMPORTS]
+    return round(total / 1000, 1), {name: round(self_us / 1000, 1) for name, self_us, _, _ in slowest}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the import time of the service entry points.")
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_BUDGET_MS, help="Budget of each module in milliseconds.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per module, the best one is kept.")
+    parser.add_argument("--module", choices=MODULES, action="append", help="Module to check, repeatable. All of them by default.")
+    args = parser.parse_args()
+
+    results = []
+    for module in args.module or MODULES:
+        milliseconds, slowest = measure(module, args.repeat)
+        results.append({"module": module, "import_ms": milliseconds, "budget_ms": args.budget_ms,
+                        "over_budget": milliseconds > args.budget_ms, "slowest_ms": slowest})
+
+    print(json.dumps(results, indent=2))
+    if any(result["over_budget"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+End-to-end benchmark of the zip -> decrypt -> PII filter pipeline.
+
+Generates a synthetic .txt corpus (reproducible from --seed) and runs each scenario
+in its own interpreter, so the peak RSS reported is the scenario's own:
+
+- create_zip:         TxtFileHandler.create_zip on every file
+- extract_and_filter: ZipFileHandler.extract_and_filter on every zip
+- pii_filter:         ZipFileHandler.pii_filter on every file
+- live:               both watchers running, from writing a .txt file to its PII filtered file
+
+Results are printed (or written with --output) as JSON:
+
+    python benchmarks/pipeline_benchmark.py --files 500 --size 8192 --pii-density 0.2
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import platform
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app"))
+
+SCENARIOS = ("create_zip", "extract_and_filter", "pii_filter", "live")
+
+# Seconds the live scenario waits for the last filtered file.
+LIVE_TIMEOUT = 120
+
+FILLER_WORDS = ("the", "request", "was", "processed", "by", "service", "worker", "queue", "status", "ok",
+                "retry", "payload", "session", "token", "started", "finished", "cache", "miss", "hit", "node")
+FIRST_NAMES = ("john", "maria", "wei", "fatima", "olga", "diego", "amara", "kenji")
+
+
+def pii_token(rng):
+    """
+    Returns one random piece of PII of a kind the PII rules look for.
+    """
+    name = rng.choice(FIRST_NAMES)
+    kind = rng.randrange(6)
+    if kind == 0:
+        return f"{name}.{rng.randrange(1000)}@example.com"
+    if kind == 1:
+        return f"({rng.randrange(200, 999)}) {rng.randrange(200, 999)}-{rng.randrange(10000):04d}"
+    if kind == 2:
+        return f'"file_path" : "C:\\\\Users\\\\{name}\\\\Documents\\\\report_{rng.randrange(100)}.docx"'
+    if kind == 3:
+        return f"{rng.randrange(1, 13):02d}/{rng.randrange(1, 29):02d}/{rng.randrange(1950, 2025)}"
+    if kind == 4:
+        return f"@{name}_{rng.randrange(1000)}"
+    return f"https://github.com/{name}{rng.randrange(1000)}"
+
+
+def generate_text(rng, size, pii_density):
+    """
+    Returns about ``size`` characters of log-like lines; each line holds a piece of
+    PII with probability ``pii_density``.
+    """
+    lines = []
+    length = 0
+    while length < size:
+        words = [rng.choice(FILLER_WORDS) for _ in range(rng.randrange(6, 14))]
+        if rng.random() < pii_density:
+            words.insert(rng.randrange(len(words)), pii_token(rng))
+        line = " ".join(words)
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)[:size] + "\n"
+
+
+def generate_corpus(folder, files, size, pii_density, seed):
+    """
+    Writes ``files`` .txt files of about ``size`` bytes to ``folder``.
+    :return: Paths of the files, in order.
+    """
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for index in range(files):
+        path = os.path.join(folder, f"bench_{index:06d}.txt")
+        with open(path, 'w') as file:
+            file.write(generate_text(rng, size, pii_density))
+        paths.append(path)
+    return paths
+
+
+def summarize(scenario, latencies, seconds, files, size):
+    latencies = sorted(latencies)
+    return {
+        "scenario": scenario,
+        "files": files,
+        "bytes": size,
+        "seconds": round(seconds, 6),
+        "files_per_s": round(files / seconds, 3) if seconds else None,
+        "mb_per_s": round(size / seconds / 1e6, 3) if seconds else None,
+        "latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 3) if latencies else None,
+        "latency_p99_ms": round(latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1000, 3) if latencies else None,
+        # ru_maxrss is in KiB on Linux and in bytes on macOS
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+    }
+
+
+def timed(function, items):
+    """
+    Calls ``function`` on every item.
+    :return: Per-call latencies and the total seconds.
+    """
+    latencies = []
+    started = time.perf_counter()
+    for item in items:
+        call_started = time.perf_counter()
+        function(item)
+        latencies.append(time.perf_counter() - call_started)
+    return latencies, time.perf_counter() - started
+
+
+def run_scenario(scenario, workdir, files, size, pii_density, seed):
+    """
+    Runs one scenario in ``workdir`` and returns its results.
+    """
+    from folder_monitor import TxtFileHandler
+    from todecode_monitor import ZipFileHandler
+
+    corpus = generate_corpus(os.path.join(workdir, "corpus"), files, size, pii_density, seed)
+    total_size = sum(os.path.getsize(path) for path in corpus)
+    zip_folder = os.path.join(workdir, "todecode")
+    output_folder = os.path.join(workdir, "output")
+    os.makedirs(zip_folder, exist_ok=True)
+    os.makedirs(output_folder, exist_ok=True)
+
+    if scenario == "create_zip":
+        handler = TxtFileHandler(zip_folder, None)
+        latencies, seconds = timed(handler.create_zip, corpus)
+
+    elif scenario == "extract_and_filter":
+        zipper = TxtFileHandler(zip_folder, None)
+        zips = [zipper.create_zip(path) for path in corpus]
+        handler = ZipFileHandler(output_folder, zip_folder, None)
+        latencies, seconds = timed(handler.extract_and_filter, zips)
+
+    elif scenario == "pii_filter":
+        copies = []
+        for path in corpus:
+            copies.append(shutil.copy(path, zip_folder))
+        handler = ZipFileHandler(output_folder, zip_folder, None)
+        latencies, seconds = timed(handler.pii_filter, copies)
+
+    elif scenario == "live":
+        latencies, seconds = run_live(corpus, workdir, zip_folder, output_folder)
+
+    else:
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+    return summarize(scenario, latencies, seconds, files, total_size)
+
+
+def run_live(corpus, workdir, zip_folder, output_folder):
+    """
+    Copies the corpus into the watched folder one file after the other and waits for
+    every PII filtered file.
+    :return: Latencies from each file being written to its filtered file, and the total seconds.
+    """
+    from watchdog.observers import Observer
+    from folder_monitor import TxtFileHandler, WORKER_TREAD_COUNT
+    from todecode_monitor import ZipFileHandler
+
+    input_folder = os.path.join(workdir, "input")
+    os.makedirs(input_folder, exist_ok=True)
+
+    with ThreadPoolExecutor(WORKER_TREAD_COUNT) as txt_executor, ThreadPoolExecutor(WORKER_TREAD_COUNT) as zip_executor:
+        observers = []
+        for handler, folder in ((TxtFileHandler(zip_folder, txt_executor), input_folder),
+                                (ZipFileHandler(output_folder, zip_folder, zip_executor), zip_folder)):
+            observer = Observer()
+            observer.schedule(handler, folder, recursive=False)
+            observer.start()
+            observers.append(observer)
+
+        written = {}
+        started = time.perf_counter()
+        for path in corpus:
+            shutil.copy(path, input_folder)
+            written[f"PII_filtered_{os.path.basename(path)}"] = time.perf_counter()
+
+        done = {}
+        deadline = time.perf_counter() + LIVE_TIMEOUT
+        while len(done) < len(written) and time.perf_counter() < deadline:
+            with os.scandir(output_folder) as entries:
+                for entry in entries:
+                    if entry.name in written and entry.name not in done:
+                        done[entry.name] = time.perf_counter()
+            time.sleep(0.001)
+        seconds = time.perf_counter() - started
+
+        for observer in observers:
+            observer.stop()
+            observer.join()
+
+    if len(done) < len(written):
+        raise TimeoutError(f"Only {len(done)} of {len(written)} files were filtered within {LIVE_TIMEOUT} seconds")
+    return [done[name] - written[name] for name in done], seconds
+
+
+def run_isolated(scenario, args):
+    """
+    Runs a scenario in a fresh interpreter and working directory.
+    """
+    with tempfile.TemporaryDirectory(prefix=f"bench_{scenario}_") as workdir:
+        command = [sys.executable, os.path.abspath(__file__), "--scenario", scenario,
+                   "--files", str(args.files), "--size", str(args.size),
+                   "--pii-density", str(args.pii_density), "--seed", str(args.seed)]
+        # The monitors write their logs and state relative to the working directory
+        completed = subprocess.run(command, cwd=workdir, capture_output=True, text=True, check=True)
+        return json.loads(completed.stdout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the zip -> decrypt -> PII filter pipeline.")
+    parser.add_argument("--files", type=int, default=200, help="Number of .txt files in the corpus.")
+    parser.add_argument("--size", type=int, default=16 * 1024, help="Size of each .txt file in bytes.")
+    parser.add_argument("--pii-density", type=float, default=0.2, help="Share of lines holding a piece of PII.")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the corpus generator.")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append",
+                        help="Scenario to run, repeatable. All of them by default.")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout.")
+    args = parser.parse_args()
+
+    if args.scenario and len(args.scenario) == 1 and os.environ.get("PIPELINE_BENCHMARK_CHILD"):
+        print(json.dumps(run_scenario(args.scenario[0], os.getcwd(), args.files, args.size, args.pii_density, args.seed)))
+        return
+
+    os.environ["PIPELINE_BENCHMARK_CHILD"] = "1"
+    report = {
+        "config": {"files": args.files, "size": args.size, "pii_density": args.pii_density, "seed": args.seed},
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": [run_isolated(scenario, args) for scenario in (args.scenario or SCENARIOS)],
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,55 +4,167 @@ import sys
 import time
 import json
 import signal
+import argparse
 import psutil
-from app.select_folder import select_folders
 from app.utils import is_process_running
+from app.metrics import METRICS_PORTS, METRICS_PORT_OFFSET_ENV, fetch_summary, format_summary
 
-FOLDER_MONITOR = "app/folder_monitor.py"
-TODECODE_MONITOR = "app/todecode_monitor.py"
-SERVICE_MONITOR = "app/service_monitor.py"
+APP_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app")
+FOLDER_MONITOR = os.path.join(APP_FOLDER, "folder_monitor.py")
+TODECODE_MONITOR = os.path.join(APP_FOLDER, "todecode_monitor.py")
+SERVICE_MONITOR = os.path.join(APP_FOLDER, "service_monitor.py")
+SUPERVISOR = os.path.join(APP_FOLDER, "supervisor.py")
 LOG_FILE = "logs/app_status.log"
 PID_FILE = 'pids.json'
+METRICS_LOG_INTERVAL = 60
+
+# Input and output folders of the pipelines, when not given with --input/--output:
+# os.pathsep separated lists in these environment variables, else CONFIG_FILE, a JSON
+# object like {"pipelines": [{"input": "...", "output": "..."}]}. The folder dialogs
+# only open when none of them is set.
+INPUT_FOLDERS_ENV = "MONITOR_INPUT_FOLDERS"
+OUTPUT_FOLDERS_ENV = "MONITOR_OUTPUT_FOLDERS"
+CONFIG_FILE = "config/monitor.json"
+
+# The first pipeline runs in the current folder. Every other one gets its own working
+# folder under PIPELINES_FOLDER for its logs, state and todecode folder, and its own
+# metrics ports, PIPELINE_PORT_STRIDE above the previous pipeline's.
+PIPELINES_FOLDER = "pipelines"
+PIPELINE_PORT_STRIDE = 10
+
+# Config files of the services, resolved against the current folder and passed to every
+# pipeline through these environment variables (pii_engine.PII_RULES_FILE_ENV and
+# folder_monitor.WATCH_FILE_ENV). The PII rules apply to all the pipelines; the extra
+# folders of the watch file are only watched by the first one, or every pipeline would
+# zip their files.
+PII_RULES_FILE_ENV = "MONITOR_PII_RULES_FILE"
+PII_RULES_FILE = "config/pii_rules.json"
+WATCH_FILE_ENV = "MONITOR_WATCH_FILE"
+WATCH_FILE = "config/watch.json"
 
 folder_proc = None
 todecode_proc = None
 service_proc = None
 
-def save_pids(folder_proc_pid=None, todecode_proc_pid=None, service_proc_pid=None):
+def save_pids(folder_proc_pid=None, todecode_proc_pid=None, service_proc_pid=None, pid_file=PID_FILE, pipelines=None):
     pids_data = {
         "folder_proc_pid": folder_proc_pid,
         "todecode_proc_pid": todecode_proc_pid,
         "service_proc_pid": service_proc_pid
     }
-    with open(PID_FILE, 'w') as f:
+    if pipelines:
+        # Working folders of the other pipelines, each with its own PID file
+        pids_data["pipelines"] = pipelines
+    with open(pid_file, 'w') as f:
         json.dump(pids_data, f)
     time.sleep(1)  # Small delay to ensure the file is written properly
 
-def get_pids():
+def get_pids(pid_file=PID_FILE):
     try:
-        with open(PID_FILE, 'r') as f:
+        with open(pid_file, 'r') as f:
             pids_data = json.load(f)
         folder_pid = int(pids_data.get("folder_proc_pid"))
         todecode_pid = int(pids_data.get("todecode_proc_pid"))
         service_pid = int(pids_data.get("service_proc_pid"))
         return folder_pid, todecode_pid, service_pid
-    except (FileNotFoundError, ValueError):
+    except (FileNotFoundError, ValueError, TypeError):
         return None, None, None
 
-def start_services(log_to_console=False):
-    global folder_proc, todecode_proc, service_proc
+def get_pipeline_folders():
+    """
+    Returns the working folders of all the started pipelines, the current folder first.
+    """
+    try:
+        with open(PID_FILE, 'r') as f:
+            return ["."] + json.load(f).get("pipelines", [])
+    except (FileNotFoundError, ValueError):
+        return ["."]
+
+def load_pipelines(input_folders=None, output_folders=None, config_file=CONFIG_FILE):
+    """
+    Returns the (input folder, output folder) pairs given on the command line, else in
+    the environment, else in the config file, as absolute paths; empty if none is set.
+    Raises ValueError if the folders do not pair up.
+    """
+    if not input_folders and not output_folders:
+        input_folders = [folder for folder in os.environ.get(INPUT_FOLDERS_ENV, "").split(os.pathsep) if folder]
+        output_folders = [folder for folder in os.environ.get(OUTPUT_FOLDERS_ENV, "").split(os.pathsep) if folder]
+    if not input_folders and not output_folders and os.path.exists(config_file):
+        with open(config_file, 'r') as f:
+            pipelines = json.load(f).get("pipelines", [])
+        input_folders = [pipeline["input"] for pipeline in pipelines]
+        output_folders = [pipeline["output"] for pipeline in pipelines]
+
+    input_folders, output_folders = input_folders or [], output_folders or []
+    if len(input_folders) != len(output_folders):
+        raise ValueError(f"{len(input_folders)} input folders for {len(output_folders)} output folders")
+    pipelines = [(os.path.abspath(input_folder), os.path.abspath(output_folder))
+                 for input_folder, output_folder in zip(input_folders, output_folders)]
+    for input_folder, output_folder in pipelines:
+        if input_folder == output_folder:
+            raise ValueError(f"Input and output folders cannot be the same: {input_folder}")
+    return pipelines
+
+def select_pipelines(args):
+    """
+    Returns the pipelines to start, see load_pipelines, asking for the folders with the
+    dialogs of select_folder if none is configured and --headless is not set.
+    """
+    try:
+        pipelines = load_pipelines(args.input, args.output, args.config)
+    except (ValueError, KeyError) as e:
+        print(f"Invalid folder configuration: {str(e)}")
+        sys.exit(1)
+    if pipelines or args.headless:
+        return pipelines
 
+    # Only imported here, so tkinter is not needed (nor loaded) otherwise
+    from app.select_folder import select_folders
     input_folder, output_folder = select_folders()
+    return [(input_folder, output_folder)] if input_folder and output_folder else []
+
+def start_pipeline(input_folder, output_folder, log_to_console, single_process, workdir, env):
+    """
+    Starts the services of one pipeline in ``workdir``.
+    :return: The PIDs of folder_monitor, todecode_monitor and service_monitor.
+    """
+    if single_process:
+        # One supervisor process runs all three services, so it stands for each of them
+        proc = subprocess.Popen([sys.executable, SUPERVISOR, input_folder, output_folder, str(log_to_console)],
+                                cwd=workdir, env=env)
+        return proc.pid, proc.pid, proc.pid
 
-    if not input_folder or not output_folder:
+    folder_proc = subprocess.Popen([sys.executable, FOLDER_MONITOR, input_folder], cwd=workdir, env=env)
+    todecode_proc = subprocess.Popen([sys.executable, TODECODE_MONITOR, output_folder], cwd=workdir, env=env)
+    service_proc = subprocess.Popen([sys.executable, SERVICE_MONITOR, str(folder_proc.pid), str(todecode_proc.pid), str(log_to_console)],
+                                    cwd=workdir, env=env)
+    return folder_proc.pid, todecode_proc.pid, service_proc.pid
+
+def start_services(pipelines, log_to_console=False, single_process=False):
+    if not pipelines:
         print("Folders not selected. Exiting.")
         sys.exit(1)
 
-    folder_proc = subprocess.Popen([sys.executable, FOLDER_MONITOR, input_folder])
-    todecode_proc = subprocess.Popen([sys.executable, TODECODE_MONITOR, output_folder])
-    service_proc = subprocess.Popen([sys.executable, SERVICE_MONITOR, str(folder_proc.pid), str(todecode_proc.pid), str(log_to_console)])
-
-    save_pids(folder_proc.pid, todecode_proc.pid, service_proc.pid)
+    workdirs = ["."] + [os.path.join(PIPELINES_FOLDER, str(index)) for index in range(1, len(pipelines))]
+    pii_rules_file = os.path.abspath(os.environ.get(PII_RULES_FILE_ENV) or PII_RULES_FILE)
+    watch_file = os.environ.get(WATCH_FILE_ENV, WATCH_FILE)
+    watch_file = os.path.abspath(watch_file) if watch_file else ""
+    first_pids = None
+    for index, ((input_folder, output_folder), workdir) in enumerate(zip(pipelines, workdirs)):
+        os.makedirs(workdir, exist_ok=True)
+        env = dict(os.environ, **{
+            METRICS_PORT_OFFSET_ENV: str(index * PIPELINE_PORT_STRIDE),
+            PII_RULES_FILE_ENV: pii_rules_file,
+            WATCH_FILE_ENV: "" if index else watch_file,
+        })
+        pids = start_pipeline(input_folder, output_folder, log_to_console, single_process, workdir, env)
+        print(f"Pipeline {input_folder} -> {output_folder} started")
+        if index:
+            save_pids(*pids, pid_file=os.path.join(workdir, PID_FILE))
+        else:
+            first_pids = pids
+    # The current folder's PID file is written last, as it lists the other pipelines
+    save_pids(*first_pids, pipelines=workdirs[1:])
 
 def stop_services():
     folder_proc_pid, todecode_proc_pid, service_proc_pid = get_pids()
@@ -75,40 +187,77 @@ def stop_services():
         except Exception as e:
             print(f"Error terminating process with PID {pid}: {str(e)}")
 
-    terminate_proc(folder_proc_pid)
-    terminate_proc(todecode_proc_pid)
-    terminate_proc(service_proc_pid)
+    # The other pipelines first, as the current folder's PID file lists them
+    for workdir in reversed(get_pipeline_folders()):
+        pid_file = os.path.join(workdir, PID_FILE)
+        folder_proc_pid, todecode_proc_pid, service_proc_pid = get_pids(pid_file)
+        # service_monitor first, or it restarts the monitors being stopped.
+        # In single process mode all three PIDs are the supervisor's
+        for pid in dict.fromkeys((service_proc_pid, folder_proc_pid, todecode_proc_pid)):
+            if pid is not None:
+                terminate_proc(pid)
+
+        if os.path.exists(pid_file):
+            os.remove(pid_file)
     
     print("All services terminated.")
-    
-    if os.path.exists(PID_FILE):
-        os.remove(PID_FILE) 
 
     sys.exit(0)
 
+def print_metrics(pipelines=1):
+    """
+    Prints the stage latencies, counters and queue gauges of the running services
+    every METRICS_LOG_INTERVAL seconds, until interrupted.
+    :param pipelines: Number of pipelines started, see PIPELINE_PORT_STRIDE.
+    """
+    while True:
+        time.sleep(METRICS_LOG_INTERVAL)
+        for index in range(pipelines):
+            for service, port in METRICS_PORTS.items():
+                summary = fetch_summary(port + index * PIPELINE_PORT_STRIDE)
+                if summary:
+                    prefix = f"[{service}]" if not index else f"[{service} {index}]"
+                    for line in format_summary(summary):
+                        print(f"{prefix} {line}")
+
 def handle_keyboard_interrupt(signum, frame):
     print("\nKeyboard interrupt received. Stopping all services...")
     stop_services()
     sys.exit(0)
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Start or stop the monitoring services.")
+    parser.add_argument("--stop", action="store_true", help="Stop the running services.")
+    parser.add_argument("--log", action="store_true", help="Print the status logs and metrics to the console.")
+    parser.add_argument("--single-process", action="store_true", help="Run the services of a pipeline in one process.")
+    parser.add_argument("--input", action="append", help="Input folder of a pipeline, repeatable.")
+    parser.add_argument("--output", action="append", help="Output folder of a pipeline, repeatable, in the order of --input.")
+    parser.add_argument("--config", default=CONFIG_FILE, help=f"Config file with the pipelines (default: {CONFIG_FILE}).")
+    parser.add_argument("--headless", action="store_true", help="Never open the folder dialogs.")
+    return parser.parse_args(argv)
+
 def main():
     signal.signal(signal.SIGINT, handle_keyboard_interrupt)  # Handle Ctrl+C
     signal.signal(signal.SIGTSTP, handle_keyboard_interrupt)  # Handle Ctrl+Z
 
-    if "--stop" in sys.argv:
+    args = parse_args()
+
+    if args.stop:
         if are_services_running():
             stop_services()
         else:
             print("No service running!")
-    elif "--log" in sys.argv:
+    elif args.log:
         if are_services_running():
             print("All services are already running")
         else:
             print("Starting all services and printing logs...")
-            start_services(log_to_console=True)
+            pipelines = select_pipelines(args)
+            start_services(pipelines, log_to_console=True, single_process=args.single_process)
+            print_metrics(len(pipelines))
     else:
         print("Starting all services...")
-        start_services()
+        start_services(select_pipelines(args), single_process=args.single_process)
 
 def are_services_running():
     folder_proc_pid, todecode_proc_pid, service_proc_pid = get_pids()
@@ -0,0 +1,16 @@
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+# The services import each other as top-level modules, as when run from app/
+APP_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+if APP_FOLDER not in sys.path:
+    sys.path.insert(0, APP_FOLDER)
+
+# The services log to logs/ on import; the tests and the interpreters they start log to
+# a temporary folder instead (see utils.LOG_DIR_ENV)
+if "MONITOR_LOG_DIR" not in os.environ:
+    os.environ["MONITOR_LOG_DIR"] = tempfile.mkdtemp(prefix="monitor_test_logs_")
+    atexit.register(shutil.rmtree, os.environ["MONITOR_LOG_DIR"], ignore_errors=True)
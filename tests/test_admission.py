@@ -0,0 +1,139 @@
+import os
+import threading
+import unittest
+from concurrent.futures import Future
+
+from app.admission import AdmissionQueue
+
+
+class TestAdmissionQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.spill_path = 'test_state/test.spill'
+        self.started = []
+        self.futures = []
+
+    def tearDown(self):
+        if os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+            os.rmdir(os.path.dirname(self.spill_path))
+
+    def dispatch(self, path):
+        future = Future()
+        self.started.append(path)
+        self.futures.append(future)
+        return future
+
+    def finish_next(self):
+        self.futures.pop(0).set_result(None)
+
+    def test_runs_at_most_workers_jobs(self):
+        admission = AdmissionQueue(self.dispatch, workers=2)
+        for index in range(5):
+            admission.offer(f'file_{index}.zip')
+
+        self.assertEqual(self.started, ['file_0.zip', 'file_1.zip'])
+        self.assertEqual(admission.stats()["depth"], 3)
+
+        self.finish_next()
+        self.assertEqual(self.started, ['file_0.zip', 'file_1.zip', 'file_2.zip'])
+        self.assertIn("wait_p99", admission.stats())
+
+    def test_size_lanes(self):
+        admission = AdmissionQueue(self.dispatch, workers=5)
+        for index in range(3):
+            admission.offer(f'large_{index}.zip', size=10 ** 9)
+        for index in range(3):
+            admission.offer(f'medium_{index}.zip', size=10 ** 7)
+        for index in range(6):
+            admission.offer(f'small_{index}.zip', size=100)
+
+        # One large and three medium files at most, the last worker is left to small files
+        self.assertEqual(self.started, ['large_0.zip', 'medium_0.zip', 'medium_1.zip', 'medium_2.zip', 'small_0.zip'])
+
+        # Free workers take small files first
+        self.finish_next()
+        self.finish_next()
+        self.assertEqual(self.started[5:], ['small_1.zip', 'small_2.zip'])
+
+        stats = admission.stats()
+        self.assertEqual(stats["depth"], 5)
+        self.assertEqual(stats["lanes"]["large"]["depth"], 2)
+        self.assertEqual(stats["lanes"]["small"]["running"], 3)
+        self.assertIn("latency_p99", stats["lanes"]["large"])
+        self.assertNotIn("latency_p99", stats["lanes"]["small"])
+
+    def test_drop_policy(self):
+        admission = AdmissionQueue(self.dispatch, workers=1, high_water=1, policy="drop")
+
+        self.assertTrue(admission.offer('file_0.zip'))
+        self.assertTrue(admission.offer('file_1.zip'))
+        self.assertFalse(admission.offer('file_2.zip'))
+        self.assertEqual(admission.stats()["counters"]["dropped"], 1)
+
+    def test_spill_policy_keeps_order(self):
+        admission = AdmissionQueue(self.dispatch, workers=1, high_water=1, policy="spill",
+                                   spill_path=self.spill_path)
+        for index in range(5):
+            admission.offer(f'file_{index}.zip')
+
+        self.assertEqual(admission.stats()["spilled_depth"], 3)
+        for _ in range(4):
+            self.finish_next()
+
+        self.assertEqual(self.started, [f'file_{index}.zip' for index in range(5)])
+        self.assertEqual(admission.stats()["spilled_depth"], 0)
+
+    def test_spilled_paths_survive_restart(self):
+        admission = AdmissionQueue(self.dispatch, workers=1, high_water=1, policy="spill",
+                                   spill_path=self.spill_path)
+        for index in range(3):
+            admission.offer(f'file_{index}.zip')
+
+        self.started = []
+        restarted = AdmissionQueue(self.dispatch, workers=1, high_water=1, policy="spill", spill_path=self.spill_path)
+        # Nothing is dispatched before start
+        self.assertEqual(self.started, [])
+        restarted.start(restarted.offer)
+        self.assertEqual(self.started, ['file_2.zip'])
+        self.assertFalse(os.path.exists(restarted.replay_path))
+
+    def test_block_policy_waits_for_room(self):
+        admission = AdmissionQueue(self.dispatch, workers=1, high_water=1, policy="block")
+        admission.offer('file_0.zip')
+        admission.offer('file_1.zip')
+
+        blocked = threading.Thread(target=admission.offer, args=('file_2.zip',))
+        blocked.start()
+        blocked.join(0.1)
+        self.assertTrue(blocked.is_alive())
+
+        self.finish_next()
+        blocked.join(1)
+        self.assertFalse(blocked.is_alive())
+        self.assertEqual(admission.stats()["counters"]["blocked"], 1)
+
+    def test_jobs_done_on_dispatch(self):
+        # Jobs whose future is already done when dispatched, e.g. a zip without .txt files
+        def dispatch(path):
+            self.started.append(path)
+            if path == 'slow.zip':
+                self.futures.append(Future())
+                return self.futures[-1]
+            future = Future()
+            future.set_result(None)
+            return future
+
+        admission = AdmissionQueue(dispatch, workers=1)
+        admission.offer('slow.zip')
+        for index in range(3000):
+            admission.offer(f'empty_{index}.zip')
+
+        self.finish_next()
+        self.assertEqual(len(self.started), 3001)
+        stats = admission.stats()
+        self.assertEqual((stats["depth"], stats["running"]), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
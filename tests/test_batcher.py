@@ -0,0 +1,61 @@
+import os
+import time
+import unittest
+from concurrent.futures import Future
+
+from app.batcher import Batcher
+
+
+class TestBatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.batches = []
+        self.jobs = []
+
+    def flush(self, paths):
+        job = Future()
+        self.batches.append(paths)
+        self.jobs.append(job)
+        return job
+
+    def test_flushes_when_full(self):
+        batcher = Batcher(self.flush, max_files=3, max_delay=10)
+        futures = [batcher.add(f'file_{index}.txt') for index in range(4)]
+
+        self.assertEqual(self.batches, [['file_0.txt', 'file_1.txt', 'file_2.txt']])
+        self.jobs[0].set_result('batch.zip')
+        self.assertEqual([future.done() for future in futures], [True, True, True, False])
+        self.assertEqual(futures[0].result(), 'batch.zip')
+
+    def test_flushes_on_size(self):
+        test_file = 'test_batch.txt'
+        with open(test_file, 'w') as f:
+            f.write("x" * 100)
+        try:
+            batcher = Batcher(self.flush, max_bytes=150, max_delay=10)
+            batcher.add(test_file)
+            self.assertEqual(self.batches, [])
+            batcher.add(test_file)
+            self.assertEqual(self.batches, [[test_file, test_file]])
+        finally:
+            os.remove(test_file)
+
+    def test_flushes_after_delay(self):
+        batcher = Batcher(self.flush, max_delay=0.05)
+        batcher.add('file_0.txt')
+        batcher.add('file_1.txt')
+
+        time.sleep(0.3)
+        self.assertEqual(self.batches, [['file_0.txt', 'file_1.txt']])
+
+    def test_error_reaches_every_file(self):
+        batcher = Batcher(self.flush, max_files=2, max_delay=10)
+        futures = [batcher.add(f'file_{index}.txt') for index in range(2)]
+
+        self.jobs[0].set_exception(OSError("disk full"))
+        for future in futures:
+            self.assertIsInstance(future.exception(), OSError)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.pipeline_benchmark import generate_corpus, run_scenario
+
+
+class TestPipelineBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='test_bench_')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_corpus_is_reproducible(self):
+        first = generate_corpus(os.path.join(self.workdir, 'first'), 3, 2048, 0.5, seed=7)
+        second = generate_corpus(os.path.join(self.workdir, 'second'), 3, 2048, 0.5, seed=7)
+
+        for first_path, second_path in zip(first, second):
+            with open(first_path) as f, open(second_path) as g:
+                self.assertEqual(f.read(), g.read())
+        self.assertAlmostEqual(os.path.getsize(first[0]), 2048, delta=1)
+
+    def test_scenarios_report_results(self):
+        for scenario in ("create_zip", "extract_and_filter", "pii_filter"):
+            result = run_scenario(scenario, os.path.join(self.workdir, scenario), 5, 1024, 0.5, seed=1)
+
+            self.assertEqual(result["scenario"], scenario)
+            self.assertEqual(result["files"], 5)
+            self.assertGreater(result["files_per_s"], 0)
+            self.assertLessEqual(result["latency_p50_ms"], result["latency_p99_ms"])
+            self.assertGreater(result["peak_rss_mb"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import unittest
+import pyzipper
+
+from app.compression import CompressionPolicy, COMPRESSION_METHODS
+
+
+class TestCompressionPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.test_file = 'test_compression.txt'
+        self.zip_file = 'test_compression.zip'
+
+    def tearDown(self):
+        for path in (self.test_file, self.zip_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def write_test_file(self, content):
+        with open(self.test_file, 'wb') as f:
+            f.write(content)
+
+    def test_small_file_is_stored(self):
+        self.write_test_file(b"short line\n")
+        self.assertEqual(CompressionPolicy().choose(self.test_file), "store")
+
+    def test_dense_file_is_stored(self):
+        self.write_test_file(os.urandom(4096))
+        self.assertEqual(CompressionPolicy().choose(self.test_file), "store")
+
+    def test_repetitive_file_gets_dense_method(self):
+        self.write_test_file(b"Contact: john.doe@example.com\n" * 200)
+        self.assertEqual(CompressionPolicy().choose(self.test_file), "max")
+        self.assertEqual(CompressionPolicy(large=1024).choose(self.test_file), "fast")
+
+    def test_fixed_mode(self):
+        self.write_test_file(b"short line\n")
+        self.assertEqual(CompressionPolicy("lzma").choose(self.test_file), "lzma")
+        with self.assertRaises(ValueError):
+            CompressionPolicy("zstd")
+
+    def test_every_method_round_trips_encrypted(self):
+        content = b"Contact: john.doe@example.com\n" * 200
+        self.write_test_file(content)
+
+        for method in COMPRESSION_METHODS:
+            with pyzipper.AESZipFile(self.zip_file, 'w', encryption=pyzipper.WZ_AES) as zipf:
+                zipf.setpassword(b"1695462004")
+                chosen, ratio = CompressionPolicy(method).write(zipf, self.test_file, 'notes.txt')
+
+            with pyzipper.AESZipFile(self.zip_file, 'r') as zipf:
+                zipf.pwd = b"1695462004"
+                self.assertEqual(zipf.read('notes.txt'), content)
+            self.assertEqual(chosen, method)
+            if method != "store":
+                self.assertLess(ratio, 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
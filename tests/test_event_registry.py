@@ -0,0 +1,99 @@
+import os
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from app.event_registry import FileEventRegistry
+
+
+class TestFileEventRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.test_file = 'test_event.zip'
+        with open(self.test_file, 'w') as f:
+            f.write("Test content")
+        self.dispatched = []
+
+    def tearDown(self):
+        if os.path.exists(self.test_file):
+            os.remove(self.test_file)
+
+    def test_debounce_collapses_events(self):
+        registry = FileEventRegistry(self.dispatched.append, debounce=0.05)
+        for _ in range(3):
+            registry.observe(self.test_file)
+
+        time.sleep(0.3)
+        self.assertEqual(self.dispatched, [self.test_file])
+        self.assertEqual(registry.suppressed["debounced"], 2)
+
+    def test_waits_until_file_is_stable(self):
+        registry = FileEventRegistry(self.dispatched.append, debounce=0.2)
+        registry.observe(self.test_file)
+        # Written to without any further event
+        time.sleep(0.1)
+        with open(self.test_file, 'a') as f:
+            f.write("More content")
+
+        time.sleep(0.25)
+        self.assertEqual(self.dispatched, [])
+        time.sleep(0.25)
+        self.assertEqual(self.dispatched, [self.test_file])
+
+    def test_ready_dispatches_immediately(self):
+        registry = FileEventRegistry(self.dispatched.append, debounce=10)
+        registry.observe(self.test_file)
+        registry.ready(self.test_file)
+
+        self.assertEqual(self.dispatched, [self.test_file])
+        self.assertEqual(registry.stats()["pending"], 0)
+
+    def test_in_flight_and_processed_are_suppressed(self):
+        registry = FileEventRegistry(self.dispatched.append, debounce=0)
+        registry.observe(self.test_file)
+        registry.observe(self.test_file)
+        registry.release(self.test_file)
+        registry.observe(self.test_file)
+
+        self.assertEqual(self.dispatched, [self.test_file])
+        self.assertEqual(registry.suppressed["in_flight"], 1)
+        self.assertEqual(registry.suppressed["processed"], 1)
+
+    def test_changed_file_is_processed_again(self):
+        registry = FileEventRegistry(self.dispatched.append, debounce=0)
+        registry.observe(self.test_file)
+        registry.release(self.test_file)
+        with open(self.test_file, 'a') as f:
+            f.write("More content")
+        registry.observe(self.test_file)
+
+        self.assertEqual(self.dispatched, [self.test_file, self.test_file])
+
+    def test_missing_file_is_suppressed(self):
+        registry = FileEventRegistry(self.dispatched.append, debounce=0)
+        registry.observe('missing.zip')
+
+        self.assertEqual(self.dispatched, [])
+        self.assertEqual(registry.stats()["suppressed"], {"missing": 1})
+
+    def test_dispatch_error_is_logged_and_counted(self):
+        logger = MagicMock()
+        dispatched = []
+
+        def dispatch(path):
+            dispatched.append(path)
+            raise ValueError("boom")
+
+        registry = FileEventRegistry(dispatch, debounce=0.05, logger=logger)
+        registry.observe(self.test_file)
+        deadline = time.monotonic() + 5
+        while not logger.error.called and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        self.assertEqual(dispatched, [self.test_file])
+        self.assertEqual(registry.stats()["dispatch_errors"], 1)
+        self.assertIn("boom", logger.error.call_args[0][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from app.filter_cache import FilterCache, content_key
+
+
+class TestFilterCache(unittest.TestCase):
+
+    def test_key_depends_on_content_and_rules(self):
+        self.assertEqual(content_key(b"status ok", "v1"), content_key(b"status ok", "v1"))
+        self.assertNotEqual(content_key(b"status ok", "v1"), content_key(b"status ko", "v1"))
+        self.assertNotEqual(content_key(b"status ok", "v1"), content_key(b"status ok", "v2"))
+
+    def test_evicts_least_recently_used(self):
+        cache = FilterCache(max_entries=2, max_bytes=100)
+        cache.put("a", "1")
+        cache.put("b", "2")
+        cache.get("a")
+        cache.put("c", "3")
+
+        self.assertEqual(cache.get("a"), "1")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), "3")
+
+    def test_bounded_by_size(self):
+        cache = FilterCache(max_entries=10, max_bytes=10, max_item_bytes=8)
+        cache.put("a", "x" * 6)
+        cache.put("b", "y" * 6)
+        cache.put("c", "z" * 9)
+
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.stats(), {"entries": 1, "size": 6})
+        self.assertIsNone(cache.get("c"))
+
+    def test_persists_to_folder(self):
+        folder = tempfile.mkdtemp()
+        try:
+            cache = FilterCache(max_entries=1, folder=folder)
+            cache.put("a", "first\r\n")
+            cache.put("b", "second\n")
+            self.assertEqual(os.listdir(folder), ["b.txt"])
+
+            cache = FilterCache(folder=folder)
+            self.assertEqual(len(cache), 1)
+            self.assertEqual(cache.get("b"), "second\n")
+
+            # Entries written by another process are found on disk
+            FilterCache(folder=folder).put("c", "third\r\n")
+            self.assertEqual(cache.get("c"), "third\r\n")
+        finally:
+            shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,19 +1,25 @@
 import os
 import time
+import calendar
 import unittest
+import shutil
+import pyzipper
 from unittest.mock import patch, MagicMock
-from queue import Queue
-from threading import Thread
+from concurrent.futures import Future
 
-from app.folder_monitor import start_folder_monitor, TxtFileHandler
+from app.folder_monitor import start_folder_monitor, catch_up_backlog, TxtFileHandler
+from app.journal import ProcessedJournal
+# The registry the app/ modules record into, which import each other as top-level modules
+from metrics import REGISTRY
 
 class TestTxtFileHandler(unittest.TestCase):
 
     def setUp(self):
         self.output_folder = 'test_output'
         os.makedirs(self.output_folder, exist_ok=True)
-        self.processing_queue = Queue()
-        self.handler = TxtFileHandler(self.output_folder, self.processing_queue)
+        self.executor = MagicMock()
+        self.executor.submit.return_value = Future()
+        self.handler = TxtFileHandler(self.output_folder, self.executor, settle=0)
 
     def tearDown(self):
         # Remove files in output folder
@@ -21,62 +27,186 @@ class TestTxtFileHandler(unittest.TestCase):
             os.remove(os.path.join(self.output_folder, file))
         os.rmdir(self.output_folder)
 
-    @patch('app.folder_monitor.pyzipper.AESZipFile')
-    def test_create_zip(self, mock_zip):
+    def test_create_zip(self):
         test_file = 'test_file.txt'
         with open(test_file, 'w') as f:
             f.write("Test content")
-        
-        self.handler.create_zip(test_file)
 
-        expected_zip_name = f"test_file_{time.strftime('%Y_%m_%d_%I_%M_%S_%p', time.gmtime())}.zip"
-        zip_path = os.path.join(self.output_folder, expected_zip_name)
+        zip_path = self.handler.create_zip(test_file)
 
+        # Named after the file and the UTC time, which is also the password
+        timestamp = os.path.basename(zip_path)[len("test_file_"):-len(".zip")]
+        epoch_time = calendar.timegm(time.strptime(timestamp, '%Y_%m_%d_%I_%M_%S_%p'))
         self.assertTrue(os.path.exists(zip_path))
+        self.assertAlmostEqual(epoch_time, time.time(), delta=5)
+        with pyzipper.AESZipFile(zip_path, 'r') as zf:
+            zf.pwd = bytes(str(epoch_time), 'utf-8')
+            self.assertEqual(zf.read('test_file.txt'), b"Test content")
         os.remove(test_file)
         os.remove(zip_path)
 
+    def test_routes(self):
+        routed_folder = 'test_routed_output'
+        os.makedirs(os.path.join('test_input', 'nested'), exist_ok=True)
+        os.makedirs(routed_folder, exist_ok=True)
+        test_file = os.path.join('test_input', 'nested', 'test_file.txt')
+        with open(test_file, 'w') as f:
+            f.write("Test content")
+        handler = TxtFileHandler(self.output_folder, self.executor, settle=0,
+                                 routes=[('test_input', routed_folder)])
+        try:
+            self.assertEqual(handler.output_for(test_file), routed_folder)
+            self.assertEqual(handler.output_for('test_file.txt'), self.output_folder)
+            zip_path = handler.create_zip(test_file)
+            self.assertEqual(os.path.dirname(zip_path), routed_folder)
+        finally:
+            os.remove(test_file)
+            os.rmdir(os.path.join('test_input', 'nested'))
+            os.rmdir('test_input')
+            for file in os.listdir(routed_folder):
+                os.remove(os.path.join(routed_folder, file))
+            os.rmdir(routed_folder)
+
+    def test_catch_up_after_restart(self):
+        input_folder = 'test_input'
+        os.makedirs(input_folder, exist_ok=True)
+        handler = TxtFileHandler(self.output_folder, self.executor, settle=0,
+                                 journal=ProcessedJournal('test_state/test.journal'))
+        try:
+            with open(os.path.join(input_folder, 'a.txt'), 'w') as f:
+                f.write("Test content")
+            # First install: the files already there are recorded, not zipped
+            catch_up_backlog(handler, input_folder)
+            self.executor.submit.assert_not_called()
+
+            # Arrived while the observer was down, zipped by the catch-up of the restart
+            with open(os.path.join(input_folder, 'b.txt'), 'w') as f:
+                f.write("Test content")
+            catch_up_backlog(handler, input_folder)
+            self.assertEqual(self.executor.submit.call_count, 1)
+        finally:
+            handler.events.journal.close()
+            shutil.rmtree(input_folder)
+            shutil.rmtree('test_state')
+
     def test_on_created(self):
+        test_file = 'test_file.txt'
+        with open(test_file, 'w') as f:
+            f.write("Test content")
         event = MagicMock()
-        event.src_path = 'test_file.txt'
-        self.handler.on_created(event)
+        event.src_path = test_file
+        try:
+            self.handler.on_created(event)
+        finally:
+            os.remove(test_file)
+
+        self.executor.submit.assert_called_once_with(self.handler.process_files, test_file)
 
-        self.assertEqual(self.processing_queue.qsize(), 1)
+    def test_event_counters_are_exported(self):
+        self.assertFalse(self.handler.events.claim('test_missing.txt'))
+        self.handler.admission.counters["spilled"] += 2
+
+        text = REGISTRY.render()
+        self.assertIn('monitor_queue_events_total{event="suppressed_missing",queue="txt"} 1', text)
+        self.assertIn('monitor_queue_events_total{event="spilled",queue="txt"} 2', text)
+        self.assertIn('monitor_queue_events_total{event="dispatch_error",queue="txt"} 0', text)
 
     def test_process_files(self):
         test_file = 'test_file.txt'
         with open(test_file, 'w') as f:
             f.write("Test content")
 
-        self.processing_queue.put(test_file)
-        processing_thread = Thread(target=self.handler.process_files)
-        processing_thread.start()
+        self.handler.events.claim(test_file)
+        self.handler.process_files(test_file)
 
-        time.sleep(1)  # Allow processing to occur
-        self.assertEqual(self.processing_queue.qsize(), 0)
+        self.assertEqual(len(os.listdir(self.output_folder)), 1)
+        self.assertEqual(self.handler.events.stats()["in_flight"], 0)
 
         os.remove(test_file)
 
-    @patch('app.folder_monitor.Observer')
+    def test_process_batch_leaves_out_missing_file(self):
+        good, missing = 'test_good.txt', 'test_missing.txt'
+        for file_path in (good, missing):
+            with open(file_path, 'w') as f:
+                f.write("Test content")
+            self.assertTrue(self.handler.events.claim(file_path))
+        os.remove(missing)
+        try:
+            self.handler.process_batch([good, missing])
+
+            zips = os.listdir(self.output_folder)
+            self.assertEqual(len(zips), 1)
+            with pyzipper.AESZipFile(os.path.join(self.output_folder, zips[0]), 'r') as zf:
+                self.assertEqual(zf.namelist(), [good])
+            # Only the zipped file counts as processed, the other one is retried once back
+            self.assertFalse(self.handler.events.claim(good))
+            with open(missing, 'w') as f:
+                f.write("Test content")
+            self.assertTrue(self.handler.events.claim(missing))
+        finally:
+            for file_path in (good, missing):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+
+    def test_same_named_files_of_different_folders(self):
+        test_files = [os.path.join('test_input', 'test_file.txt'),
+                      os.path.join('test_input', 'nested', 'test_file.txt'),
+                      os.path.join('test_other_input', 'test_file.txt')]
+        for file_path in test_files:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w') as f:
+                f.write(file_path)
+        try:
+            journal = ProcessedJournal(os.path.join(self.output_folder, 'journal.jsonl'), base_folder='test_input')
+            handler = TxtFileHandler(self.output_folder, self.executor, settle=0, journal=journal)
+            names = [handler.member_name(file_path) for file_path in test_files]
+            self.assertEqual(names[:2], ['test_file.txt', 'nested__test_file.txt'])
+            self.assertEqual(len(set(names)), 3)
+
+            # Zipped within the same second, neither the zips nor their members collide
+            zip_paths = [handler.create_zip(file_path) for file_path in test_files]
+            self.assertEqual(len(set(zip_paths)), 3)
+            batch_path = handler.create_batch_zip(test_files)
+            epoch_time = calendar.timegm(time.strptime(batch_path[-len('2020_01_01_12_00_00_AM.zip'):-4],
+                                                       '%Y_%m_%d_%I_%M_%S_%p'))
+            with pyzipper.AESZipFile(batch_path, 'r') as zf:
+                zf.pwd = bytes(str(epoch_time), 'utf-8')
+                self.assertEqual(zf.namelist(), names)
+                self.assertEqual([zf.read(name).decode() for name in names], test_files)
+        finally:
+            shutil.rmtree('test_input')
+            shutil.rmtree('test_other_input')
+
+    @patch('app.folder_monitor.time')
+    @patch('app.folder_monitor.MetricsServer')
+    @patch('app.folder_monitor.ProcessedJournal')
+    @patch('app.folder_monitor.FolderWatcher')
     @patch('app.folder_monitor.TxtFileHandler')
-    def test_start_folder_monitor(self, MockTxtFileHandler, MockObserver):
-        mock_observer = MockObserver.return_value
+    def test_start_folder_monitor(self, MockTxtFileHandler, MockWatcher, MockJournal, MockMetricsServer, mock_time):
+        mock_watcher = MockWatcher.return_value
         mock_handler = MockTxtFileHandler.return_value
-        
+        # Ends the monitor loop on its first iteration
+        mock_time.sleep.side_effect = RuntimeError("stop")
+
         input_folder = 'test_input_folder'
         os.makedirs(input_folder, exist_ok=True)
 
         try:
-            start_folder_monitor(input_folder, self.output_folder, self.processing_queue)
-
-            MockObserver.assert_called_once_with()
-            MockTxtFileHandler.assert_called_once_with(self.output_folder, self.processing_queue)
-            mock_observer.schedule.assert_called_once_with(mock_handler, input_folder, recursive=True)
-            mock_observer.start.assert_called_once()
+            start_folder_monitor(input_folder)
+
+            MockWatcher.assert_called_once()
+            MockTxtFileHandler.assert_called_once()
+            self.assertEqual(MockTxtFileHandler.call_args.args[0], 'todecode')
+            self.assertEqual(MockTxtFileHandler.call_args.kwargs["journal"], MockJournal.return_value)
+            mock_watcher.add.assert_called_once_with(mock_handler, input_folder, recursive=False)
+            mock_watcher.start.assert_called_once()
+            mock_watcher.stop.assert_called_once()
         finally:
             # Clean up input folder
             if os.path.exists(input_folder):
                 os.rmdir(input_folder)
+            if os.path.exists('todecode') and not os.listdir('todecode'):
+                os.rmdir('todecode')
 
 if __name__ == '__main__':
     unittest.main()
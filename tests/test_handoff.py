@@ -0,0 +1,87 @@
+import os
+import socket
+import threading
+import unittest
+
+from app.handoff import HandoffClient, HandoffServer
+
+
+class TestHandoff(unittest.TestCase):
+
+    def setUp(self):
+        self.socket_path = 'test_state/test.sock'
+        self.received = []
+
+    def tearDown(self):
+        if os.path.exists(os.path.dirname(self.socket_path)):
+            os.rmdir(os.path.dirname(self.socket_path))
+
+    def receive(self, name, data):
+        self.received.append((name, data))
+        return name != 'rejected.zip'
+
+    def client(self):
+        # The results are awaited, not raced against the default timeout on a busy host
+        return HandoffClient(self.socket_path, timeout=60)
+
+    def test_round_trip(self):
+        server = HandoffServer(self.receive, self.socket_path)
+        server.start()
+        try:
+            client = self.client()
+            data = os.urandom(3 * 1024 * 1024)
+            self.assertTrue(client.send('todecode/notes.zip', data))
+            self.assertTrue(client.send('todecode/empty.zip'))
+            self.assertFalse(client.send('todecode/rejected.zip'))
+        finally:
+            server.stop()
+
+        self.assertEqual(self.received, [('notes.zip', data), ('empty.zip', b""), ('rejected.zip', b"")])
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_blocked_receive_does_not_hold_up_other_connections(self):
+        blocking, release = threading.Event(), threading.Event()
+
+        def receive(name, data):
+            if name == 'blocked.zip':
+                blocking.set()
+                release.wait(60)
+            return self.receive(name, data)
+
+        server = HandoffServer(receive, self.socket_path)
+        server.start()
+        try:
+            results = []
+            blocked = threading.Thread(target=lambda: results.append(self.client().send('todecode/blocked.zip')))
+            blocked.start()
+            self.assertTrue(blocking.wait(60))
+            self.assertTrue(self.client().send('todecode/notes.zip'))
+            release.set()
+            blocked.join(60)
+            self.assertEqual(results, [True])
+        finally:
+            release.set()
+            server.stop()
+
+        self.assertEqual(self.received, [('notes.zip', b""), ('blocked.zip', b"")])
+
+    def test_stalled_sender_is_dropped(self):
+        server = HandoffServer(self.receive, self.socket_path, timeout=0.1)
+        server.start()
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                conn.connect(self.socket_path)
+                conn.sendall(b"\x00")
+                conn.settimeout(60)
+                # Closed by the server once the rest of the header did not arrive in time
+                self.assertEqual(conn.recv(1), b"")
+            self.assertTrue(self.client().send('todecode/notes.zip'))
+        finally:
+            server.stop()
+
+    def test_send_without_server_fails(self):
+        self.assertFalse(HandoffClient(self.socket_path).send('todecode/notes.zip', b"data"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import unittest
+from unittest.mock import patch
+
+from app.journal import ProcessedJournal, scan_backlog, catch_up
+
+
+class TestProcessedJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'test_watched'
+        self.journal_path = 'test_state/test.journal'
+        os.makedirs(self.folder, exist_ok=True)
+
+    def tearDown(self):
+        for file in os.listdir(self.folder):
+            os.remove(os.path.join(self.folder, file))
+        os.rmdir(self.folder)
+        if os.path.exists('test_state'):
+            for file in os.listdir('test_state'):
+                os.remove(os.path.join('test_state', file))
+            os.rmdir('test_state')
+
+    def create_file(self, name, content="Test content"):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        stat = os.stat(path)
+        return path, (stat.st_size, stat.st_mtime_ns)
+
+    def test_record_survives_restart(self):
+        path, signature = self.create_file('a.zip')
+        journal = ProcessedJournal(self.journal_path)
+        journal.record(path, signature)
+        journal.close()
+        # A line cut short by a crash is ignored
+        with open(self.journal_path, 'a') as f:
+            f.write("12\t34")
+
+        journal = ProcessedJournal(self.journal_path)
+        self.assertTrue(journal.contains(path, signature))
+        self.assertFalse(journal.contains(path, (signature[0] + 1, signature[1])))
+        journal.close()
+
+    def test_forgotten_entries_are_compacted(self):
+        journal = ProcessedJournal(self.journal_path)
+        with patch('app.journal.COMPACT_MIN_LINES', 10):
+            for index in range(25):
+                path, signature = self.create_file(f'file_{index}.zip')
+                journal.record(path, signature)
+                # Removed once processed
+                journal.forget(path)
+                os.remove(path)
+        journal.close()
+
+        self.assertEqual(len(journal), 0)
+        with open(self.journal_path) as f:
+            self.assertLessEqual(len(f.readlines()), 10)
+
+    def test_scan_backlog(self):
+        done, done_signature = self.create_file('done.zip')
+        pending, _ = self.create_file('pending.zip')
+        self.create_file('ignored.txt')
+        journal = ProcessedJournal(self.journal_path)
+        journal.record(done, done_signature)
+        journal.record(os.path.join(self.folder, 'deleted.zip'), (1, 1))
+
+        self.assertEqual(scan_backlog(self.folder, '.zip', journal), [pending])
+        self.assertEqual(journal.names(), {'done.zip'})
+        journal.close()
+
+    def test_scan_backlog_seeds_new_journal(self):
+        self.create_file('old.txt')
+        journal = ProcessedJournal(self.journal_path)
+
+        self.assertEqual(scan_backlog(self.folder, '.txt', journal, seed=True), [])
+        self.assertEqual(journal.names(), {'old.txt'})
+
+        # Only the first scan seeds, a rescan reports what arrived since
+        new, _ = self.create_file('new.txt')
+        self.assertEqual(scan_backlog(self.folder, '.txt', journal, seed=True), [new])
+        journal.close()
+
+    def test_scan_backlog_recursive(self):
+        top, top_signature = self.create_file('same.txt')
+        nested_folder = os.path.join(self.folder, 'nested')
+        os.makedirs(nested_folder)
+        nested = os.path.join(nested_folder, 'same.txt')
+        with open(nested, 'w') as f:
+            f.write("Test content")
+        journal = ProcessedJournal(self.journal_path, base_folder=self.folder)
+        journal.record(top, top_signature)
+        # Another watched folder, left alone by the compaction of this one
+        journal.record(os.path.abspath('elsewhere.txt'), (1, 1))
+
+        try:
+            # Files directly in the base folder keep their name, nested ones are told apart
+            self.assertEqual(scan_backlog(self.folder, '.txt', journal, recursive=True), [nested])
+            self.assertEqual(journal.names(), {'same.txt', os.path.abspath('elsewhere.txt')})
+            self.assertEqual(journal.key(nested), os.path.join('nested', 'same.txt'))
+        finally:
+            journal.close()
+            os.remove(nested)
+            os.rmdir(nested_folder)
+
+    def test_catch_up_in_batches(self):
+        ready = []
+        progress = list(catch_up([f'file_{index}.zip' for index in range(5)], ready.append, batch_size=2))
+
+        self.assertEqual(progress, [2, 4, 5])
+        self.assertEqual(len(ready), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
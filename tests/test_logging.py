@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import queue
+import shutil
+import logging
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from app import utils
+from app.utils import logger_setup, LogListener, DroppingQueueHandler, BatchRotatingFileHandler, JsonFormatter
+
+
+class TestAsyncLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.folder, 'service.log')
+
+    def tearDown(self):
+        logger = logging.getLogger(self.log_file)
+        for handler in list(logger.handlers):
+            if isinstance(handler, DroppingQueueHandler):
+                handler.listener.stop()
+            logger.removeHandler(handler)
+            handler.close()
+        shutil.rmtree(self.folder)
+
+    def read_lines(self):
+        with open(self.log_file) as file:
+            return file.read().splitlines()
+
+    @patch.object(utils, 'ASYNC_LOGGING', True)
+    def test_records_are_written_by_the_listener(self):
+        logger = logger_setup(self.log_file)
+        queue_handler = logger.handlers[0]
+        self.assertIsInstance(queue_handler, DroppingQueueHandler)
+
+        for index in range(100):
+            logger.info(f"line {index}")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.error("failed", exc_info=True)
+        queue_handler.listener.stop()
+
+        lines = self.read_lines()
+        self.assertTrue(lines[0].endswith("INFO - line 0"))
+        self.assertTrue(lines[99].endswith("INFO - line 99"))
+        self.assertTrue(lines[100].endswith("ERROR - failed"))
+        self.assertIn("ValueError: boom", lines[-1])
+
+    def test_full_queue_drops_and_reports(self):
+        handler = BatchRotatingFileHandler(self.log_file)
+        handler.setFormatter(logging.Formatter(utils.LOG_FORMAT))
+        listener = LogListener(queue.Queue(2), [handler])
+        logger = logging.getLogger(self.log_file)
+        logger.setLevel(logging.INFO)
+        logger.addHandler(DroppingQueueHandler(listener))
+
+        # The listener is not running yet, so only the first two records fit
+        for index in range(5):
+            logger.info(f"line {index}")
+        self.assertEqual(logger.handlers[0].dropped, 3)
+
+        listener.start()
+        listener.stop()
+        lines = self.read_lines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].endswith("line 1"))
+        self.assertTrue(lines[2].endswith("WARNING - 3 log records dropped, the log queue was full"))
+
+    def test_batch_rolls_over(self):
+        handler = BatchRotatingFileHandler(self.log_file, maxBytes=100, backupCount=1)
+        records = [logging.makeLogRecord({"msg": "x" * 60}) for _ in range(2)]
+        handler.emit_batch(records[:1])
+        handler.emit_batch(records[1:])
+        handler.close()
+
+        self.assertTrue(os.path.exists(self.log_file + ".1"))
+        self.assertEqual(len(self.read_lines()), 1)
+
+    @patch.object(utils, 'LOG_JSON', True)
+    def test_json_lines(self):
+        logger = logger_setup(self.log_file)
+        logger.warning("disk %s", "full")
+
+        entry = json.loads(self.read_lines()[0])
+        self.assertEqual(entry["level"], "WARNING")
+        self.assertEqual(entry["message"], "disk full")
+        self.assertEqual(entry["logger"], self.log_file)
+
+    def test_json_formatter_keeps_the_traceback(self):
+        try:
+            raise KeyError("missing")
+        except KeyError:
+            record = logging.LogRecord("test", logging.ERROR, __file__, 1, "failed", None, sys.exc_info())
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertIn("KeyError: 'missing'", entry["exc_info"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+from unittest.mock import patch
+
+import manage_monitor_app
+from manage_monitor_app import load_pipelines, parse_args, select_pipelines, INPUT_FOLDERS_ENV, OUTPUT_FOLDERS_ENV
+from benchmarks.import_budget import parse_importtime, measure
+
+
+class TestManageMonitorApp(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix='test_manage_')
+        self.config_file = os.path.join(self.workdir, 'monitor.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    @patch.dict(os.environ, {INPUT_FOLDERS_ENV: "", OUTPUT_FOLDERS_ENV: ""})
+    def test_pipelines_from_flags_env_and_config(self):
+        with open(self.config_file, 'w') as f:
+            json.dump({"pipelines": [{"input": "in_config", "output": "out_config"}]}, f)
+
+        self.assertEqual(load_pipelines(config_file=self.config_file),
+                         [(os.path.abspath("in_config"), os.path.abspath("out_config"))])
+        with patch.dict(os.environ, {INPUT_FOLDERS_ENV: os.pathsep.join(["in_a", "in_b"]),
+                                     OUTPUT_FOLDERS_ENV: os.pathsep.join(["out_a", "out_b"])}):
+            self.assertEqual(load_pipelines(config_file=self.config_file),
+                             [(os.path.abspath("in_a"), os.path.abspath("out_a")),
+                              (os.path.abspath("in_b"), os.path.abspath("out_b"))])
+            # Flags win over the environment
+            self.assertEqual(load_pipelines(["in_flag"], ["out_flag"], self.config_file),
+                             [(os.path.abspath("in_flag"), os.path.abspath("out_flag"))])
+
+    @patch.dict(os.environ, {INPUT_FOLDERS_ENV: "", OUTPUT_FOLDERS_ENV: ""})
+    def test_invalid_pipelines(self):
+        with self.assertRaises(ValueError):
+            load_pipelines(["in_a", "in_b"], ["out_a"], self.config_file)
+        with self.assertRaises(ValueError):
+            load_pipelines(["same"], ["same"], self.config_file)
+
+    @patch.dict(os.environ, {INPUT_FOLDERS_ENV: "", OUTPUT_FOLDERS_ENV: ""})
+    def test_headless_never_opens_the_dialogs(self):
+        args = parse_args(["--headless", "--config", self.config_file])
+        self.assertEqual(select_pipelines(args), [])
+        self.assertNotIn("app.select_folder", sys.modules)
+
+    def test_start_services_per_pipeline_folder(self):
+        pipelines = [("/in_a", "/out_a"), ("/in_b", "/out_b")]
+        cwd = os.getcwd()
+        os.chdir(self.workdir)
+        try:
+            with patch.object(manage_monitor_app, 'start_pipeline', side_effect=[(1, 2, 3), (4, 5, 6)]) as mock_start, \
+                    patch.object(manage_monitor_app.time, 'sleep'):
+                manage_monitor_app.start_services(pipelines)
+
+            self.assertEqual(mock_start.call_args_list[0].args[4], ".")
+            self.assertEqual(mock_start.call_args_list[1].args[4], os.path.join("pipelines", "1"))
+            self.assertEqual(mock_start.call_args_list[1].args[5][manage_monitor_app.METRICS_PORT_OFFSET_ENV], "10")
+            # Every pipeline applies the project's PII rules, only the first one the watch file
+            for call in mock_start.call_args_list:
+                self.assertEqual(call.args[5][manage_monitor_app.PII_RULES_FILE_ENV],
+                                 os.path.join(os.getcwd(), "config", "pii_rules.json"))
+            self.assertEqual(mock_start.call_args_list[0].args[5][manage_monitor_app.WATCH_FILE_ENV],
+                             os.path.join(os.getcwd(), "config", "watch.json"))
+            self.assertEqual(mock_start.call_args_list[1].args[5][manage_monitor_app.WATCH_FILE_ENV], "")
+            self.assertEqual(manage_monitor_app.get_pids(), (1, 2, 3))
+            self.assertEqual(manage_monitor_app.get_pids(os.path.join("pipelines", "1", "pids.json")), (4, 5, 6))
+            self.assertEqual(manage_monitor_app.get_pipeline_folders(), [".", os.path.join("pipelines", "1")])
+        finally:
+            os.chdir(cwd)
+
+    def test_import_does_not_load_tkinter(self):
+        completed = subprocess.run([sys.executable, "-c", "import sys, manage_monitor_app; print('tkinter' in sys.modules)"],
+                                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   capture_output=True, text=True, check=True)
+        self.assertEqual(completed.stdout.strip(), "False")
+
+    def test_import_budget(self):
+        imports = parse_importtime("import time: self [us] | cumulative | imported package\n"
+                                   "import time:       120 |        120 |   json.decoder\n"
+                                   "import time:       300 |        420 | json\n")
+        self.assertEqual(imports, [("json.decoder", 120, 120, 1), ("json", 300, 420, 0)])
+
+        milliseconds, slowest = measure("service_monitor", repeat=1)
+        self.assertGreater(milliseconds, 0)
+        self.assertLessEqual(len(slowest), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
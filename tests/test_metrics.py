@@ -0,0 +1,58 @@
+import unittest
+import urllib.request
+
+from app.metrics import MetricsRegistry, MetricsServer, fetch_summary, format_summary
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+        self.stage_seconds = self.registry.histogram("test_stage_seconds", "Stage time.", buckets=(0.01, 0.1, 1))
+        self.files = self.registry.counter("test_files_total", "Files.")
+        self.queue = self.registry.gauge("test_queue", "Queue.")
+
+    def test_render_prometheus_text(self):
+        zip_seconds = self.stage_seconds.labels(stage="zip")
+        for value in (0.005, 0.05, 0.05, 5):
+            zip_seconds.observe(value)
+        self.files.labels(stage="zip", outcome="ok").inc(3)
+        self.queue.labels(queue="txt").set_function(lambda: 7)
+
+        text = self.registry.render()
+        self.assertIn('# TYPE test_stage_seconds histogram', text)
+        self.assertIn('test_stage_seconds_bucket{stage="zip",le="0.1"} 3', text)
+        self.assertIn('test_stage_seconds_bucket{stage="zip",le="+Inf"} 4', text)
+        self.assertIn('test_stage_seconds_count{stage="zip"} 4', text)
+        self.assertIn('test_files_total{outcome="ok",stage="zip"} 3', text)
+        self.assertIn('test_queue{queue="txt"} 7', text)
+
+    def test_quantiles(self):
+        histogram = self.stage_seconds.labels(stage="zip")
+        for _ in range(98):
+            histogram.observe(0.005)
+        histogram.observe(0.5)
+        histogram.observe(0.5)
+
+        self.assertEqual(histogram.quantile(0.5), 0.01)
+        self.assertEqual(histogram.quantile(0.99), 1)
+
+    def test_server(self):
+        self.stage_seconds.labels(stage="zip").observe(0.05)
+        server = MetricsServer(0, self.registry)
+        server.start()
+        try:
+            port = server._server.server_address[1]
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+                self.assertIn(b'test_stage_seconds_count{stage="zip"} 1', response.read())
+            summary = fetch_summary(port)
+        finally:
+            server.stop()
+
+        self.assertEqual(summary['test_stage_seconds{stage="zip"}']["count"], 1)
+        self.assertTrue(format_summary(summary)[0].startswith('test_stage_seconds{stage="zip"} count=1'))
+        self.assertIsNone(fetch_summary(port))
+
+
+if __name__ == '__main__':
+    unittest.main()
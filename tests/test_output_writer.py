@@ -0,0 +1,99 @@
+import os
+import time
+import shutil
+import threading
+import unittest
+from unittest.mock import patch
+
+from app import output_writer
+from app.output_writer import OutputWriter, temp_path
+
+
+class TestOutputWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'test_output_writer'
+        os.makedirs(self.folder, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, name, content="Test content"):
+        path = os.path.join(self.folder, name)
+        with open(temp_path(path), 'w') as f:
+            f.write(content)
+        return path
+
+    def test_commits_in_groups(self):
+        for sync_method in ("syncfs", "fsync"):
+            writer = OutputWriter(interval=0.2, sync_method=sync_method)
+            batches = writer.batch_files.count
+            paths = [self.write(f'{sync_method}_{index}.txt') for index in range(5)]
+            # Still under their temp name until committed
+            self.assertFalse(os.path.exists(paths[0]))
+
+            commits = [writer.commit([path]) for path in paths]
+            self.assertEqual([commit.result(timeout=5) for commit in commits], [[path] for path in paths])
+            for path in paths:
+                with open(path, 'r') as f:
+                    self.assertEqual(f.read(), "Test content")
+                self.assertFalse(os.path.exists(temp_path(path)))
+            # One barrier for the five outputs
+            self.assertEqual(writer.batch_files.count, batches + 1)
+
+    def test_slow_callback_does_not_hold_up_commits(self):
+        writer = OutputWriter(interval=0.1)
+        release = threading.Event()
+        first = writer.commit([self.write('first.txt')])
+        # Like removing the input and starting the next job
+        first.add_done_callback(lambda commit: release.wait(5))
+        first.result(timeout=5)
+
+        second = self.write('second.txt')
+        writer.commit([second])
+        deadline = time.monotonic() + 1
+        while not os.path.exists(second) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        try:
+            self.assertTrue(os.path.exists(second))
+        finally:
+            release.set()
+
+    def test_full_batch_does_not_wait(self):
+        writer = OutputWriter(interval=30, batch_size=2)
+        commit = writer.commit([self.write('a.txt'), self.write('b.txt')])
+        self.assertEqual(len(commit.result(timeout=5)), 2)
+
+    def test_missing_temp_file_fails_its_commit_only(self):
+        writer = OutputWriter(interval=0.1, sync_method="fsync")
+        missing = writer.commit([os.path.join(self.folder, 'missing.txt')])
+        written = writer.commit([self.write('written.txt')])
+
+        with self.assertRaises(FileNotFoundError):
+            missing.result(timeout=5)
+        self.assertEqual(len(written.result(timeout=5)), 1)
+
+    def test_failed_barrier_fails_the_batch(self):
+        writer = OutputWriter(interval=0.1, sync_method="fsync")
+        path = self.write('a.txt')
+        with patch.object(output_writer, 'fsync_path', side_effect=OSError(5, "I/O error")):
+            commit = writer.commit([path])
+            with self.assertRaises(OSError):
+                commit.result(timeout=5)
+        # Not renamed, so the input of the file is kept and retried
+        self.assertFalse(os.path.exists(path))
+
+    def test_unexpected_error_fails_the_batch_and_keeps_committing(self):
+        writer = OutputWriter(interval=0.1, sync_method="fsync")
+        path = self.write('a.txt')
+        with patch.object(writer, '_sync_data', side_effect=ValueError("unexpected")):
+            with self.assertRaises(ValueError):
+                writer.commit([path]).result(timeout=5)
+
+        # The committer thread survived and commits the next batch
+        self.assertEqual(writer.commit([path]).result(timeout=5), [path])
+        self.assertTrue(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import io
+import os
+import json
+import random
+import re
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from app.pii_engine import PiiEngine, PiiRule, PII_RULES, PII_RULES_FILE_ENV, load_rules
+
+
+def legacy_filter(content):
+    # The original implementation: one re.sub per rule, in rule order.
+    for rule in PII_RULES:
+        content = re.sub(rule.pattern, rule.replacement, content)
+    return content
+
+
+class TestPiiEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = PiiEngine()
+
+    def test_filter_text(self):
+        content = ('"file_path" : "C:\\\\Users\\\\john\\\\xyz" mail john.doe@example.com '
+                   'on December 25, 1990 call 123-456-7890 see https://github.com/john @jdoe')
+        filtered = self.engine.filter_text(content)
+
+        self.assertIn('<d>\\\\Users\\\\<u>\\\\xyz', filtered)
+        self.assertIn('<email>', filtered)
+        self.assertIn('<phone_number>', filtered)
+        self.assertIn('<github_profile>', filtered)
+        self.assertIn('<twitter_handle>', filtered)
+        self.assertNotIn('john', filtered)
+
+    def test_matches_rule_order(self):
+        # Overlapping candidates are resolved exactly as the sequential filter does.
+        for content in ['@john@example.com', '1/2/555 1234', '12 5 Dec 2023 Main St',
+                        '@.https://linkedin.com/in/abc', 'https://github.com/xhttps://facebook.com/y']:
+            self.assertEqual(self.engine.filter_text(content), legacy_filter(content))
+
+    def test_matches_legacy_filter_on_random_text(self):
+        tokens = ['@', 'john', '.', 'com', 'https://', 'www.', 'linkedin.com/in/', 'instagram.com/',
+                  'github.com/', 'C:', '\\', 'Users', ' ', '\n', '+1', '(', ')', '-', '/', '12', '555',
+                  '1234', 'Dec', '25th', ',', '2023', 'Main', 'St', 'a@b.com']
+        rng = random.Random(0)
+        for _ in range(2000):
+            content = ''.join(rng.choice(tokens) for _ in range(rng.randint(1, 30)))
+            self.assertEqual(self.engine.filter_text(content), legacy_filter(content), content)
+
+    def test_filter_stream_matches_filter_text(self):
+        tokens = ['@', 'john', '.', 'com', 'https://', 'github.com/', 'C:', '\\', 'Users', ' ', '\n',
+                  '-', '/', '12', '555', '1234', 'Dec', '25th', ',', '2023', 'Main', 'St', 'a@b.com']
+        rng = random.Random(1)
+        engine = PiiEngine(chunk_size=7, overlap=512)
+        for _ in range(200):
+            content = ''.join(rng.choice(tokens) for _ in range(rng.randint(1, 1000)))
+            target = io.StringIO()
+            engine.filter_stream(io.StringIO(content), target)
+            self.assertEqual(target.getvalue(), self.engine.filter_text(content), content)
+
+    def test_filter_stream_with_chunks_smaller_than_the_matches(self):
+        # Long runs without a backslash, a line end or a dot: the matches of the file path,
+        # address and profile rules run as long as the rules let them
+        tokens = ['C:', '\\', 'Users', 'john', ' ', '\n', '12', ' Main', ' St', ' Rd', 'x' * 50, '@', 'a.b',
+                  '.com', 'https://github.com/', '25th', 'Dec', '2023']
+        rng = random.Random(2)
+        engine = PiiEngine(chunk_size=3, overlap=1024)
+        for _ in range(200):
+            content = ''.join(rng.choice(tokens) for _ in range(rng.randint(1, 300)))
+            target = io.StringIO()
+            engine.filter_stream(io.StringIO(content), target)
+            self.assertEqual(target.getvalue(), self.engine.filter_text(content), content)
+
+        # A user name at the start of a long log
+        content = 'C:\\Users\\john' + ''.join(f'\nline {index} of the log' for index in range(5000))
+        target = io.StringIO()
+        PiiEngine(chunk_size=4096).filter_stream(io.StringIO(content), target)
+        self.assertEqual(target.getvalue(), self.engine.filter_text(content))
+        self.assertTrue(target.getvalue().startswith('<d>\\Users\\<u>\nline 0 of the log\n'))
+
+    def test_filter_stream_holds_back_matches_reaching_the_end(self):
+        # Unbounded rule, longer than the overlap
+        engine = PiiEngine([PiiRule("run", r"a+", "<a>")], chunk_size=5, overlap=2)
+        target = io.StringIO()
+        engine.filter_stream(io.StringIO('x' + 'a' * 50 + 'y'), target)
+        self.assertEqual(target.getvalue(), 'x<a>y')
+
+    def test_filter_stream_catches_matches_across_chunks(self):
+        content = 'x' * 1000 + ' john.doe@example.com ' + 'y' * 1000
+        target = io.StringIO()
+        PiiEngine(chunk_size=10, overlap=100).filter_stream(io.StringIO(content), target)
+        self.assertEqual(target.getvalue(), 'x' * 1000 + ' <email> ' + 'y' * 1000)
+
+    def test_prefilter_skips_rules(self):
+        content = 'plain text without any personal data\n' * 100
+        target = io.StringIO()
+        stats = {}
+        self.engine.filter_stream(io.StringIO(content), target, stats)
+
+        self.assertEqual(target.getvalue(), content)
+        self.assertEqual(set(stats), {rule.name for rule in PII_RULES})
+        for seconds, searched, skipped in stats.values():
+            self.assertEqual(searched, 0)
+            self.assertGreater(skipped, 0)
+
+        stats = {}
+        self.engine.filter_stream(io.StringIO('mail a@b.com'), io.StringIO(), stats)
+        self.assertGreater(stats["emails"][1], 0)
+        self.assertEqual(stats["github"][1], 0)
+
+    def test_may_match(self):
+        rule = PiiRule("test", r"\d{3}-\d{4}", "<n>", prefilter=("#",), prefilter_pattern=r"\d{3}")
+        self.assertTrue(rule.may_match("call 555-1234"))
+        self.assertTrue(rule.may_match("ticket #"))
+        self.assertFalse(rule.may_match("call 55-12"))
+        self.assertFalse(rule.may_match("555 #", 5))
+        self.assertTrue(PiiRule("test", "x", "y").may_match(""))
+
+    def test_load_rules(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'rules.json')
+            self.assertEqual(load_rules(path), PII_RULES)
+
+            with open(path, 'w') as file:
+                json.dump([{"name": "github", "pattern": "github\\.com/\\w+", "replacement": "<gh>",
+                            "prefilter": ["github.com"]},
+                           {"name": "ssn", "pattern": "\\b\\d{3}-\\d{2}-\\d{4}\\b", "replacement": "<ssn>",
+                            "prefilter_pattern": "\\d{3}-"}], file)
+            rules = load_rules(path)
+
+            # The file of the environment variable applies by default
+            with patch.dict(os.environ, {PII_RULES_FILE_ENV: path}):
+                self.assertEqual([rule.name for rule in load_rules()], [rule.name for rule in rules])
+
+        self.assertEqual([rule.name for rule in rules], [rule.name for rule in PII_RULES] + ["ssn"])
+        engine = PiiEngine(rules)
+        self.assertEqual(engine.filter_text("id 123-45-6789 at github.com/john"), "id <ssn> at <gh>")
+
+
+
+if __name__ == '__main__':
+    unittest.main()
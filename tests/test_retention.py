@@ -0,0 +1,94 @@
+import os
+import time
+import shutil
+import unittest
+from watchdog.events import FileCreatedEvent, FileDeletedEvent, FileMovedEvent
+from watchdog.observers import Observer
+
+from app.retention import RetentionEngine, RetentionPolicy
+
+
+class TestRetention(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'test_retention'
+        os.makedirs(self.folder, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def create_file(self, name, size=10, age=0):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as f:
+            f.write("x" * size)
+        if age:
+            os.utime(path, (time.time() - age, time.time() - age))
+        return path
+
+    def test_limits(self):
+        engine = RetentionEngine([RetentionPolicy(self.folder, "*.tmp", max_age=60),
+                                  RetentionPolicy(self.folder, "*.zip", max_files=2),
+                                  RetentionPolicy(self.folder, "*.txt", max_bytes=25)])
+        old_tmp = self.create_file('old.tmp', age=120)
+        new_tmp = self.create_file('new.tmp')
+        zips = [self.create_file(f'{index}.zip', age=30 - index) for index in range(3)]
+        txts = [self.create_file(f'{index}.txt', age=30 - index) for index in range(3)]
+        engine.seed()
+
+        self.assertEqual(engine.sweep(), (3, 30))
+        # The oldest file of each policy went, the newest are kept
+        self.assertFalse(os.path.exists(old_tmp))
+        self.assertFalse(os.path.exists(zips[0]))
+        self.assertFalse(os.path.exists(txts[0]))
+        for path in [new_tmp] + zips[1:] + txts[1:]:
+            self.assertTrue(os.path.exists(path))
+        self.assertEqual(engine.sweep(), (0, 0))
+        self.assertEqual(engine.stats()["deleted_files"], 3)
+        self.assertEqual(engine.deleted_bytes[f"{self.folder}/*.txt"].value, 10)
+
+    def test_index_follows_events(self):
+        engine = RetentionEngine([RetentionPolicy(self.folder, "*.zip", max_files=1)])
+        first = self.create_file('first.zip', age=10)
+        engine.on_created(FileCreatedEvent(first))
+        second = self.create_file('second.zip')
+        engine.on_created(FileCreatedEvent(second))
+        engine.on_created(FileCreatedEvent(self.create_file('other.txt')))
+        self.assertEqual(engine.stats()["policies"][f"{self.folder}/*.zip"], {"files": 2, "bytes": 20})
+
+        os.remove(first)
+        engine.on_deleted(FileDeletedEvent(first))
+        renamed = os.path.join(self.folder, 'renamed.txt')
+        os.rename(second, renamed)
+        engine.on_moved(FileMovedEvent(second, renamed))
+
+        self.assertEqual(engine.stats()["policies"][f"{self.folder}/*.zip"], {"files": 0, "bytes": 0})
+        self.assertEqual(engine.sweep(), (0, 0))
+
+    def test_sweep_is_batched(self):
+        engine = RetentionEngine([RetentionPolicy(self.folder, "*.tmp", max_age=60)], batch_size=3)
+        for index in range(5):
+            self.create_file(f'{index}.tmp', age=120)
+        engine.seed()
+
+        self.assertEqual(engine.sweep()[0], 3)
+        self.assertEqual(len(os.listdir(self.folder)), 2)
+        self.assertEqual(engine.sweep()[0], 2)
+
+    def test_scheduled_on_observer(self):
+        engine = RetentionEngine([RetentionPolicy(os.path.join(self.folder, 'failed'), "*.zip", max_files=0)])
+        observer = Observer()
+        engine.schedule(observer)
+        observer.start()
+        try:
+            path = os.path.join(self.folder, 'failed', 'a.zip')
+            with open(path, 'w') as f:
+                f.write("Test content")
+            time.sleep(0.5)
+            self.assertEqual(engine.sweep(), (1, 12))
+        finally:
+            observer.stop()
+            observer.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
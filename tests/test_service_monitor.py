@@ -0,0 +1,94 @@
+import os
+import sys
+import time
+import logging
+import subprocess
+import unittest
+import psutil
+from unittest.mock import patch
+
+from app import service_monitor
+from app.service_monitor import ServiceProcess, supervise
+
+
+class TestServiceMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.heartbeat_dir = 'test_state'
+        os.makedirs(self.heartbeat_dir, exist_ok=True)
+        # service_monitor reads heartbeats through its own import of utils
+        utils = sys.modules[service_monitor.heartbeat_age.__module__]
+        self.patchers = [patch.object(utils, 'HEARTBEAT_DIR', self.heartbeat_dir),
+                         patch.object(service_monitor, 'RESTART_BACKOFF', 0)]
+        for patcher in self.patchers:
+            patcher.start()
+        self.logger = logging.getLogger('test_service_monitor')
+        self.child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+        # Popen returns once the exec started, the command line is only readable a bit later
+        deadline = time.monotonic() + 5
+        while not psutil.Process(self.child.pid).cmdline() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.service = ServiceProcess('test_service', self.child.pid, 'test_proc_pid')
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        for process in (self.child, self.service.popen):
+            if process and process.poll() is None:
+                process.kill()
+                process.wait()
+        for file in os.listdir(self.heartbeat_dir):
+            os.remove(os.path.join(self.heartbeat_dir, file))
+        os.rmdir(self.heartbeat_dir)
+
+    def test_restarts_exited_service(self):
+        self.child.kill()
+        started = time.monotonic()
+        supervise(self.logger, [self.service], check_interval=5)
+
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(self.service.restarts, 1)
+        self.assertNotEqual(self.service.pid, self.child.pid)
+        self.assertIsNone(self.service.popen.poll())
+        self.assertEqual(self.service.cmdline, self.service.popen.args)
+
+    def test_kills_service_without_heartbeat(self):
+        heartbeat = os.path.join(self.heartbeat_dir, 'test_service.heartbeat')
+        open(heartbeat, 'w').close()
+        os.utime(heartbeat, (time.time() - 60, time.time() - 60))
+        self.service.started_at -= 60
+
+        supervise(self.logger, [self.service], check_interval=0.1)
+        # Reaps the killed child
+        self.assertIsNotNone(self.child.wait(timeout=5))
+        # The exit is seen on a later round, however long the kill took
+        deadline = time.monotonic() + 5
+        while not self.service.restarts and time.monotonic() < deadline:
+            supervise(self.logger, [self.service], check_interval=0.1)
+        self.assertEqual(self.service.restarts, 1)
+
+    def test_log_retention(self):
+        with self.assertLogs(self.logger) as logs:
+            service_monitor.log_retention(self.logger, "todecode_monitor", {
+                'monitor_retention_files_total{policy="todecode/*.tmp"}': 3.0,
+                'monitor_retention_bytes_total{policy="todecode/*.tmp"}': 2048.0,
+                'monitor_files_total{outcome="ok",stage="zip"}': 5.0,
+            })
+            # A service that did not answer logs nothing
+            service_monitor.log_retention(self.logger, "todecode_monitor", None)
+
+        self.assertEqual([record.getMessage() for record in logs.records], [
+            'Retention (todecode_monitor): monitor_retention_files_total{policy="todecode/*.tmp"} 3',
+            'Retention (todecode_monitor): monitor_retention_bytes_total{policy="todecode/*.tmp"} 2048',
+        ])
+
+    def test_healthy_service_is_left_alone(self):
+        open(os.path.join(self.heartbeat_dir, 'test_service.heartbeat'), 'w').close()
+        supervise(self.logger, [self.service], check_interval=0.1)
+
+        self.assertIsNone(self.child.poll())
+        self.assertEqual(self.service.restarts, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
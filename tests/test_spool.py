@@ -0,0 +1,99 @@
+import os
+import time
+import shutil
+import unittest
+import multiprocessing
+
+from app.spool import Spool
+
+
+def _drain(folder, worker_id, processed):
+    # Worker process: claims and completes archives until the spool is empty
+    spool = Spool(folder, worker_id=worker_id)
+    for path in spool.pending(".zip"):
+        claimed_path = spool.claim(path)
+        if claimed_path is not None:
+            processed.put((worker_id, os.path.basename(path)))
+            spool.complete(claimed_path)
+
+
+class TestSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'test_spool'
+        os.makedirs(self.folder, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def create_archive(self, name):
+        path = os.path.join(self.folder, name)
+        with open(path, 'w') as f:
+            f.write("Test content")
+        return path
+
+    def test_only_one_worker_claims(self):
+        path = self.create_archive('a.zip')
+        first = Spool(self.folder, worker_id='first')
+        second = Spool(self.folder, worker_id='second')
+
+        claimed_path = first.claim(path)
+        self.assertEqual(claimed_path, os.path.join(self.folder, 'claimed', 'first', 'a.zip'))
+        self.assertIsNone(second.claim(path))
+        self.assertEqual(second.counters["lost_race"], 1)
+
+        self.assertEqual(first.complete(claimed_path), os.path.join(first.done_folder, 'a.zip'))
+        self.assertEqual(first.complete(first.claim(self.create_archive('b.zip')), failed=True),
+                         os.path.join(first.failed_folder, 'b.zip'))
+        self.assertEqual(first.stats()["held"], 0)
+
+    def test_expired_lease_is_reclaimed(self):
+        path = self.create_archive('a.zip')
+        crashed = Spool(self.folder, worker_id='crashed', lease_seconds=10)
+        claimed_path = crashed.claim(path)
+        other = Spool(self.folder, worker_id='other', lease_seconds=10)
+
+        self.assertEqual(other.reclaim(), [])
+        self.assertEqual(other.reclaim(now=time.time() + 11), [path])
+        self.assertEqual(other.pending(".zip"), [path])
+        # The first worker finds out its lease is gone
+        self.assertEqual(crashed.renew(), [claimed_path])
+        with self.assertRaises(FileNotFoundError):
+            crashed.complete(claimed_path)
+
+    def test_renew_extends_the_lease(self):
+        spool = Spool(self.folder, worker_id='worker', lease_seconds=10)
+        claimed_path = spool.claim(self.create_archive('a.zip'))
+        os.utime(claimed_path, (time.time() - 20, time.time() - 20))
+
+        self.assertEqual(spool.renew(), [])
+        self.assertEqual(spool.reclaim(), [])
+
+    def test_recover_own_claims(self):
+        path = self.create_archive('a.zip')
+        Spool(self.folder, worker_id='stable').claim(path)
+
+        restarted = Spool(self.folder, worker_id='stable')
+        self.assertEqual(restarted.recover(), [path])
+
+    def test_workers_in_several_processes(self):
+        names = {f'archive_{index}.zip' for index in range(200)}
+        for name in names:
+            self.create_archive(name)
+        context = multiprocessing.get_context("fork")
+        processed = context.Queue()
+        workers = [context.Process(target=_drain, args=(self.folder, f'worker_{index}', processed))
+                   for index in range(4)]
+        for worker in workers:
+            worker.start()
+        results = [processed.get(timeout=30) for _ in names]
+        for worker in workers:
+            worker.join()
+
+        # Every archive was processed exactly once
+        self.assertEqual(sorted(name for _, name in results), sorted(names))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.folder, 'done'))), sorted(names))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import time
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+from watchdog.events import FileSystemEventHandler
+
+from app.retention import RetentionEngine
+from app.supervisor import Supervisor, PipelineComponent, RetentionComponent
+from app.todecode_monitor import create_retention
+
+
+class FakeComponent:
+
+    def __init__(self, name):
+        self.name = name
+        self.alive = False
+        self.starts = 0
+
+    def start(self):
+        self.alive = True
+        self.starts += 1
+
+    def stop(self):
+        self.alive = False
+
+    def is_alive(self):
+        return self.alive
+
+    def stats(self):
+        return {}
+
+
+class TestSupervisor(unittest.TestCase):
+
+    def test_restarts_crashed_component(self):
+        component = FakeComponent("pipeline")
+        supervisor = Supervisor([component], backoff=0)
+        supervisor.start()
+
+        component.alive = False
+        supervisor.check()
+        self.assertTrue(component.alive)
+        self.assertEqual(supervisor.restarts, {"pipeline": 1})
+
+    def test_restart_waits_for_backoff(self):
+        component = FakeComponent("pipeline")
+        healthy = FakeComponent("health")
+        supervisor = Supervisor([component, healthy], backoff=0.1)
+        supervisor.start()
+
+        component.alive = False
+        supervisor.check()
+        self.assertFalse(component.alive)
+        time.sleep(0.15)
+        supervisor.check()
+        self.assertTrue(component.alive)
+
+        # The backoff doubles when the component keeps crashing
+        component.alive = False
+        supervisor.check()
+        time.sleep(0.15)
+        supervisor.check()
+        self.assertFalse(component.alive)
+        time.sleep(0.1)
+        supervisor.check()
+        self.assertTrue(component.alive)
+        self.assertEqual(healthy.starts, 1)
+
+    def test_pipeline_component_watches_every_folder(self):
+        created = []
+
+        class Handler(FileSystemEventHandler):
+            def on_created(self, event):
+                created.append(event.src_path)
+
+        with tempfile.TemporaryDirectory() as folder:
+            first, second = os.path.join(folder, 'first'), os.path.join(folder, 'second')
+            os.makedirs(os.path.join(first, 'nested'))
+            os.makedirs(os.path.join(second, 'nested'))
+            catch_up_backlog = MagicMock()
+            handler = Handler()
+            component = PipelineComponent("folder_monitor", handler, [(first, False), (second, True)], catch_up_backlog)
+            component.start()
+            try:
+                expected = [os.path.join(first, 'a.txt'), os.path.join(second, 'nested', 'b.txt')]
+                for path in expected + [os.path.join(first, 'nested', 'c.txt')]:
+                    open(path, 'w').close()
+                deadline = time.monotonic() + 5
+                while not set(expected) <= set(created) and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                self.assertTrue(set(expected) <= set(created))
+                # Subfolders are only watched where recursive
+                self.assertNotIn(os.path.join(first, 'nested', 'c.txt'), created)
+            finally:
+                component.stop()
+
+            catch_up_backlog.assert_any_call(handler, first)
+            catch_up_backlog.assert_any_call(handler, second, True)
+
+    def test_retention_component(self):
+        with tempfile.TemporaryDirectory() as folder:
+            todecode_folder = os.path.join(folder, 'todecode')
+            output_folder = os.path.join(folder, 'output')
+            os.makedirs(output_folder)
+            old = time.time() - 2 * 3600
+            stale, foreign = os.path.join(output_folder, 'PII_filtered_a.txt.tmp'), os.path.join(output_folder, 'a.tmp')
+            for path in (stale, foreign):
+                open(path, 'w').close()
+                os.utime(path, (old, old))
+
+            engine = create_retention(todecode_folder, output_folder)
+            component = RetentionComponent(RetentionEngine(engine.policies, interval=0.05))
+            supervisor = Supervisor([component], backoff=0)
+            supervisor.start()
+            try:
+                self.assertTrue(component.is_alive())
+                deadline = time.monotonic() + 5
+                while os.path.exists(stale) and time.monotonic() < deadline:
+                    time.sleep(0.05)
+                self.assertFalse(os.path.exists(stale))
+                # Only the service's own temp files are deleted from the output folder
+                self.assertTrue(os.path.exists(foreign))
+            finally:
+                supervisor.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import os
+import sys
+import json
+import subprocess
+import unittest
+
+from app.telemetry import ProcessTelemetry, TelemetryCollector, percentiles
+
+
+class TestTelemetry(unittest.TestCase):
+
+    def test_ring_buffer_is_bounded(self):
+        telemetry = ProcessTelemetry('test', os.getpid(), samples=3)
+        for _ in range(5):
+            telemetry.sample()
+
+        self.assertEqual(len(telemetry.samples), 3)
+        summary = telemetry.summary(0)
+        self.assertEqual(summary["n"], 3)
+        self.assertGreater(summary["rss"]["min"], 0)
+        self.assertGreaterEqual(summary["threads"]["max"], 1)
+        self.assertIn("read_bytes", summary)
+
+    def test_collector_writes_json_lines_with_children(self):
+        lines = []
+        child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)'])
+        try:
+            collector = TelemetryCollector(lines.append, interval=0)
+            collector.sample({'test': os.getpid()})
+            collector.sample({'test': os.getpid()})
+            collector.flush()
+        finally:
+            child.kill()
+            child.wait()
+
+        summaries = {summary["pid"]: summary for summary in map(json.loads, lines)}
+        self.assertEqual(summaries[os.getpid()]["name"], 'test')
+        self.assertEqual(summaries[child.pid]["name"], 'test/worker')
+        self.assertEqual(summaries[child.pid]["n"], 2)
+        self.assertNotIn(" ", lines[0])
+
+    def test_percentiles(self):
+        self.assertEqual(percentiles(list(range(100, 0, -1))), {"min": 1, "p50": 51, "p95": 96, "max": 100})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,15 @@
 import os
+import time
+import shutil
 import unittest
-from unittest.mock import patch
-from queue import Queue
-from app.todecode_monitor import ZipFileHandler
+import pyzipper
+from unittest.mock import patch, MagicMock
+from concurrent.futures import Future, ThreadPoolExecutor
+from app.todecode_monitor import ZipFileHandler, create_executor
+from app.filter_cache import FilterCache
+from app.spool import Spool
+from app.output_writer import OutputWriter
+from app.journal import ProcessedJournal
 
 class TestZipFileHandler(unittest.TestCase):
 
@@ -11,10 +18,11 @@ class TestZipFileHandler(unittest.TestCase):
         self.input_folder = 'test_input'
         os.makedirs(self.output_folder, exist_ok=True)
         os.makedirs(self.input_folder, exist_ok=True)
-        self.processing_queue = Queue()
-        self.handler = ZipFileHandler(self.output_folder, self.input_folder, self.processing_queue)
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.handler = ZipFileHandler(self.output_folder, self.input_folder, self.executor)
 
     def tearDown(self):
+        self.executor.shutdown()
         # Remove files in output folder
         for file in os.listdir(self.output_folder):
             os.remove(os.path.join(self.output_folder, file))
@@ -23,20 +31,19 @@ class TestZipFileHandler(unittest.TestCase):
         os.rmdir(self.output_folder)
         os.rmdir(self.input_folder)
 
-    @patch('app.todecode_monitor.pyzipper.AESZipFile')
-    def test_extract_and_filter(self, mock_zip):
-        zip_file_path = 'test_file.zip'
-        with open(zip_file_path, 'w') as f:
-            f.write("Test content")
+    def test_extract_and_filter(self):
+        zip_file_path = self.create_test_zip()
 
-        self.handler.process_files()  # Simulate file processing
+        self.handler.events.claim(zip_file_path)
+        self.handler.process_files(zip_file_path)
 
-        self.assertTrue(os.path.exists(self.output_folder))
-        os.remove(zip_file_path)
+        self.assertEqual(os.listdir(self.output_folder), ['PII_filtered_notes.txt'])
+        self.assertFalse(os.path.exists(zip_file_path))
+        self.assertEqual(self.handler.events.stats()["in_flight"], 0)
 
     def test_extract_password(self):
         zip_file_name = "Coding Assignment SE_2024_09_23_06_02_04_PM.zip"
-        expected_password = "1695462004"  # This should match the epoch time for the timestamp
+        expected_password = "1727114524"  # This should match the epoch time for the timestamp
         actual_password = self.handler.extract_password(zip_file_name)
         self.assertEqual(actual_password, expected_password)
 
@@ -52,7 +59,201 @@ class TestZipFileHandler(unittest.TestCase):
             self.assertNotIn('john.doe@example.com', content)
             self.assertNotIn('December 25, 1990', content)
 
-        os.remove(test_file)
+        # The unfiltered file does not stay behind
+        self.assertFalse(os.path.exists(test_file))
+
+    def create_test_zip(self, content="Contact: john.doe@example.com", members=('notes.txt',)):
+        epoch_time = 1695462004
+        zip_file_path = os.path.join(self.input_folder, f"notes_{time.strftime('%Y_%m_%d_%I_%M_%S_%p', time.gmtime(epoch_time))}.zip")
+        with pyzipper.AESZipFile(zip_file_path, 'w', compression=pyzipper.ZIP_DEFLATED, encryption=pyzipper.WZ_AES) as zf:
+            zf.setpassword(bytes(str(epoch_time), 'utf-8'))
+            for name in members:
+                zf.writestr(name, content)
+        return zip_file_path
+
+    def test_extract_and_filter_streams_members(self):
+        zip_file_path = self.create_test_zip()
+
+        filtered_files = self.handler.extract_and_filter(zip_file_path)
+
+        self.assertEqual(filtered_files, [os.path.join(self.output_folder, 'PII_filtered_notes.txt')])
+        with open(filtered_files[0], 'r') as f:
+            self.assertEqual(f.read(), "Contact: <email>")
+        # Nothing but the zip itself lands in the input folder
+        self.assertEqual(os.listdir(self.input_folder), [os.path.basename(zip_file_path)])
+
+    def test_submit_to_process_pool(self):
+        zip_file_path = self.create_test_zip()
+
+        with create_executor("process", self.output_folder, self.input_folder) as executor:
+            handler = ZipFileHandler(self.output_folder, self.input_folder, executor)
+            filtered_files = handler.submit(zip_file_path).result()
+
+        self.assertEqual(filtered_files, [os.path.join(self.output_folder, 'PII_filtered_notes.txt')])
+        self.assertFalse(os.path.exists(zip_file_path))
+
+    def test_submit_batch_zip_filters_every_member(self):
+        members = [f'notes_{index}.txt' for index in range(4)]
+        zip_file_path = self.create_test_zip(members=members)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            handler = ZipFileHandler(self.output_folder, self.input_folder, executor)
+            filtered_files = handler.submit(zip_file_path).result()
+
+        self.assertEqual(filtered_files, [os.path.join(self.output_folder, f'PII_filtered_{name}') for name in members])
+        for filtered_file in filtered_files:
+            with open(filtered_file, 'r') as f:
+                self.assertEqual(f.read(), "Contact: <email>")
+        self.assertFalse(os.path.exists(zip_file_path))
+
+    def test_handoff_filters_from_memory(self):
+        zip_file_path = self.create_test_zip()
+        with open(zip_file_path, 'rb') as f:
+            data = f.read()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            handler = ZipFileHandler(self.output_folder, self.input_folder, executor)
+            with patch('app.todecode_monitor.pyzipper.AESZipFile', wraps=pyzipper.AESZipFile) as mock_zip:
+                self.assertTrue(handler.handoff(os.path.basename(zip_file_path), data))
+                executor.shutdown(wait=True)
+            # Only the bytes handed off were opened, never the file
+            self.assertNotIn(zip_file_path, [call.args[0] for call in mock_zip.call_args_list])
+
+        with open(os.path.join(self.output_folder, 'PII_filtered_notes.txt'), 'r') as f:
+            self.assertEqual(f.read(), "Contact: <email>")
+        self.assertFalse(os.path.exists(zip_file_path))
+        self.assertEqual(handler.archives, {})
+
+    def test_handoff_dropped_by_the_queue(self):
+        zip_file_path = self.create_test_zip()
+        with open(zip_file_path, 'rb') as f:
+            data = f.read()
+        names = [f'{index}_{os.path.basename(zip_file_path)}' for index in range(3)]
+        for name in names:
+            shutil.copy(zip_file_path, os.path.join(self.input_folder, name))
+        # Member jobs that never finish, so the first zip holds the only worker
+        executor = MagicMock()
+        executor.submit.return_value = Future()
+        handler = ZipFileHandler(self.output_folder, self.input_folder, executor, debounce=0, workers=1,
+                                 queue_size=1, overflow="drop")
+
+        with patch('app.todecode_monitor.HANDOFF_MEMORY_BYTES', len(data)):
+            self.assertTrue(handler.handoff(names[0], data))
+            self.assertTrue(handler.handoff(names[1], data))
+            # Waiting in the queue with its bytes, which leave no room for more
+            self.assertEqual(handler.archive_bytes, len(data))
+            self.assertFalse(handler.handoff(names[2], data))
+        self.assertEqual(list(handler.archives), [os.path.join(self.input_folder, names[1])])
+        # Already in flight
+        self.assertTrue(handler.handoff(names[0], data))
+
+    def test_cache_hit_skips_the_filter(self):
+        handler = ZipFileHandler(self.output_folder, self.input_folder, self.executor, cache=FilterCache())
+        zip_file_path = self.create_test_zip(members=('first.txt',))
+        handler.extract_and_filter(zip_file_path)
+        os.remove(zip_file_path)
+        zip_file_path = self.create_test_zip(members=('second.txt',))
+
+        with patch.object(handler.pii_engine, 'filter_stream') as mock_filter:
+            filtered_files = handler.extract_and_filter(zip_file_path)
+        mock_filter.assert_not_called()
+
+        self.assertEqual(filtered_files, [os.path.join(self.output_folder, 'PII_filtered_second.txt')])
+        with open(filtered_files[0], 'r') as f:
+            self.assertEqual(f.read(), "Contact: <email>")
+        self.assertEqual(handler.cache_lookups["hit"].value, 1)
+
+    def test_durable_output_removes_zip_once_committed(self):
+        zip_file_path = self.create_test_zip()
+        writer = OutputWriter(interval=0.2)
+        handler = ZipFileHandler(self.output_folder, self.input_folder, self.executor, writer=writer)
+
+        result = handler.submit(zip_file_path)
+        time.sleep(0.1)
+        # Filtered into its temp file, but not committed yet
+        self.assertEqual(os.listdir(self.output_folder), ['PII_filtered_notes.txt.tmp'])
+        self.assertTrue(os.path.exists(zip_file_path))
+
+        self.assertEqual(result.result(timeout=5), [os.path.join(self.output_folder, 'PII_filtered_notes.txt')])
+        self.assertEqual(os.listdir(self.output_folder), ['PII_filtered_notes.txt'])
+        self.assertFalse(os.path.exists(zip_file_path))
+
+    def test_spilled_zip_replayed_after_restart(self):
+        zip_file_path = self.create_test_zip()
+        spill_path = os.path.join(self.input_folder, 'test.spill')
+        # Left over by a previous run
+        with open(spill_path, 'w') as f:
+            f.write(f"{time.time()}\t{zip_file_path}\n")
+
+        with patch('app.todecode_monitor.SPILL_FILE', spill_path):
+            handler = ZipFileHandler(self.output_folder, self.input_folder, self.executor, overflow="spill")
+        deadline = time.monotonic() + 5
+        while os.path.exists(zip_file_path) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        with open(os.path.join(self.output_folder, 'PII_filtered_notes.txt'), 'r') as f:
+            self.assertEqual(f.read(), "Contact: <email>")
+        self.assertFalse(os.path.exists(zip_file_path))
+        self.assertEqual(handler.admission.stats()["counters"]["replayed"], 1)
+        # Claimed through the event registry, so a later event for it is suppressed
+        self.assertFalse(handler.events.ready(zip_file_path))
+
+    def test_removed_zip_leaves_no_journal_entry(self):
+        zip_file_path = self.create_test_zip()
+        journal = ProcessedJournal(os.path.join(self.input_folder, 'test.journal'))
+        handler = ZipFileHandler(self.output_folder, self.input_folder, self.executor, debounce=0, journal=journal)
+
+        self.assertTrue(handler.events.ready(zip_file_path))
+        deadline = time.monotonic() + 5
+        while handler.events.stats()["in_flight"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        journal.close()
+
+        self.assertFalse(os.path.exists(zip_file_path))
+        self.assertEqual(len(journal), 0)
+
+    def test_durable_output_in_process_pool(self):
+        zip_file_path = self.create_test_zip()
+
+        with create_executor("process", self.output_folder, self.input_folder) as executor:
+            handler = ZipFileHandler(self.output_folder, self.input_folder, executor, writer=OutputWriter())
+            filtered_files = handler.submit(zip_file_path).result(timeout=30)
+
+        self.assertEqual(os.listdir(self.output_folder), ['PII_filtered_notes.txt'])
+        self.assertEqual(filtered_files, [os.path.join(self.output_folder, 'PII_filtered_notes.txt')])
+        self.assertFalse(os.path.exists(zip_file_path))
+
+    def test_unreadable_zip_moves_to_failed(self):
+        zip_file_path = os.path.join(self.input_folder, 'broken_2023_09_23_09_40_04_AM.zip')
+        with open(zip_file_path, 'w') as f:
+            f.write("Not a zip")
+
+        self.assertEqual(self.handler.submit(zip_file_path).result(timeout=5), [])
+        try:
+            self.assertEqual(os.listdir(os.path.join(self.input_folder, 'failed')), [os.path.basename(zip_file_path)])
+            self.assertFalse(os.path.exists(zip_file_path))
+        finally:
+            shutil.rmtree(os.path.join(self.input_folder, 'failed'))
+
+    def test_spool_mode_claims_and_moves_to_done(self):
+        zip_file_path = self.create_test_zip()
+        spool = Spool(self.input_folder, worker_id='worker_a')
+        handler = ZipFileHandler(self.output_folder, self.input_folder, self.executor, spool=spool)
+        other = ZipFileHandler(self.output_folder, self.input_folder, self.executor,
+                               spool=Spool(self.input_folder, worker_id='worker_b'))
+        try:
+            filtered_files = handler.submit(zip_file_path).result()
+            # Already claimed and processed by the first worker
+            self.assertEqual(other.submit(zip_file_path).result(), [])
+
+            self.assertEqual(filtered_files, [os.path.join(self.output_folder, 'PII_filtered_notes.txt')])
+            self.assertEqual(os.listdir(spool.done_folder), [os.path.basename(zip_file_path)])
+            self.assertEqual(os.listdir(spool.claimed_folder), [])
+            self.assertEqual(handler.events.stats()["in_flight"], 0)
+        finally:
+            for folder in ('claimed', 'done', 'failed'):
+                shutil.rmtree(os.path.join(self.input_folder, folder))
+
 
 if __name__ == '__main__':
     unittest.main()
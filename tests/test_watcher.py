@@ -0,0 +1,128 @@
+import os
+import time
+import errno
+import shutil
+import unittest
+from unittest.mock import patch, MagicMock
+
+from app.watcher import ScandirPoller, FolderWatcher
+
+
+class TestScandirPoller(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = 'test_polled'
+        os.makedirs(self.folder, exist_ok=True)
+        self.handler = MagicMock()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def dispatched(self):
+        return [(type(call.args[0]).__name__, call.args[0].src_path) for call in self.handler.dispatch.call_args_list]
+
+    def write(self, path, content="Test content"):
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_reports_new_and_changed_files(self):
+        existing = os.path.join(self.folder, 'existing.txt')
+        self.write(existing)
+        poller = ScandirPoller()
+        poller.add(self.handler, self.folder)
+        # Files present when the folder is added are only indexed
+        poller.scan()
+        self.assertEqual(self.dispatched(), [])
+
+        new = os.path.join(self.folder, 'new.txt')
+        self.write(new)
+        poller.scan()
+        self.assertEqual(self.dispatched(), [('FileCreatedEvent', new)])
+
+        self.write(existing, "Longer test content")
+        poller.scan(full=True)
+        self.assertEqual(self.dispatched()[1:], [('FileModifiedEvent', existing)])
+
+    def test_recursive(self):
+        poller = ScandirPoller()
+        poller.add(self.handler, self.folder, recursive=True)
+        nested = os.path.join(self.folder, 'a', 'b')
+        os.makedirs(nested)
+        nested_file = os.path.join(nested, 'nested.txt')
+        self.write(nested_file)
+
+        poller.scan()
+        self.assertEqual(self.dispatched(), [('FileCreatedEvent', nested_file)])
+
+        shutil.rmtree(os.path.join(self.folder, 'a'))
+        poller.scan()
+        self.assertEqual(list(poller._folders), [self.folder])
+
+    def test_thread(self):
+        poller = ScandirPoller(interval=0.05)
+        poller.add(self.handler, self.folder)
+        poller.start()
+        try:
+            new = os.path.join(self.folder, 'new.txt')
+            self.write(new)
+            time.sleep(0.3)
+            self.assertEqual(self.dispatched(), [('FileCreatedEvent', new)])
+        finally:
+            poller.stop()
+            poller.join()
+
+
+class TestFolderWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.folders = ['test_watched_a', 'test_watched_b']
+        for folder in self.folders:
+            os.makedirs(folder, exist_ok=True)
+        self.handler = MagicMock()
+
+    def tearDown(self):
+        for folder in self.folders:
+            shutil.rmtree(folder)
+
+    def test_shared_observer(self):
+        watcher = FolderWatcher()
+        for folder in self.folders:
+            watcher.add(self.handler, folder, recursive=True)
+        watcher.start()
+        try:
+            self.assertTrue(watcher.is_alive())
+            self.assertEqual(watcher.stats(), {"folders": 2, "inotify": 2, "polled": 0})
+        finally:
+            watcher.stop()
+            watcher.join()
+
+    def test_falls_back_to_polling_at_watch_limit(self):
+        logger = MagicMock()
+        watcher = FolderWatcher(poll_interval=0.05, logger=logger)
+        watcher.add(self.handler, self.folders[0])
+        with patch.object(watcher.observer, 'schedule', side_effect=OSError(errno.ENOSPC, "inotify watch limit reached")):
+            watcher.add(self.handler, self.folders[1])
+        watcher.start()
+        try:
+            self.assertEqual(watcher.stats(), {"folders": 2, "inotify": 1, "polled": 1})
+            logger.warning.assert_called_once()
+
+            new = os.path.join(self.folders[1], 'new.txt')
+            with open(new, 'w') as f:
+                f.write("Test content")
+            time.sleep(0.3)
+            self.assertIn(os.path.abspath(new), [call.args[0].src_path for call in self.handler.dispatch.call_args_list])
+        finally:
+            watcher.stop()
+            watcher.join()
+
+    def test_other_errors_are_raised(self):
+        watcher = FolderWatcher()
+        watcher.add(self.handler, 'test_missing_folder')
+        with self.assertRaises(FileNotFoundError):
+            watcher.start()
+        watcher.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()